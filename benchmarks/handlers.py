@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+"""
+Measures the throughput and latency of the handlers on synthetic text.
+
+The handlers are driven directly with a fake MMS context and, by default, the tiny test model.
+Results are written as JSON, and can be compared with an earlier run to flag regressions::
+
+    python benchmarks/handlers.py -o new.json --compare old.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from sockeye_serving.default_handler import DefaultHandler
+from sockeye_serving.ko_handler import KoreanHandler
+from sockeye_serving.sockeye_handler import SockeyeHandler
+from sockeye_serving.text_processor import BpeEncoder, DeBPE, Detokenizer, ProcessorChain
+from sockeye_serving.zh_handler import ChineseHandler
+
+HANDLERS = {
+    'en': DefaultHandler,
+    'ko': KoreanHandler,
+    'zh': ChineseHandler,
+}
+
+STAGES = ['unescape', 'tokenize', 'bpe', 'decode', 'debpe', 'detokenize']
+
+# metrics where a larger value is better; for all others a smaller value is better
+HIGHER_IS_BETTER = {'sentences_per_sec', 'tokens_per_sec'}
+
+TEST_MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'tests', 'sockeye_serving', 'resources')
+
+
+class FakeRequestProcessor:
+    def __init__(self):
+        self.status = None
+
+    def report_status(self, code, reason=None):
+        self.status = code, reason
+
+
+class FakeContext:
+    """
+    The parts of an MMS context that the handlers use
+    """
+
+    def __init__(self, model_name: str, model_dir: str, batch_size: int):
+        self.model_name = model_name
+        self.system_properties = {'model_dir': model_dir, 'batch_size': batch_size, 'gpu_id': 0}
+        self.request_processor = FakeRequestProcessor()
+
+
+class StageTimer:
+    """
+    Adds up the time spent in methods of the handler's processors and translator
+    """
+
+    def __init__(self):
+        self.totals = {}  # type: Dict[str, float]
+
+    def wrap(self, obj, method: str, stage: str):
+        """
+        Replaces a method of an object with one that is timed
+
+        :param obj: an object
+        :param method: name of the method
+        :param stage: the stage to add the time to
+        """
+        func = getattr(obj, method)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.totals[stage] = self.totals.get(stage, 0.0) + time.perf_counter() - start
+
+        setattr(obj, method, timed)
+
+    def stages(self) -> Dict[str, float]:
+        res = {stage: self.totals.get(stage, 0.0) for stage in STAGES}
+        # tokenization is timed together with unescaping and normalization
+        res['tokenize'] = max(0.0, self.totals.get('text', 0.0) - res['unescape'])
+        return res
+
+
+def processors(processor) -> List:
+    if isinstance(processor, ProcessorChain):
+        return processor.chain
+    return [processor]
+
+
+def instrument(handler: SockeyeHandler, timer: StageTimer, counts: Dict[str, int]):
+    """
+    Times the stages of an initialized handler and counts the sentences and tokens it translates
+    """
+    for p in processors(handler.preprocessor):
+        if isinstance(p, BpeEncoder):
+            timer.wrap(p, 'run_batch', 'bpe')
+        else:
+            timer.wrap(p, 'unescape', 'unescape')
+            timer.wrap(p, 'run_batch', 'text')
+    for p in processors(handler.postprocessor):
+        if isinstance(p, DeBPE):
+            timer.wrap(p, 'run_batch', 'debpe')
+        elif isinstance(p, Detokenizer):
+            timer.wrap(p, 'run_batch', 'detokenize')
+
+    translate = handler.translator.translate
+
+    def counted(trans_inputs, *args, **kwargs):
+        lengths = [len(i.tokens) for i in trans_inputs]
+        counts['tokens'] += sum(lengths)
+        if lengths:
+            counts['padded_tokens'] += len(lengths) * max(lengths)
+        return translate(trans_inputs, *args, **kwargs)
+
+    handler.translator.translate = counted
+    timer.wrap(handler.translator, 'translate', 'decode')
+
+    make_inputs = handler.make_inputs
+
+    def counted_inputs(req):
+        trans_inputs = make_inputs(req)
+        counts['sentences'] += len(trans_inputs)
+        return trans_inputs
+
+    handler.make_inputs = counted_inputs
+
+
+def random_word(rng: random.Random, lang: str) -> str:
+    if lang == 'ko':
+        return ''.join(chr(rng.randint(0xac00, 0xd7a3)) for _ in range(rng.randint(1, 3)))
+    if lang == 'zh':
+        return ''.join(chr(rng.randint(0x4e00, 0x9fff)) for _ in range(rng.randint(1, 2)))
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(1, 10)))
+
+
+def sentence_length(rng: random.Random, distribution: str) -> int:
+    """
+    Draws a sentence length
+
+    :param distribution: 'fixed:N', 'uniform:MIN:MAX' or 'normal:MEAN:STD'
+    :return: a number of words
+    """
+    kind, *params = distribution.split(':')
+    params = [float(p) for p in params]
+    if kind == 'fixed':
+        return int(params[0])
+    if kind == 'uniform':
+        return rng.randint(int(params[0]), int(params[1]))
+    if kind == 'normal':
+        return max(1, int(round(rng.gauss(params[0], params[1]))))
+    raise ValueError(f'Unknown length distribution {distribution}')
+
+
+def make_corpus(lang: str, num_requests: int, sentences_per_request: int, distribution: str,
+                seed: int) -> List[str]:
+    """
+    Creates synthetic documents
+
+    :return: a list of documents, one per request
+    """
+    rng = random.Random(seed)
+    end = '。' if lang == 'zh' else '.'
+    sep = '' if lang == 'zh' else ' '
+    docs = []
+    for _ in range(num_requests):
+        sentences = []
+        for _ in range(sentences_per_request):
+            words = [random_word(rng, lang) for _ in range(sentence_length(rng, distribution))]
+            sentence = sep.join(words) + end
+            sentences.append(sentence[0].upper() + sentence[1:])
+        docs.append(sep.join(sentences))
+    return docs
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+
+def run_benchmark(lang: str, args) -> Dict:
+    """
+    Translates a synthetic corpus with the handler of a language
+
+    :return: the measurements
+    """
+    model_dir = tempfile.mkdtemp()
+    try:
+        for f in os.listdir(args.model_dir):
+            path = os.path.join(args.model_dir, f)
+            if os.path.isfile(path):
+                shutil.copy(path, model_dir)
+        with open(os.path.join(model_dir, 'serving-args.txt'), 'w') as f:
+            f.write(args.serving_args)
+
+        context = FakeContext(lang, model_dir, args.batch_size)
+        handler = HANDLERS[lang]()
+        handler.initialize(context)
+
+        docs = make_corpus(lang, args.requests, args.sentences, args.lengths, args.seed)
+        batches = [[{'body': doc} for doc in docs[i:i + args.batch_size]]
+                   for i in range(0, len(docs), args.batch_size)]
+
+        for batch in batches[:args.warmup]:
+            handler.handle(batch, context)
+
+        timer = StageTimer()
+        counts = {'sentences': 0, 'tokens': 0, 'padded_tokens': 0}
+        instrument(handler, timer, counts)
+
+        latencies = []
+        start = time.perf_counter()
+        for batch in batches:
+            batch_start = time.perf_counter()
+            reqs = handler.handle(batch, context)
+            latencies.append(time.perf_counter() - batch_start)
+            if context.request_processor.status is not None:
+                raise RuntimeError(f'{lang} handler failed: {reqs}')
+        elapsed = time.perf_counter() - start
+
+        return {
+            'batches': len(batches),
+            'sentences': counts['sentences'],
+            'tokens': counts['tokens'],
+            'elapsed_sec': elapsed,
+            'sentences_per_sec': counts['sentences'] / elapsed,
+            'tokens_per_sec': counts['tokens'] / elapsed,
+            'padding_ratio': 1 - counts['tokens'] / counts['padded_tokens'] if counts['padded_tokens'] else 0.0,
+            'latency_p50_ms': percentile(latencies, 50) * 1000,
+            'latency_p95_ms': percentile(latencies, 95) * 1000,
+            'latency_p99_ms': percentile(latencies, 99) * 1000,
+            'stages_sec': timer.stages(),
+        }
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Compares results with an earlier run
+
+    :param threshold: the relative change that counts as a regression
+    :return: a description of each regression
+    """
+    regressions = []
+    for lang, metrics in results['handlers'].items():
+        old = baseline.get('handlers', {}).get(lang)
+        if not old:
+            continue
+        for metric in ['sentences_per_sec', 'tokens_per_sec', 'latency_p50_ms', 'latency_p95_ms', 'latency_p99_ms']:
+            if not old.get(metric):
+                continue
+            change = (metrics[metric] - old[metric]) / old[metric]
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > threshold:
+                regressions.append(f'{lang} {metric}: {old[metric]:.2f} -> {metrics[metric]:.2f}')
+    return regressions
+
+
+def main():
+    params = argparse.ArgumentParser(description='Benchmark the sockeye-serving handlers')
+    params.add_argument('-l', '--langs', nargs='+', choices=sorted(HANDLERS), default=sorted(HANDLERS),
+                        help='handlers to run, by language')
+    params.add_argument('-m', '--model-dir', default=TEST_MODEL, help='model directory')
+    params.add_argument('-s', '--serving-args', default='--cache-size 0',
+                        help='contents of serving-args.txt; the translation cache is disabled by default')
+    params.add_argument('-r', '--requests', type=int, default=200, help='number of requests')
+    params.add_argument('-n', '--sentences', type=int, default=5, help='sentences per request')
+    params.add_argument('-b', '--batch-size', type=int, default=8, help='requests per MMS batch')
+    params.add_argument('--lengths', default='normal:15:8',
+                        help="sentence length distribution in words: 'fixed:N', 'uniform:MIN:MAX' or "
+                             "'normal:MEAN:STD'")
+    params.add_argument('--warmup', type=int, default=2, help='number of batches to run before measuring')
+    params.add_argument('--seed', type=int, default=1, help='random seed of the corpus')
+    params.add_argument('-o', '--output', help='file to save the results to as JSON')
+    params.add_argument('-c', '--compare', help='results of an earlier run to compare with')
+    params.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='relative change of a metric that is reported as a regression')
+    args = params.parse_args()
+
+    results = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'timestamp': time.time(),
+        'handlers': {lang: run_benchmark(lang, args) for lang in args.langs},
+    }
+
+    for lang, metrics in results['handlers'].items():
+        stages = ', '.join(f'{stage} {sec:.3f}s' for stage, sec in metrics['stages_sec'].items())
+        print(f"{lang}: {metrics['sentences_per_sec']:.1f} sentences/s, {metrics['tokens_per_sec']:.1f} tokens/s, "
+              f"p50/p95/p99 {metrics['latency_p50_ms']:.1f}/{metrics['latency_p95_ms']:.1f}/"
+              f"{metrics['latency_p99_ms']:.1f} ms")
+        print(f'    {stages}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for r in regressions:
+            print(f'REGRESSION {r}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Measures the speed and BLEU of vocabulary-restricted decoding with the top-k lexicon of a model (``lexicon.npy``)
+at different values of k, compared with decoding over the full target vocabulary.
+
+Each k is run in a separate process::
+
+    python benchmarks/lexicon.py -l zh -m /tmp/models/zh -i test.zh -r test.en -k 50 100 200 500
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+from sockeye.evaluate import raw_corpus_bleu
+from sockeye_serving.lexicon import LEXICON_FILE
+
+from handlers import HANDLERS
+from precision import translate_file
+
+
+def main():
+    params = argparse.ArgumentParser(description='Compare vocabulary-restricted decoding at different values of k')
+    params.add_argument('-l', '--lang', choices=sorted(HANDLERS), required=True, help='handler to run, by language')
+    params.add_argument('-m', '--model-dir', required=True, help=f'model directory with a {LEXICON_FILE}')
+    params.add_argument('-i', '--input', required=True, help='held-out source sentences, one per line')
+    params.add_argument('-r', '--references', help='reference translations; without them, BLEU is computed against '
+                                                   'the unrestricted translations')
+    params.add_argument('-k', nargs='+', type=int, default=[50, 100, 200, 500],
+                        help='numbers of target words per source word to compare')
+    params.add_argument('-b', '--batch-size', type=int, default=8, help='requests per MMS batch')
+    params.add_argument('-t', '--max-drift', type=float, default=None,
+                        help='largest acceptable BLEU drift; a larger drift makes the script exit with status 1')
+    params.add_argument('-o', '--output', help='file to save the results to as JSON')
+    args = params.parse_args()
+
+    if not os.path.isfile(os.path.join(args.model_dir, LEXICON_FILE)):
+        params.error(f'{LEXICON_FILE} not found in {args.model_dir}; build it with python -m sockeye_serving.lexicon')
+
+    with open(args.input, encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+    references = None
+    if args.references:
+        with open(args.references, encoding='utf-8') as f:
+            references = [line.strip() for line in f]
+
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    configs = [('full', '--no-lexicon')] + [(f'k={k}', f'--lexicon-topk {k}') for k in sorted(args.k)]
+    for name, serving_args in configs:
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(translate_file, (args.lang, args.model_dir, serving_args, lines,
+                                                        args.batch_size))
+
+    baseline = results['full']
+    failed = False
+    for name, res in results.items():
+        res['speedup'] = baseline['cpu_ms_per_sentence'] / res['cpu_ms_per_sentence']
+        res['bleu_vs_full'] = 100 * raw_corpus_bleu(res['translations'], baseline['translations'])
+        if references:
+            res['bleu'] = 100 * raw_corpus_bleu(res['translations'], references)
+            res['bleu_drift'] = baseline['bleu'] - res['bleu']
+        else:
+            res['bleu_drift'] = 100 - res['bleu_vs_full']
+
+        bleu = f"BLEU {res['bleu']:.2f}, " if references else ''
+        print(f"{name}: {bleu}BLEU drift {res['bleu_drift']:.2f}, {res['cpu_ms_per_sentence']:.1f} CPU ms/sentence, "
+              f"{res['speedup']:.2f}x")
+        if args.max_drift is not None and res['bleu_drift'] > args.max_drift:
+            print(f'DRIFT {name}: {res["bleu_drift"]:.2f} > {args.max_drift:.2f}')
+            failed = True
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
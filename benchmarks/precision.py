@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Measures how a reduced-precision model compares with float32: the BLEU drift on a held-out test file,
+CPU time per sentence and peak memory of the worker. The data type is set with ``--override-dtype`` of Sockeye.
+float16 is meant for GPUs, and is usually slower than float32 with MXNet on CPUs.
+
+Each data type is run in a separate process, so that its memory use is measured on its own::
+
+    python benchmarks/precision.py -l zh -m /tmp/models/zh -i test.zh -r test.en --max-drift 0.5
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from sockeye.evaluate import raw_corpus_bleu
+
+from handlers import HANDLERS, FakeContext
+
+DTYPES = ['float32', 'float16']
+
+
+def translate_file(lang: str, model_dir: str, serving_args: str, lines: List[str], batch_size: int,
+                   sockeye_args: str = '') -> Dict:
+    """
+    Translates a test file with a copy of the model directory that has the given handler options and further
+    Sockeye arguments. Sentences that fail get an empty translation, and are counted as errors.
+
+    :return: the translations and measurements
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for f in os.listdir(model_dir):
+            path = os.path.join(model_dir, f)
+            if os.path.isfile(path):
+                shutil.copy(path, tmp_dir)
+        with open(os.path.join(tmp_dir, 'serving-args.txt'), 'w') as f:
+            f.write(f'--cache-size 0\n{serving_args}')
+        if sockeye_args:
+            with open(os.path.join(tmp_dir, 'sockeye-args.txt'), 'a') as f:
+                f.write(f'\n{sockeye_args}\n')
+
+        context = FakeContext(lang, tmp_dir, batch_size)
+        handler = HANDLERS[lang]()
+        handler.handle(None, context)
+
+        translations = []
+        errors = []
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        for i in range(0, len(lines), batch_size):
+            batch = lines[i:i + batch_size]
+            context.request_processor.status = None
+            responses = handler.handle([{'body': line} for line in batch], context)
+            for r in responses[:len(batch)]:
+                # a request that the handler rejects, or a batch that fails, gets error messages instead of responses
+                if isinstance(r, dict):
+                    translations.append(r['translation'])
+                else:
+                    translations.append('')
+                    errors.append(r)
+        cpu = time.process_time() - cpu_start
+        if errors:
+            print(f'{len(errors)} of {len(lines)} sentences failed with {serving_args} {sockeye_args}: {errors[0]}',
+                  file=sys.stderr)
+
+        return {
+            'translations': translations,
+            'errors': len(errors),
+            'elapsed_sec': time.perf_counter() - start,
+            'cpu_ms_per_sentence': cpu * 1000 / len(lines),
+            # kilobytes on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    params = argparse.ArgumentParser(description='Compare reduced-precision models with float32')
+    params.add_argument('-l', '--lang', choices=sorted(HANDLERS), required=True, help='handler to run, by language')
+    params.add_argument('-m', '--model-dir', required=True, help='model directory')
+    params.add_argument('-i', '--input', required=True, help='held-out source sentences, one per line')
+    params.add_argument('-r', '--references', help='reference translations; without them, BLEU is computed against '
+                                                   'the float32 translations')
+    params.add_argument('-d', '--dtypes', nargs='+', choices=DTYPES, default=['float16'],
+                        help='data types to compare with float32')
+    params.add_argument('-b', '--batch-size', type=int, default=8, help='requests per MMS batch')
+    params.add_argument('-t', '--max-drift', type=float, default=None,
+                        help='largest acceptable BLEU drift; a larger drift makes the script exit with status 1')
+    params.add_argument('-o', '--output', help='file to save the results to as JSON')
+    args = params.parse_args()
+
+    with open(args.input, encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+    references = None
+    if args.references:
+        with open(args.references, encoding='utf-8') as f:
+            references = [line.strip() for line in f]
+
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for dtype in ['float32'] + [d for d in args.dtypes if d != 'float32']:
+        with ctx.Pool(1) as pool:
+            results[dtype] = pool.apply(translate_file, (args.lang, args.model_dir, '', lines, args.batch_size,
+                                                         f'--override-dtype {dtype}'))
+
+    baseline = results['float32']
+    failed = False
+    for dtype, res in results.items():
+        res['bleu_vs_float32'] = 100 * raw_corpus_bleu(res['translations'], baseline['translations'])
+        if references:
+            res['bleu'] = 100 * raw_corpus_bleu(res['translations'], references)
+            res['bleu_drift'] = baseline['bleu'] - res['bleu']
+        else:
+            res['bleu_drift'] = 100 - res['bleu_vs_float32']
+
+        print(f"{dtype}: BLEU drift {res['bleu_drift']:.2f}, {res['bleu_vs_float32']:.2f} BLEU against float32, "
+              f"{res['cpu_ms_per_sentence']:.1f} CPU ms/sentence, peak RSS {res['peak_rss_mb']:.0f} MB, "
+              f"{res['errors']} failed sentences")
+        if args.max_drift is not None and res['bleu_drift'] > args.max_drift:
+            print(f'DRIFT {dtype}: {res["bleu_drift"]:.2f} > {args.max_drift:.2f}')
+            failed = True
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
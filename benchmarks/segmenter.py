@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Compares word segmentation with a dictionary against the per-character tokenization of the Chinese and Korean
+preprocessors: characters per second, tokens per sentence and, given a model trained on each, decoding speed::
+
+    python benchmarks/segmenter.py -l zh -d dict.txt -i test.zh
+    python benchmarks/segmenter.py -l zh -d dict.txt -i test.zh --char-model zh --word-model zh-words
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from typing import Dict, List
+
+from sockeye_serving.ko_handler import KoreanPreprocessor
+from sockeye_serving.utils import SCRIPTS_PATH
+from sockeye_serving.word_segmenter import MAX_MATCH, VITERBI, WordSegmenter, WordTrie, build_trie, read_dictionary
+from sockeye_serving.zh_handler import ChinesePreprocessor
+
+from precision import translate_file
+
+PREPROCESSORS = {
+    'ko': KoreanPreprocessor,
+    'zh': ChinesePreprocessor,
+}
+
+
+def tokenize(preprocessor, lines: List[str]) -> Dict:
+    """
+    Tokenizes sentences one at a time, like a handler without the cache of ``run_batch``
+    """
+    start = time.perf_counter()
+    tokens = sum(len(preprocessor.run(line).split()) for line in lines)
+    elapsed = time.perf_counter() - start
+    return {
+        'chars_per_sec': sum(len(line) for line in lines) / elapsed,
+        'tokens_per_sentence': tokens / len(lines),
+    }
+
+
+def main():
+    params = argparse.ArgumentParser(description='Compare dictionary word segmentation with characters')
+    params.add_argument('-l', '--lang', choices=sorted(PREPROCESSORS), required=True, help='preprocessor to run')
+    params.add_argument('-d', '--dictionary', required=True, help='dictionary with a word and a frequency per line')
+    params.add_argument('-i', '--input', required=True, help='sentences, one per line')
+    params.add_argument('--char-model', help='model directory of a model trained on characters')
+    params.add_argument('--word-model', help='model directory of a model trained on words from the dictionary')
+    params.add_argument('-b', '--batch-size', type=int, default=8, help='requests per MMS batch')
+    params.add_argument('-o', '--output', help='file to save the results to as JSON')
+    args = params.parse_args()
+
+    with open(args.input, encoding='utf-8') as f:
+        lines = [line.strip() for line in f if line.strip()]
+
+    start = time.perf_counter()
+    trie = WordTrie(build_trie(read_dictionary(args.dictionary)))
+    results = {'build_sec': time.perf_counter() - start}
+
+    preprocessor = PREPROCESSORS[args.lang]
+    results['chars'] = tokenize(preprocessor(SCRIPTS_PATH), lines)
+    for method in [VITERBI, MAX_MATCH]:
+        results[method] = tokenize(preprocessor(SCRIPTS_PATH, WordSegmenter(trie, method)), lines)
+    for name in ['chars', VITERBI, MAX_MATCH]:
+        res = results[name]
+        print(f"{name}: {res['chars_per_sec']:.0f} chars/s, {res['tokens_per_sentence']:.1f} tokens/sentence")
+
+    if args.char_model and args.word_model:
+        ctx = multiprocessing.get_context('spawn')
+        word_args = f'--word-dict {os.path.abspath(args.dictionary)}'
+        for name, model_dir, serving_args in [('decode_chars', args.char_model, ''),
+                                              ('decode_words', args.word_model, word_args)]:
+            with ctx.Pool(1) as pool:
+                res = pool.apply(translate_file, (args.lang, model_dir, serving_args, lines, args.batch_size))
+            res.pop('translations')
+            results[name] = res
+        speedup = results['decode_chars']['cpu_ms_per_sentence'] / results['decode_words']['cpu_ms_per_sentence']
+        results['decode_speedup'] = speedup
+        print(f"decoding: {results['decode_chars']['cpu_ms_per_sentence']:.1f} CPU ms/sentence with characters, "
+              f"{results['decode_words']['cpu_ms_per_sentence']:.1f} with words, {speedup:.2f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Measures how long it takes to build a translation memory and to look up sentences in it, with a synthetic corpus of
+templates that differ in numbers and names, or with sentence pairs from files::
+
+    python benchmarks/translation_memory.py -n 1000000
+    python benchmarks/translation_memory.py -p lexicon-*.tsv -i test.tok.bpe.zh
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from typing import List, Tuple
+
+from sockeye_serving.translation_memory import MinHasher, TranslationMemory, build_memory, read_pairs, repair
+
+from handlers import percentile
+
+TEMPLATES = [
+    ('your order {n} has shipped to {name} .', 'votre commande {n} a été expédiée à {name} .'),
+    ('{name} sent you {n} new messages .', '{name} vous a envoyé {n} nouveaux messages .'),
+    ('the meeting with {name} starts at {n} .', 'la réunion avec {name} commence à {n} .'),
+    ('invoice {n} for {name} is overdue by {m} days .', 'la facture {n} de {name} est en retard de {m} jours .'),
+]
+WORDS = 'the a of to in is was for on that with as by at from this have not are be it his they or had'.split()
+
+
+def make_corpus(size: int, seed: int) -> List[Tuple[List[str], List[str], float]]:
+    """
+    Creates sentence pairs from templates, and random sentences that are rarely similar to each other
+    """
+    rand = random.Random(seed)
+    pairs = []
+    for i in range(size):
+        if i % 2:
+            source = [rand.choice(WORDS) + str(rand.randrange(1000)) for _ in range(rand.randint(5, 25))]
+            pairs.append((source, source[::-1], 0.0))
+        else:
+            source, target = rand.choice(TEMPLATES)
+            fields = dict(n=i, m=rand.randrange(100), name=f'user{rand.randrange(size)}')
+            pairs.append((source.format(**fields).split(), target.format(**fields).split(), 0.0))
+    return pairs
+
+
+def make_queries(pairs, count: int, seed: int) -> List[List[str]]:
+    """
+    Creates near-duplicates of sentences of the corpus, with one token changed, and as many new sentences
+    """
+    rand = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        source = list(rand.choice(pairs)[0])
+        source[rand.randrange(len(source))] = str(rand.randrange(10 ** 6))
+        queries.append(source)
+        queries.append([rand.choice(WORDS) for _ in range(rand.randint(5, 25))])
+    return queries
+
+
+def main():
+    params = argparse.ArgumentParser(description='Benchmark building and querying a translation memory')
+    params.add_argument('-n', '--size', type=int, default=1000000, help='number of synthetic sentence pairs')
+    params.add_argument('-p', '--pairs', nargs='+', help='files of sentence pairs to use instead, separated by tabs')
+    params.add_argument('-i', '--input', help='preprocessed sentences to look up, one per line; by default, '
+                                              'near-duplicates of the sentence pairs and as many new sentences')
+    params.add_argument('-q', '--queries', type=int, default=1000, help='number of near-duplicates to look up')
+    params.add_argument('-t', '--threshold', type=float, default=0.8, help='minimum similarity')
+    params.add_argument('--seed', type=int, default=1, help='seed of the synthetic data')
+    params.add_argument('-o', '--output', help='file to save the results to as JSON')
+    args = params.parse_args()
+
+    pairs = list(read_pairs(args.pairs)) if args.pairs else make_corpus(args.size, args.seed)
+    if args.input:
+        with open(args.input, encoding='utf-8') as f:
+            queries = [line.split() for line in f if line.strip()]
+    else:
+        queries = make_queries(pairs, args.queries, args.seed)
+
+    results = {'entries': len(pairs)}
+    fd, path = tempfile.mkstemp(suffix='.tm')
+    try:
+        start = time.perf_counter()
+        data = build_memory(pairs, MinHasher())
+        results['build_sec'] = time.perf_counter() - start
+        results['file_mb'] = len(data) / 2 ** 20
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        del data, pairs
+
+        # kilobytes on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        start = time.perf_counter()
+        memory = TranslationMemory.load(path, threshold=args.threshold)
+        results['load_ms'] = (time.perf_counter() - start) * 1000
+
+        latencies = []
+        hits = 0
+        adapted = 0
+        for tokens in queries:
+            start = time.perf_counter()
+            match = memory.lookup(tokens)
+            if match is not None:
+                hits += 1
+                adapted += repair(tokens, match[0], match[1])[0] is not None
+            latencies.append(time.perf_counter() - start)
+        results.update({
+            'queries': len(queries),
+            'hit_rate': hits / len(queries),
+            'adapted_rate': adapted / len(queries),
+            'lookup_p50_ms': percentile(latencies, 50) * 1000,
+            'lookup_p95_ms': percentile(latencies, 95) * 1000,
+            'lookup_p99_ms': percentile(latencies, 99) * 1000,
+            'lookups_per_sec': len(queries) / sum(latencies),
+            'peak_rss_mb': rss,
+        })
+    finally:
+        os.remove(path)
+
+    print(f"{results['entries']} entries: built in {results['build_sec']:.1f}s, {results['file_mb']:.0f} MB, "
+          f"loaded in {results['load_ms']:.1f} ms")
+    print(f"{results['queries']} lookups: {results['hit_rate']:.1%} hits, {results['adapted_rate']:.1%} adapted, "
+          f"p50/p95/p99 {results['lookup_p50_ms']:.2f}/{results['lookup_p95_ms']:.2f}/"
+          f"{results['lookup_p99_ms']:.2f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
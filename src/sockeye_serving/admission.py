@@ -0,0 +1,80 @@
+from typing import List, Optional, Tuple
+
+# upper bounds of the buckets of the request cost histogram
+COST_BUCKETS = [10 * 4 ** i for i in range(10)]
+
+# decisions about a request
+ADMIT = 'admit'
+DOWNGRADE = 'downgrade'
+REJECT = 'reject'
+SHED = 'shed'
+
+# HTTP statuses of requests that are not admitted
+REJECT_STATUS = 413
+SHED_STATUS = 503
+
+
+class AdmissionControl:
+    """
+    Estimates the decoding cost of requests and admits them within a per-request and a per-batch budget.
+    The cost of a request is its number of source tokens times the beam size, times one plus its number of constraints,
+    since every constraint adds a bank of hypotheses that beam search has to track.
+    Requests are admitted in order; one that exceeds a budget is downgraded to a smaller beam if that is allowed
+    and makes it fit, and is otherwise rejected if it exceeds the per-request budget or shed if the batch is full.
+    """
+
+    def __init__(self, request_budget: int = 0, batch_budget: int = 0, downgrade_beam_size: Optional[int] = None):
+        """
+        :param request_budget: maximum cost of a request; 0 means no limit
+        :param batch_budget: maximum cost of all admitted requests of a batch; 0 means no limit
+        :param downgrade_beam_size: beam size that requests over budget are downgraded to, or None to reject them
+        """
+        self.request_budget = request_budget
+        self.batch_budget = batch_budget
+        self.downgrade_beam_size = downgrade_beam_size
+
+    @staticmethod
+    def cost(tokens: int, constraints: int, beam_size: int) -> int:
+        """
+        Estimates the cost of decoding a request
+
+        :param tokens: number of source tokens
+        :param constraints: number of constraints
+        :param beam_size: beam size the request is decoded with
+        """
+        return tokens * beam_size * (1 + constraints)
+
+    def over_budget(self, cost: int, batch_cost: int) -> Optional[str]:
+        """
+        Checks a cost against the budgets
+
+        :param cost: cost of a request
+        :param batch_cost: cost of the requests that are already admitted
+        :return: REJECT or SHED if the request doesn't fit, otherwise None
+        """
+        if self.request_budget and cost > self.request_budget:
+            return REJECT
+        if self.batch_budget and batch_cost + cost > self.batch_budget:
+            return SHED
+        return None
+
+    def admit(self, requests: List[Tuple[int, int, int]]) -> List[Tuple[str, int]]:
+        """
+        Decides which requests of a batch to decode
+
+        :param requests: the number of source tokens, number of constraints and beam size of each request
+        :return: the decision and cost of each request, where the cost is for the downgraded beam size if downgraded
+        """
+        decisions = []
+        batch_cost = 0
+        for tokens, constraints, beam_size in requests:
+            cost = self.cost(tokens, constraints, beam_size)
+            decision = self.over_budget(cost, batch_cost)
+            if decision is not None and self.downgrade_beam_size is not None and self.downgrade_beam_size < beam_size:
+                cheaper = self.cost(tokens, constraints, self.downgrade_beam_size)
+                if self.over_budget(cheaper, batch_cost) is None:
+                    decision, cost = DOWNGRADE, cheaper
+            if decision in (None, DOWNGRADE):
+                batch_cost += cost
+            decisions.append((decision or ADMIT, cost))
+        return decisions
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+from typing import Any, Callable, List
+
+# directory in the model directory that holds artifacts built from the model's files
+ARTIFACTS_DIR = '.sockeye-serving'
+
+
+def artifact_path(artifacts_dir: str, name: str, sources: List[str], ext: str, **params) -> str:
+    """
+    Returns the path of an artifact built from source files.
+    The name includes a digest of the sources' paths, sizes and modification times and of the build parameters,
+    so that a changed source or parameter yields a new artifact.
+
+    :param artifacts_dir: directory that holds the artifacts
+    :param name: artifact name
+    :param sources: the files the artifact is built from
+    :param ext: file extension
+    :param params: build parameters
+    :return: a file path
+    """
+    stamps = []
+    for source in sources:
+        stat = os.stat(source)
+        stamps.append([os.path.abspath(source), stat.st_size, stat.st_mtime_ns])
+    data = json.dumps([stamps, params], sort_keys=True, default=str)
+    digest = hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(artifacts_dir, f'{name}-{digest}.{ext}')
+
+
+def save_atomic(path: str, write: Callable[[Any], None]):
+    """
+    Writes a file through a temporary file, so that other workers never read a partial artifact.
+    An unwritable directory only logs a warning, since artifacts just speed up later starts.
+
+    :param path: file path
+    :param write: function that writes the contents to a binary file object
+    """
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logging.warning(f'Could not save {path}: {e}')
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def load_pickle(path: str) -> Any:
+    """
+    Loads a pickled artifact through a memory map
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        return pickle.loads(m)
+
+
+def cached_pickle(path: str, build: Callable[[], Any]) -> Any:
+    """
+    Loads a pickled artifact, or builds and saves it if it does not exist
+
+    :param path: artifact path
+    :param build: function that builds the artifact
+    :return: the artifact
+    """
+    if os.path.isfile(path):
+        try:
+            return load_pickle(path)
+        except Exception as e:
+            logging.warning(f'Could not load {path}, rebuilding it: {e}')
+
+    obj = build()
+    save_atomic(path, lambda f: pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL))
+    return obj
@@ -0,0 +1,234 @@
+"""
+Translates large files offline with the preprocessing, translation and postprocessing of a handler.
+
+The input file is memory-mapped and split into shards of whole lines, which are translated by worker processes that
+each load the model. The translations are written in the order of the input, one line per input line, and a checkpoint
+is saved after every shard, so that a job that is interrupted resumes after the last shard that was written::
+
+    python -m sockeye_serving.bulk /tmp/models/zh zh_handler input.zh output.en --workers 4
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from .utils import encode_json, iter_lines
+
+# the state of a worker process
+_worker = {}  # type: Dict
+
+
+class BulkRequestProcessor:
+    def __init__(self):
+        self.status = None
+
+    def report_status(self, code, reason=None):
+        self.status = code, reason
+
+
+class BulkContext:
+    """
+    The parts of an MMS context that the handlers use, with a status for every request of a batch
+    """
+
+    def __init__(self, model_name: str, model_dir: str, batch_size: int, gpu_id: int = 0):
+        self.model_name = model_name
+        self.system_properties = {'model_dir': model_dir, 'batch_size': batch_size, 'gpu_id': gpu_id}
+        self.request_processor = BulkRequestProcessor()
+        self.statuses = {}  # type: Dict[int, Tuple[int, str]]
+
+    def set_response_status(self, code, reason, idx):
+        self.statuses[idx] = code, reason
+
+    def reset(self):
+        """
+        Clears the statuses of the previous batch
+        """
+        self.request_processor.status = None
+        self.statuses = {}
+
+
+def shards(data, shard_bytes: int, start: int = 0) -> Iterator[Tuple[int, int]]:
+    """
+    Splits a file into shards of whole lines of at least ``shard_bytes`` bytes
+
+    :param data: the contents of the file, e.g. a memory map
+    :param shard_bytes: minimum size of a shard
+    :param start: the offset to start from, which must be the start of a line
+    :return: an iterator over the start and end offset of every shard, without the final line break
+    """
+    size = len(data)
+    if not size:
+        return
+    # a line break at the end of the file does not start another line
+    if data[size - 1:size] == b'\n':
+        size -= 1
+    while start <= size:
+        end = data.find(b'\n', start + shard_bytes, size) if start + shard_bytes < size else -1
+        if end < 0:
+            end = size
+        yield start, end
+        start = end + 1
+
+
+def read_checkpoint(path: str) -> Optional[Dict]:
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(path: str, checkpoint: Dict):
+    """
+    Replaces a checkpoint atomically
+    """
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _init_worker(model_dir: str, handler: str, lang: str, batch_size: int, input_path: str, output_json: bool):
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        module = importlib.import_module(handler if '.' in handler else f'sockeye_serving.{handler}')
+        context = BulkContext(lang, model_dir, batch_size)
+        module._service.handle(None, context)
+    except Exception as e:
+        # a pool replaces workers that fail to start forever, so the error is raised by the first shard instead
+        logging.error(e, exc_info=True)
+        _worker['error'] = e
+        return
+
+    f = open(input_path, 'rb')
+    _worker.update(handler=module._service, context=context, batch_size=batch_size, output_json=output_json,
+                   data=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _translate_shard(shard: Tuple[int, int]) -> Tuple[int, bytes]:
+    """
+    Translates the lines of a shard. Blank lines are not translated, and lines that the handler rejects get an
+    ``{"error": ...}`` line.
+
+    :param shard: the start and end offset of the shard
+    :return: the number of lines and the encoded output
+    """
+    if 'error' in _worker:
+        raise _worker['error']
+    handler = _worker['handler']
+    context = _worker['context']
+    batch_size = _worker['batch_size']
+
+    lines = list(iter_lines(_worker['data'][shard[0]:shard[1]]))
+    text = [(i, line) for i, line in enumerate(lines) if line.strip()]
+    out = [b''] * len(lines)
+    # compact responses unless the full response is written
+    fields = {} if _worker['output_json'] else {'fields': ['translation']}
+
+    for start in range(0, len(text), batch_size):
+        batch = text[start:start + batch_size]
+        context.reset()
+        responses = handler.handle([{'body': dict(fields, text=line)} for _, line in batch], context)
+        if context.request_processor.status is not None:
+            raise RuntimeError(f'Translation failed: {responses[0]}')
+        for j, ((i, _), response) in enumerate(zip(batch, responses)):
+            if j in context.statuses:
+                out[i] = encode_json({'error': context.statuses[j][1]})
+            elif _worker['output_json']:
+                out[i] = encode_json(response)
+            else:
+                out[i] = response['translation'].encode('utf-8')
+
+    return len(lines), b''.join(line + b'\n' for line in out)
+
+
+def translate_file(args):
+    """
+    Translates a file with worker processes, resuming from the checkpoint of an earlier run if there is one
+    """
+    checkpoint_path = f'{args.output}.checkpoint'
+    stat = os.stat(args.input)
+    job = {'input': os.path.abspath(args.input), 'input_size': stat.st_size, 'input_mtime': stat.st_mtime,
+           'shard_bytes': args.shard_bytes, 'model_dir': os.path.abspath(args.model_dir), 'json': args.json}
+
+    checkpoint = read_checkpoint(checkpoint_path)
+    if checkpoint is not None and {k: checkpoint.get(k) for k in job} != job:
+        raise ValueError(f'{checkpoint_path} belongs to another job; remove it to start over')
+    if checkpoint is None or not os.path.isfile(args.output):
+        checkpoint = dict(job, input_offset=0, output_offset=0, lines=0)
+        open(args.output, 'wb').close()
+    elif checkpoint['input_offset']:
+        logging.info(f'Resuming after line {checkpoint["lines"]}')
+
+    with open(args.input, 'rb') as f, open(args.output, 'r+b') as out:
+        # discard output written after the last checkpoint
+        out.truncate(checkpoint['output_offset'])
+        out.seek(checkpoint['output_offset'])
+        if not stat.st_size:
+            write_checkpoint(checkpoint_path, checkpoint)
+            return checkpoint
+
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        ctx = multiprocessing.get_context('spawn')
+        init_args = (args.model_dir, args.handler, args.lang or os.path.basename(os.path.normpath(args.model_dir)),
+                     args.batch_size, args.input, args.json)
+
+        todo = list(shards(data, args.shard_bytes, checkpoint['input_offset']))
+        if not todo:
+            # every shard is translated, so no worker needs to load the model
+            data.close()
+            return checkpoint
+        start = time.perf_counter()
+        lines = 0
+        with ctx.Pool(min(args.workers, len(todo)), initializer=_init_worker, initargs=init_args) as pool:
+            for (_, end), (num_lines, output) in zip(todo, pool.imap(_translate_shard, todo)):
+                out.write(output)
+                out.flush()
+                os.fsync(out.fileno())
+                lines += num_lines
+                checkpoint.update(input_offset=end + 1, output_offset=out.tell(), lines=checkpoint['lines'] + num_lines)
+                write_checkpoint(checkpoint_path, checkpoint)
+
+                elapsed = time.perf_counter() - start
+                logging.info(f'{checkpoint["lines"]} lines, {100 * min(end + 1, stat.st_size) / stat.st_size:.1f}% '
+                             f'of the input, {lines / elapsed:.1f} lines/s')
+        data.close()
+
+    return checkpoint
+
+
+def main():
+    params = argparse.ArgumentParser(description='Translate a large file offline with a sockeye-serving handler')
+    params.add_argument('model_dir', help='model directory')
+    params.add_argument('handler', help='handler module, e.g. default_handler, ko_handler or zh_handler, '
+                                        'or the full name of a module with a _service handler')
+    params.add_argument('input', help='file to translate, one sentence or paragraph per line')
+    params.add_argument('output', help='file to write the translations to, one per line; '
+                                       'a checkpoint is written next to it')
+    params.add_argument('-l', '--lang', help='language of the model, which the default handler uses for '
+                                             'tokenization; defaults to the name of the model directory')
+    params.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of worker processes, each of which loads the model')
+    params.add_argument('-b', '--batch-size', type=int, default=32, help='number of lines per handler call')
+    params.add_argument('-s', '--shard-bytes', type=int, default=1 << 20,
+                        help='minimum size of the shards the input is split into; '
+                             'a checkpoint is written after every shard')
+    params.add_argument('--json', action='store_true', help='write the JSON response for every line instead of '
+                                                            'the translation')
+    args = params.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    checkpoint = translate_file(args)
+    logging.info(f'Translated {checkpoint["lines"]} lines to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from argparse import Namespace
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Sockeye arguments that change the result of decoding
+DECODING_ARGS = ['models', 'checkpoints', 'ensemble_mode', 'beam_size', 'nbest_size', 'beam_prune', 'beam_search_stop',
+                 'length_penalty_alpha', 'length_penalty_beta', 'brevity_penalty_type', 'brevity_penalty_weight',
+                 'brevity_penalty_constant_length_ratio', 'softmax_temperature', 'max_input_len',
+                 'max_output_length_num_stds', 'restrict_lexicon', 'restrict_lexicon_topk', 'avoid_list',
+                 'strip_unknown_words', 'skip_topk', 'override_dtype']
+
+# a cached translation: the translation string, its tokens and its score
+CacheValue = Tuple[str, List[str], float]
+
+
+def cache_namespace(sockeye_args: Namespace) -> str:
+    """
+    Returns a string that identifies the model and decoding settings of cached translations
+
+    :param sockeye_args: the arguments passed to Sockeye
+    :return: a cache namespace
+    """
+    settings = {a: getattr(sockeye_args, a, None) for a in DECODING_ARGS}
+    return json.dumps(settings, sort_keys=True, default=str)
+
+
+def cache_key(namespace: str, trans_input) -> str:
+    """
+    Returns the cache key of a preprocessed input
+
+    :param namespace: the cache namespace of the translator
+    :param trans_input: a TranslatorInput
+    :return: a cache key
+    """
+    pass_through = trans_input.pass_through_dict or {}
+    data = [namespace, trans_input.tokens, trans_input.constraints, trans_input.avoid_list,
+            pass_through.get('restrict_lexicon')]
+    return hashlib.sha1(json.dumps(data, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class LruCache:
+    """
+    A cache with LRU eviction and an optional time to live
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        """
+        :param max_size: maximum number of entries
+        :param ttl: seconds after which an entry expires, or None to keep entries until they are evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # type: OrderedDict
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if self.ttl is None or time.time() - created < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the cache counters
+
+        :return: a dictionary of hits, misses, evictions and the current size
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self)}
+
+    def hit_rate(self) -> float:
+        """
+        Returns the fraction of lookups that were hits
+
+        :return: the hit rate, or 0 if there were no lookups
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class TranslationCache(LruCache):
+    """
+    A sentence-level translation cache with LRU eviction and an optional time to live
+    """
+
+
+class SqliteTranslationCache(TranslationCache):
+    """
+    A translation cache stored in an SQLite file, which lets all workers on a host share their hits
+    """
+
+    def __init__(self, path: str, max_size: int, ttl: Optional[float] = None, mmap_size: int = 256 * 1024 * 1024):
+        """
+        :param path: database file
+        :param max_size: maximum number of entries
+        :param ttl: seconds after which an entry expires, or None to keep entries until they are evicted
+        :param mmap_size: number of bytes of the database to memory-map
+        """
+        super().__init__(max_size, ttl)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+        self.conn.executescript("""
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL);
+            CREATE INDEX IF NOT EXISTS translations_accessed ON translations (accessed);
+            -- keep the number of entries up to date for all workers sharing the file
+            CREATE TABLE IF NOT EXISTS translations_size (size INTEGER);
+            INSERT INTO translations_size SELECT COUNT(*) FROM translations
+                WHERE NOT EXISTS (SELECT * FROM translations_size);
+            CREATE TRIGGER IF NOT EXISTS translations_insert AFTER INSERT ON translations
+                BEGIN UPDATE translations_size SET size = size + 1; END;
+            CREATE TRIGGER IF NOT EXISTS translations_delete AFTER DELETE ON translations
+                BEGIN UPDATE translations_size SET size = size - 1; END;
+            COMMIT;
+        """)
+
+    def get(self, key: str) -> Optional[CacheValue]:
+        now = time.time()
+        with self.lock:
+            try:
+                row = self.conn.execute('SELECT value, created FROM translations WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    value, created = row
+                    if self.ttl is None or now - created < self.ttl:
+                        self.conn.execute('UPDATE translations SET accessed = ? WHERE key = ?', (now, key))
+                        self.hits += 1
+                        translation, tokens, score = json.loads(value)
+                        return translation, tokens, score
+                    self.conn.execute('DELETE FROM translations WHERE key = ?', (key,))
+                    self.evictions += 1
+            except sqlite3.OperationalError as e:
+                logging.warning(f'Could not read from translation cache {self.path}: {e}')
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: CacheValue):
+        now = time.time()
+        with self.lock:
+            try:
+                value = json.dumps(value, ensure_ascii=False)
+                # update first, since REPLACE would not fire the delete trigger and UPSERT needs SQLite 3.24
+                cursor = self.conn.execute('UPDATE translations SET value = ?, created = ?, accessed = ? WHERE key = ?',
+                                           (value, now, now, key))
+                if cursor.rowcount == 0:
+                    self.conn.execute('INSERT OR IGNORE INTO translations VALUES (?, ?, ?, ?)', (key, value, now, now))
+                excess = len(self) - self.max_size
+                if excess > 0:
+                    self.conn.execute('DELETE FROM translations WHERE key IN '
+                                      '(SELECT key FROM translations ORDER BY accessed LIMIT ?)', (excess,))
+                    self.evictions += excess
+            except sqlite3.OperationalError as e:
+                # a busy database must not fail the translation
+                logging.warning(f'Could not write to translation cache {self.path}: {e}')
+
+    def __len__(self):
+        return self.conn.execute('SELECT size FROM translations_size').fetchone()[0]
@@ -0,0 +1,149 @@
+import atexit
+import logging
+import subprocess
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+
+class CoProcessError(Exception):
+    """
+    Raised when a co-process exits or stops responding in the middle of a request
+    """
+    pass
+
+
+class CoProcess:
+    """
+    A long-lived subprocess that transforms text one line at a time over stdin and stdout.
+
+    The child must print exactly one line for every line that it reads and must flush its output after each line.
+    The process is started on first use and restarted if it crashes or hangs.
+    """
+
+    def __init__(self, args: Sequence[str], timeout: float = 30.0):
+        """
+        :param args: command line arguments of the child process
+        :param timeout: seconds to wait for a round trip before the child is considered hung
+        """
+        self.args = list(args)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.proc = None
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            self.args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            encoding='utf-8',
+            bufsize=1)
+
+    def close(self):
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+
+        for stream in (proc.stdin, proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        try:
+            proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    def run_lines(self, lines: List[str]) -> List[str]:
+        """
+        Sends a list of lines through the child in a single round trip
+
+        :param lines: input lines, which must not contain line breaks
+        :return: the output lines in the same order
+        """
+        if not lines:
+            return []
+
+        with self.lock:
+            try:
+                return self._round_trip(lines)
+            except (CoProcessError, OSError, ValueError) as e:
+                logging.warning(f'Restarting {self.args[0]}: {e}')
+                self.close()
+                return self._round_trip(lines)
+
+    def run(self, text: str) -> str:
+        """
+        Processes text, which may span several lines
+
+        :param text: input text
+        :return: processed text
+        """
+        if not text:
+            return ''
+        return '\n'.join(self.run_lines(text.split('\n'))).strip()
+
+    def _round_trip(self, lines: List[str]) -> List[str]:
+        if self.proc is None or self.proc.poll() is not None:
+            self.close()
+            self.start()
+
+        proc = self.proc
+        # write from a separate thread so that a full pipe cannot deadlock the reader
+        writer = threading.Thread(target=self._write, args=(proc, lines), daemon=True)
+        watchdog = threading.Timer(self.timeout, proc.kill)
+        writer.start()
+        watchdog.start()
+
+        try:
+            res = []
+            for _ in lines:
+                line = proc.stdout.readline()
+                if not line:
+                    raise CoProcessError(f'{self.args[0]} exited with code {proc.poll()}')
+                res.append(line.rstrip('\n'))
+            return res
+        finally:
+            watchdog.cancel()
+            writer.join()
+
+    @staticmethod
+    def _write(proc: subprocess.Popen, lines: List[str]):
+        try:
+            proc.stdin.write(''.join(line + '\n' for line in lines))
+            proc.stdin.flush()
+        except (OSError, ValueError):
+            # the reader notices that the child went away
+            pass
+
+
+_pool = {}  # type: Dict[Tuple[str, ...], CoProcess]
+_pool_lock = threading.Lock()
+
+
+def get_coprocess(args: Sequence[str]) -> CoProcess:
+    """
+    Returns the co-process for the given command line, creating it if needed.
+    There is at most one co-process per command line in each worker.
+
+    :param args: command line arguments of the child process
+    :return: a shared co-process
+    """
+    key = tuple(args)
+    with _pool_lock:
+        proc = _pool.get(key)
+        if proc is None:
+            proc = CoProcess(key)
+            _pool[key] = proc
+        return proc
+
+
+@atexit.register
+def close_all():
+    """
+    Stops all co-processes in this worker
+    """
+    with _pool_lock:
+        for proc in _pool.values():
+            proc.close()
+        _pool.clear()
@@ -1,34 +1,39 @@
 import os
 
-import pkg_resources
 import unicodedata
 
+from .coprocess import get_coprocess
+from .moses import MosesTokenizer
+from .segmenter import SentenceSplitter
 from .sockeye_handler import SockeyeHandler
-from .text_processor import BpeEncoder, DeBPE, Detokenizer, ProcessorChain, TextProcessor
-from .utils import run_subprocess
+from .text_processor import DeBPE, Detokenizer, ProcessorChain, TextProcessor
+from .utils import SCRIPTS_PATH, encode_responses
 
 
 class DefaultPreprocessor(TextProcessor):
     """
-    A preprocessor that uses Joshua scripts to preprocess text
+    A preprocessor that tokenizes text like the Moses tokenizer, or with the Moses Perl script itself
     """
 
-    def __init__(self, scripts_path, lang):
+    def __init__(self, scripts_path, lang, perl=False):
         super().__init__()
 
         self.lang = lang
-        self.tokenizer = os.path.join(scripts_path, 'tokenizer.perl')
-
-        if not os.access(self.tokenizer, os.X_OK):
-            os.chmod(self.tokenizer, 0o755)
+        if perl:
+            tokenizer = os.path.join(scripts_path, 'tokenizer.perl')
+            if not os.access(tokenizer, os.X_OK):
+                os.chmod(tokenizer, 0o755)
+            # the tokenizer process is shared by all preprocessors for this language and started on first use
+            self.tokenizer = get_coprocess([tokenizer, '-b', '-l', lang, '-no-escape', '-q'])
+        else:
+            self.tokenizer = MosesTokenizer(lang, os.path.join(scripts_path, 'nonbreaking_prefixes'))
 
     def run(self, text):
         text = self.unescape(text)
         text = unicodedata.normalize('NFKC', text)
         text = self.remove_control_characters(text)
 
-        return run_subprocess(
-            text, [self.tokenizer, '-l', self.lang, '-no-escape', '-q'])
+        return self.tokenizer.run(text)
 
 
 class DefaultHandler(SockeyeHandler):
@@ -36,26 +41,25 @@ class DefaultHandler(SockeyeHandler):
     Consumes text of arbitrary length and returns its translation.
     """
 
-    def initialize(self, context):
-        super().initialize(context)
-
-        scripts_path = pkg_resources.resource_filename(
-            'sockeye_serving', 'scripts')
+    def init_processors(self, context):
+        scripts_path = SCRIPTS_PATH
         # get the language from the model name
         lang = context.model_name
 
-        bpe_codes = os.path.join(self.basedir, 'bpe-codes.txt')
-        preprocessors = [DefaultPreprocessor(scripts_path, lang)]
-        if os.path.isfile(bpe_codes):
-            preprocessors.append(BpeEncoder(bpe_codes))
+        perl = self.serving_args.moses_perl
+        preprocessors = [DefaultPreprocessor(scripts_path, lang, perl)]
+        bpe_encoder = self.get_bpe_encoder()
+        if bpe_encoder is not None:
+            preprocessors.append(bpe_encoder)
         self.preprocessor = ProcessorChain(preprocessors)
 
-        postprocessors = [DeBPE(), Detokenizer(scripts_path)]
+        postprocessors = [DeBPE(), Detokenizer(scripts_path, perl)]
         self.postprocessor = ProcessorChain(postprocessors)
+        self.segmenter = SentenceSplitter(lang, os.path.join(scripts_path, 'nonbreaking_prefixes'))
 
 
 _service = DefaultHandler()
 
 
 def handle(data, context):
-    return _service.handle(data, context)
+    return encode_responses(_service.handle(data, context), context)
@@ -0,0 +1,161 @@
+"""
+Builds top-k lexicons for vocabulary-restricted decoding from word-aligned training data or from translations logged by
+the handler with ``--lexicon-log``. The lexicon is saved in the model directory as ``lexicon.npy``, which the handlers
+load by default::
+
+    python -m sockeye_serving.lexicon /tmp/models/zh -s train.bpe.zh -t train.bpe.en -a train.align -k 200
+    python -m sockeye_serving.lexicon /tmp/models/zh --log lexicon-log.*.tsv -k 200
+"""
+
+import argparse
+import logging
+import os
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sockeye import constants as C
+from sockeye import vocab
+
+LEXICON_FILE = 'lexicon.npy'
+
+# a sentence pair: source tokens, target tokens and alignment links between their positions, if any
+SentencePair = Tuple[List[str], List[str], Optional[List[Tuple[int, int]]]]
+
+
+def parse_alignment(line: str) -> List[Tuple[int, int]]:
+    """
+    Parses word alignments in the Pharaoh format, e.g. ``0-0 1-2 2-1``
+    """
+    return [tuple(int(i) for i in link.split('-', 1)) for link in line.split()]
+
+
+def format_alignment(attention_matrix) -> str:
+    """
+    Aligns every target position with the source position it attends to most
+
+    :param attention_matrix: attention of a translation, of shape (target length, source length)
+    :return: the alignment in the Pharaoh format
+    """
+    return ' '.join(f'{j}-{i}' for i, j in enumerate(np.argmax(attention_matrix, axis=1)))
+
+
+def read_parallel(source: str, target: str, alignments: Optional[str] = None) -> Iterator[SentencePair]:
+    """
+    Reads sentence pairs from parallel files with one sentence per line
+
+    :param source: tokenized source sentences, as they are passed to the model
+    :param target: tokenized target sentences
+    :param alignments: word alignments of each pair in the Pharaoh format
+    """
+    with open(source, encoding='utf-8') as src, open(target, encoding='utf-8') as trg:
+        align = open(alignments, encoding='utf-8') if alignments else None
+        try:
+            for s, t in zip(src, trg):
+                yield s.split(), t.split(), parse_alignment(next(align)) if align else None
+        finally:
+            if align:
+                align.close()
+
+
+def read_log(path: str) -> Iterator[SentencePair]:
+    """
+    Reads sentence pairs logged by the handler: source tokens, target tokens and an optional alignment,
+    separated by tabs
+    """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 2:
+                continue
+            links = parse_alignment(fields[2]) if len(fields) > 2 and fields[2] else None
+            yield fields[0].split(), fields[1].split(), links
+
+
+def build_lexicon(pairs: Iterable[SentencePair], source_vocab: Dict[str, int], target_vocab: Dict[str, int],
+                  k: int) -> np.ndarray:
+    """
+    Builds a top-k lexicon in Sockeye's format. Target words are ranked by how often they are aligned with a source
+    word, or, for pairs without an alignment, by how often they occur in the same sentence pair.
+
+    :param pairs: sentence pairs
+    :param source_vocab: source vocabulary of the model
+    :param target_vocab: target vocabulary of the model
+    :param k: number of target words to keep for each source word
+    :return: an array of target word IDs of shape (source vocabulary size, k), most frequent first and padded with
+             the ID of the padding symbol; the smallest integer type that holds the target IDs is used
+    """
+    source_unk = source_vocab[C.UNK_SYMBOL]
+    target_unk = target_vocab[C.UNK_SYMBOL]
+    # these are always allowed by the decoder
+    special = {target_vocab[s] for s in (C.PAD_SYMBOL, C.UNK_SYMBOL, C.BOS_SYMBOL, C.EOS_SYMBOL) if s in target_vocab}
+
+    counts = defaultdict(Counter)  # type: Dict[int, Counter]
+    num_pairs = 0
+    for source, target, links in pairs:
+        source_ids = [source_vocab.get(w, source_unk) for w in source]
+        target_ids = [target_vocab.get(w, target_unk) for w in target]
+        if links is None:
+            # count co-occurrences once per sentence pair
+            links = {(s, t) for s in set(source_ids) for t in set(target_ids)}
+        else:
+            links = [(source_ids[i], target_ids[j]) for i, j in links if i < len(source_ids) and j < len(target_ids)]
+        for s, t in links:
+            if s != source_unk and t not in special:
+                counts[s][t] += 1
+        num_pairs += 1
+
+    dtype = np.uint16 if len(target_vocab) <= np.iinfo(np.uint16).max + 1 else np.int32
+    lex = np.full((len(source_vocab), k), target_vocab.get(C.PAD_SYMBOL, 0), dtype=dtype)
+    for s, counter in counts.items():
+        top_k = [t for t, _ in counter.most_common(k)]
+        lex[s, :len(top_k)] = top_k
+
+    logging.info(f'Built a top-{k} lexicon from {num_pairs} sentence pairs, {len(counts)} source words of '
+                 f'{len(source_vocab)} have translations')
+    return lex
+
+
+def save_lexicon(path: str, lex: np.ndarray):
+    """
+    Saves a lexicon through a temporary file, so that a worker that starts meanwhile never reads a partial lexicon
+    """
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, lex)
+    os.replace(tmp, path)
+
+
+def main():
+    params = argparse.ArgumentParser(description='Build a top-k lexicon for vocabulary-restricted decoding')
+    params.add_argument('model_dir', help='model directory, which has the vocabularies of the model')
+    params.add_argument('-s', '--source', help='tokenized source side of the training data')
+    params.add_argument('-t', '--target', help='tokenized target side of the training data')
+    params.add_argument('-a', '--alignments', help='word alignments of the training data in the Pharaoh format, '
+                                                   'e.g. from fast_align; without them, co-occurrences are counted')
+    params.add_argument('-l', '--log', nargs='+', default=[], help='files written by the handler with --lexicon-log')
+    params.add_argument('-k', type=int, default=200, help='number of target words to keep for each source word')
+    params.add_argument('-o', '--output', help=f'lexicon file; defaults to {LEXICON_FILE} in the model directory')
+    args = params.parse_args()
+
+    if bool(args.source) != bool(args.target) or not (args.source or args.log):
+        params.error('either --source and --target or --log are required')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    source_vocab = vocab.load_source_vocabs(args.model_dir)[0]
+    target_vocab = vocab.load_target_vocab(args.model_dir)
+
+    def pairs():
+        if args.source:
+            yield from read_parallel(args.source, args.target, args.alignments)
+        for path in args.log:
+            yield from read_log(path)
+
+    lex = build_lexicon(pairs(), source_vocab, target_vocab, args.k)
+    output = args.output or os.path.join(args.model_dir, LEXICON_FILE)
+    save_lexicon(output, lex)
+    logging.info(f'Saved the lexicon to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, List, Optional
+
+# units of the metrics reported to MMS
+MILLISECONDS = 'ms'
+COUNT = 'count'
+PERCENT = 'percent'
+
+
+class HandlerMetrics:
+    """
+    Collects the timings and counters of a handler for each batch.
+    After a batch, they are added to the MMS metrics of the request and to running totals,
+    which can be exported in the Prometheus text format.
+    """
+
+    def __init__(self, model_name: str = ''):
+        """
+        :param model_name: the model name, used as a label of the Prometheus metrics
+        """
+        self.model_name = model_name
+        self.lock = threading.Lock()
+        self.batch = {}  # type: Dict[str, list]
+        self.totals = {}  # type: Dict[str, float]
+        self.calls = {}  # type: Dict[str, int]
+        self.gauges = {}  # type: Dict[str, float]
+        # the bucket bounds, bucket counts, sum and count of each histogram
+        self.histograms = {}  # type: Dict[str, list]
+
+    @contextmanager
+    def time(self, name: str):
+        """
+        Times a block of code
+
+        :param name: metric name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000, MILLISECONDS)
+
+    def add(self, name: str, value: float, unit: str = COUNT):
+        """
+        Adds a value to a metric of the current batch. Values of the same metric are summed.
+
+        :param name: metric name
+        :param value: the value
+        :param unit: 'ms', 'count' or 'percent'
+        """
+        with self.lock:
+            if name in self.batch:
+                self.batch[name][0] += value
+            else:
+                self.batch[name] = [value, unit]
+
+    def set(self, name: str, value: float, unit: str = COUNT):
+        """
+        Sets a metric of the current batch that is a level rather than an amount, like a cache size
+
+        :param name: metric name
+        :param value: the value
+        :param unit: 'ms', 'count' or 'percent'
+        """
+        with self.lock:
+            self.batch[name] = [value, unit]
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float, buckets: List[float]):
+        """
+        Adds a value to a histogram, which is only exported to Prometheus, since MMS has no histograms
+
+        :param name: metric name
+        :param value: the value
+        :param buckets: the upper bounds of the buckets
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [buckets, [0] * len(buckets), 0.0, 0]
+            i = bisect.bisect_left(histogram[0], value)
+            if i < len(buckets):
+                histogram[1][i] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def flush(self, context) -> Dict[str, float]:
+        """
+        Reports the metrics of the current batch to MMS and adds them to the totals
+
+        :param context: model server context
+        :return: the metrics of the batch
+        """
+        with self.lock:
+            batch, self.batch = self.batch, {}
+            for name, (value, unit) in batch.items():
+                if name not in self.gauges:
+                    self.totals[name] = self.totals.get(name, 0.0) + value
+                    self.calls[name] = self.calls.get(name, 0) + 1
+
+        store = getattr(context, 'metrics', None)
+        if store is not None:
+            for name, (value, unit) in batch.items():
+                try:
+                    if unit == MILLISECONDS:
+                        store.add_time(name, value)
+                    elif unit == PERCENT:
+                        store.add_percent(name, value)
+                    else:
+                        store.add_counter(name, value)
+                except Exception as e:
+                    # metrics must not fail the translation
+                    logging.warning(f'Could not report metric {name}: {e}')
+
+        return {name: value for name, (value, unit) in batch.items()}
+
+    def prometheus_text(self) -> str:
+        """
+        Returns the running totals in the Prometheus text format
+        """
+        label = f'model="{self.model_name}"'
+        lines = []
+        with self.lock:
+            for name in sorted(self.totals):
+                metric = 'sockeye_serving_' + _snake_case(name)
+                if name in self.calls and name.endswith('Time'):
+                    metric = metric[:-len('_time')]
+                    lines.append(f'# TYPE {metric}_seconds summary')
+                    lines.append(f'{metric}_seconds_sum{{{label}}} {self.totals[name] / 1000:.6f}')
+                    lines.append(f'{metric}_seconds_count{{{label}}} {self.calls[name]}')
+                else:
+                    lines.append(f'# TYPE {metric}_total counter')
+                    lines.append(f'{metric}_total{{{label}}} {self.totals[name]:g}')
+            for name in sorted(self.gauges):
+                metric = 'sockeye_serving_' + _snake_case(name)
+                lines.append(f'# TYPE {metric} gauge')
+                lines.append(f'{metric}{{{label}}} {self.gauges[name]:g}')
+            for name in sorted(self.histograms):
+                metric = 'sockeye_serving_' + _snake_case(name)
+                bounds, counts, total, count = self.histograms[name]
+                lines.append(f'# TYPE {metric} histogram')
+                cumulative = 0
+                for bound, n in zip(bounds, counts):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{{label},le="{bound:g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f'{metric}_sum{{{label}}} {total:g}')
+                lines.append(f'{metric}_count{{{label}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """
+        Writes the running totals to a file in the Prometheus text format, e.g. for the node exporter's textfile
+        collector. The file is replaced atomically.
+
+        :param path: file name, where '{pid}' is replaced by the process ID so that every worker has its own file
+        """
+        path = path.format(pid=os.getpid())
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+    def serve_prometheus(self, port: int) -> Optional[HTTPServer]:
+        """
+        Serves the running totals at http://host:port/metrics from a background thread.
+        Only one worker can listen on a port, so later workers log a warning instead.
+
+        :param port: port number
+        :return: the server, or None if the port is taken
+        """
+        metrics = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            server = HTTPServer(('', port), MetricsRequestHandler)
+        except OSError as e:
+            logging.warning(f'Could not serve metrics on port {port}: {e}')
+            return None
+        threading.Thread(target=server.serve_forever, name='sockeye-serving-metrics', daemon=True).start()
+        return server
+
+
+def _snake_case(name: str) -> str:
+    name = re.sub('([A-Z]+)([A-Z][a-z])', r'\1_\2', name)
+    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', name).lower()
@@ -0,0 +1,419 @@
+"""
+A pure Python port of the bundled Moses scripts ``tokenizer.perl`` and ``detokenize.pl``.
+
+The output matches the Perl scripts line for line. Only the options used by the handlers are supported:
+the tokenizer runs in its default mode (``-a`` and ``-no-escape`` are available, ``-penn`` and ``-protected`` are not).
+"""
+
+import os
+import threading
+from typing import Dict, List
+
+import regex as re
+
+NUMERIC_ONLY = 2
+NONBREAKING = 1
+
+_prefixes = {}  # type: Dict[str, Dict[str, int]]
+_prefixes_lock = threading.Lock()
+
+
+def load_prefixes(prefixes_path: str, lang: str) -> Dict[str, int]:
+    """
+    Loads the nonbreaking prefixes for a language, falling back to English like ``tokenizer.perl``.
+    Each file is read only once per process.
+
+    :param prefixes_path: the ``nonbreaking_prefixes`` directory
+    :param lang: language code
+    :return: a map from prefix to either NONBREAKING or NUMERIC_ONLY
+    """
+    prefix_file = os.path.join(prefixes_path, f'nonbreaking_prefix.{lang}')
+    if not os.path.exists(prefix_file):
+        prefix_file = os.path.join(prefixes_path, 'nonbreaking_prefix.en')
+
+    with _prefixes_lock:
+        if prefix_file not in _prefixes:
+            prefixes = {}
+            numeric_only = re.compile(r'(.*)[\s]+(\#NUMERIC_ONLY\#)')
+            with open(prefix_file, encoding='utf-8', newline='\n') as f:
+                for item in f:
+                    if item.endswith('\n'):
+                        item = item[:-1]
+                    # Perl treats "0" as false
+                    if item and item != '0' and not item.startswith('#'):
+                        m = numeric_only.search(item)
+                        if m:
+                            prefixes[m.group(1)] = NUMERIC_ONLY
+                        else:
+                            prefixes[item] = NONBREAKING
+            _prefixes[prefix_file] = prefixes
+        return _prefixes[prefix_file]
+
+
+class MosesTokenizer:
+    """
+    Tokenizes text like ``tokenizer.perl``
+    """
+
+    # Unicode properties matching Perl's \p{IsAlnum}, \p{IsAlpha}, \p{IsN} and \p{IsLower}
+    ALNUM = r'\p{Alnum}'
+    ALPHA = r'\p{Alpha}'
+    NUM = r'\p{N}'
+    LOWER = r'\p{Lowercase}'
+
+    blank = re.compile(r'^\s*$')
+    whitespace = re.compile(r'\s+')
+    ascii_junk = re.compile(r'[\000-\037]')
+    spaces = re.compile(r' +')
+    special = re.compile(rf'([^{ALNUM}\s\.\'\`\,\-])')
+    special_fi_sv = re.compile(rf'([^{ALNUM}\s\.\:\'\`\,\-])')
+    colon_fi_sv = re.compile(r'(:)(?=$|[^\p{Ll}])')
+    aggressive_hyphen = re.compile(rf'([{ALNUM}])\-(?=[{ALNUM}])')
+    multi_dot = re.compile(r'\.([\.]+)')
+    multi_dot_next = re.compile(r'DOTMULTI\.([^\.])')
+    comma_pre = re.compile(rf'([^{NUM}])[,]')
+    comma_post = re.compile(rf'[,]([^{NUM}])')
+    comma_final = re.compile(rf'([{NUM}])[,]$')
+
+    # split contractions right
+    contractions_en = [
+        (re.compile(rf'([^{ALPHA}])[\']([^{ALPHA}])'), r"\1 ' \2"),
+        (re.compile(rf'([^{ALPHA}{NUM}])[\']([{ALPHA}])'), r"\1 ' \2"),
+        (re.compile(rf'([{ALPHA}])[\']([^{ALPHA}])'), r"\1 ' \2"),
+        (re.compile(rf'([{ALPHA}])[\']([{ALPHA}])'), r"\1 '\2"),
+        # special case for "1990's"
+        (re.compile(rf'([{NUM}])[\']([s])'), r"\1 '\2")]
+    # split contractions left
+    contractions_fr = [
+        (re.compile(rf'([^{ALPHA}])[\']([^{ALPHA}])'), r"\1 ' \2"),
+        (re.compile(rf'([^{ALPHA}])[\']([{ALPHA}])'), r"\1 ' \2"),
+        (re.compile(rf'([{ALPHA}])[\']([^{ALPHA}])'), r"\1 ' \2"),
+        (re.compile(rf'([{ALPHA}])[\']([{ALPHA}])'), r"\1' \2")]
+    # don't split glottals
+    contractions_so = contractions_fr[:3]
+
+    word_with_period = re.compile(r'^(\S+)\.$')
+    alpha = re.compile(rf'{ALPHA}')
+    starts_lower = re.compile(rf'^[{LOWER}]')
+    starts_digit = re.compile(r'^[0-9]+')
+    final_period_quote = re.compile(r'\.\' ?$')
+
+    escapes = [('&', '&amp;'), ('|', '&#124;'), ('<', '&lt;'), ('>', '&gt;'), ("'", '&apos;'), ('"', '&quot;'),
+               ('[', '&#91;'), (']', '&#93;')]
+
+    def __init__(self, lang: str, prefixes_path: str, aggressive: bool = False, no_escape: bool = True):
+        """
+        :param lang: language code
+        :param prefixes_path: the ``nonbreaking_prefixes`` directory
+        :param aggressive: split hyphens like ``-a``
+        :param no_escape: don't escape special characters, like ``-no-escape``
+        """
+        self.lang = lang
+        self.aggressive = aggressive
+        self.no_escape = no_escape
+        self.prefixes = load_prefixes(prefixes_path, lang)
+
+        if lang == 'en':
+            self.contractions = self.contractions_en
+        elif lang in ('fr', 'it', 'ga'):
+            self.contractions = self.contractions_fr
+        elif lang == 'so':
+            self.contractions = self.contractions_so
+        else:
+            self.contractions = None
+
+    def tokenize(self, line: str) -> str:
+        """
+        Tokenizes a single line
+
+        :param line: a line without a line break
+        :return: the line printed by ``tokenizer.perl``, without the trailing line break
+        """
+        if self.blank.match(line):
+            return line
+
+        text = f' {line} '
+
+        # remove ASCII junk
+        text = self.whitespace.sub(' ', text)
+        text = self.ascii_junk.sub('', text)
+
+        text = self.spaces.sub(' ', text)
+        if text.startswith(' '):
+            text = text[1:]
+        if text.endswith(' '):
+            text = text[:-1]
+
+        # separate out all "other" special characters
+        if self.lang in ('fi', 'sv'):
+            # in Finnish and Swedish, the colon can be used inside words as an apostrophe-like character
+            text = self.special_fi_sv.sub(r' \1 ', text)
+            # if a colon is not immediately followed by lower-case characters, separate it out anyway
+            text = self.colon_fi_sv.sub(r' \1 ', text)
+        else:
+            text = self.special.sub(r' \1 ', text)
+
+        if self.aggressive:
+            text = self.aggressive_hyphen.sub(r'\1 @-@ ', text)
+
+        # multi-dots stay together
+        text = self.multi_dot.sub(r' DOTMULTI\1', text)
+        while 'DOTMULTI.' in text:
+            text = self.multi_dot_next.sub(r'DOTDOTMULTI \1', text)
+            text = text.replace('DOTMULTI.', 'DOTDOTMULTI')
+
+        # separate out "," except if within numbers (5,300)
+        text = self.comma_pre.sub(r'\1 , ', text)
+        text = self.comma_post.sub(r' , \1', text)
+        # separate "," after a number if it's the end of a sentence
+        text = self.comma_final.sub(r'\1 ,', text)
+
+        if self.contractions is None:
+            text = text.replace("'", " ' ")
+        else:
+            for pattern, repl in self.contractions:
+                text = pattern.sub(repl, text)
+
+        text = self._split_periods(text)
+
+        # clean up extraneous spaces
+        text = self.spaces.sub(' ', text)
+        if text.startswith(' '):
+            text = text[1:]
+        if text.endswith(' '):
+            text = text[:-1]
+
+        # .' at end of sentence is missed
+        text = self.final_period_quote.sub(" . ' ", text, count=1)
+
+        # restore multi-dots
+        while 'DOTDOTMULTI' in text:
+            text = text.replace('DOTDOTMULTI', 'DOTMULTI.')
+        text = text.replace('DOTMULTI', '.')
+
+        if not self.no_escape:
+            for c, escaped in self.escapes:
+                text = text.replace(c, escaped)
+
+        return text
+
+    def _split_periods(self, text: str) -> str:
+        words = _perl_split(text, ' ')
+        num_words = len(words)
+
+        res = []
+        for i, word in enumerate(words):
+            m = self.word_with_period.match(word)
+            if m:
+                pre = m.group(1)
+                prefix = self.prefixes.get(pre)
+                if i == num_words - 1:
+                    # split last words independently as they are unlikely to be non-breaking prefixes
+                    word = pre + ' .'
+                elif ('.' in pre and self.alpha.search(pre)) or prefix == NONBREAKING or \
+                        self.starts_lower.match(words[i + 1]):
+                    pass
+                elif prefix == NUMERIC_ONLY and self.starts_digit.match(words[i + 1]):
+                    pass
+                else:
+                    word = pre + ' .'
+            res.append(word)
+            res.append(' ')
+        return ''.join(res)
+
+    def run(self, text: str) -> str:
+        """
+        Tokenizes text that may span several lines
+
+        :param text: input text
+        :return: tokenized text
+        """
+        return '\n'.join(self.tokenize(line) for line in text.split('\n')).strip()
+
+
+class MosesDetokenizer:
+    """
+    Detokenizes text like ``detokenize.pl``
+    """
+
+    tag_or_blank = re.compile(r'^<.+>$|^\s*$')
+    quote_replacements = [
+        # convert curly quotes to ASCII
+        ('‘', "'"), ('’', "'"), ('“', '"'), ('”', '"'),
+        ('â\u0080\u0098', "'"), ('â\u0080\u0099', "'"),
+        ('â\u0080\u009c', '"'), ('â\u0080\u009d', '"')]
+    double_single_quote = re.compile(r" '\s+' ")
+    # replacements of " X " where the surrounding spaces may overlap between matches
+    replacements = [
+        (" ` ", " ' "), (" ' ", " ' "), (" `` ", ' " '), (" '' ", ' " '),
+        # replace the pipe character, which is a special reserved character in Moses
+        (' -PIPE- ', ' | '),
+        (' -LRB- ', ' ( '), (' -RRB- ', ' ) '), (' -LSB- ', ' [ '), (' -RSB- ', ' ] '),
+        (' -LCB- ', ' { '), (' -RCB- ', ' } '),
+        (' -lrb- ', ' ( '), (' -rrb- ', ' ) '), (' -lsb- ', ' [ '), (' -rsb- ', ' ] '),
+        (' -lcb- ', ' { '), (' -rcb- ', ' } '),
+        (" 'll ", "'ll "), (" 're ", "'re "), (" 've ", "'ve "), (" n't ", "n't "),
+        (" 'LL ", "'LL "), (" 'RE ", "'RE "), (" 'VE ", "'VE "), (" N'T ", "N'T "),
+        (' can not ', ' cannot '), (' Can not ', ' Cannot '),
+        # just in case the contraction was not properly treated
+        (" ' ll ", "'ll "), (" ' re ", "'re "), (" ' ve ", "'ve "), ("n ' t ", "n't "),
+        (" ' LL ", "'LL "), (" ' RE ", "'RE "), (" ' VE ", "'VE "), ("N ' T ", "N'T ")]
+
+    currency = re.compile(r'^[\p{Sc}]+$')
+    starts_digit = re.compile(r'^[0-9]')
+    # detokenize.pl has no "use utf8", so the UTF-8 bytes of ¿ and ¡ end up in the class as \xc2, \xbf and \xa1
+    right_shift = re.compile('^[\\(\\[\\{Â¿¡]+$')
+    left_shift = re.compile(r'^[\,\.\?\!\:\;\\\%\}\]\)]+$')
+    starts_quote_alpha = re.compile(r'^[\'][\p{Alpha}]')
+    ends_alnum = re.compile(r'[\p{Alnum}]$')
+    single_upper = re.compile(r'^[A-Z]$')
+    ends_alpha_quote = re.compile(r'[\p{Alpha}][\']$')
+    starts_alpha = re.compile(r'^[\p{Alpha}]')
+    quotes = re.compile(r'^[\'\"]+$')
+    ends_s = re.compile(r'[s]$')
+    comma_or_period = re.compile(r'^[,.]$')
+
+    spaces = re.compile(r' +')
+    left_angle = re.compile('(Â«|«) ')
+    right_angle = re.compile(' (Â»|»)')
+
+    def __init__(self, lang: str = 'en'):
+        """
+        :param lang: language code
+        """
+        self.lang = lang
+
+    def detokenize(self, line: str) -> str:
+        """
+        Detokenizes a single line
+
+        :param line: a line without a line break
+        :return: the line printed by ``detokenize.pl``, without the trailing line break
+        """
+        if self.tag_or_blank.match(line):
+            return line
+
+        text = f' {line} '
+
+        for c, repl in self.quote_replacements:
+            text = text.replace(c, repl)
+
+        text = self.double_single_quote.sub(' " ', text)
+        for s, repl in self.replacements:
+            text = text.replace(s, repl)
+
+        text = self._join_words(_perl_split(text, ' '))
+
+        # clean continuing spaces
+        text = self.spaces.sub(' ', text)
+
+        # delete spaces around double angle brackets
+        text = self.left_angle.sub(r'\1', text)
+        text = self.right_angle.sub(r'\1', text)
+
+        text = text.replace(' / ', '/')
+
+        # clean up spaces at head and tail of each line as well as any double-spacing
+        text = text.replace('\n ', '\n')
+        text = text.replace(' \n', '\n')
+        if text.startswith(' '):
+            text = text[1:]
+        if text.endswith(' '):
+            text = text[:-1]
+
+        return text
+
+    def _join_words(self, words: List[str]) -> str:
+        en = self.lang == 'en'
+        num_words = len(words)
+        quote_count = {"'": 0, '"': 0}
+        prepend_space = ' '
+
+        text = []
+        for i, word in enumerate(words):
+            has_next = i < num_words - 1
+
+            if self.currency.match(word):
+                # perform shift on currency
+                if has_next and self.starts_digit.match(words[i + 1]):
+                    text.append(prepend_space + word)
+                    prepend_space = ''
+                else:
+                    text.append(word)
+                    prepend_space = ' '
+            elif self.right_shift.match(word):
+                # perform right shift on random punctuation items
+                text.append(prepend_space + word)
+                prepend_space = ''
+            elif self.left_shift.match(word):
+                # perform left shift on punctuation items
+                text.append(word)
+                prepend_space = ' '
+            elif en and i > 0 and self.starts_quote_alpha.match(word) and self.ends_alnum.search(words[i - 1]):
+                # left-shift the contraction for English
+                text.append(word)
+                prepend_space = ' '
+            elif en and i > 0 and has_next and word == '&' and self.single_upper.match(words[i - 1]) and \
+                    self.single_upper.match(words[i + 1]):
+                # some contraction with an ampersand e.g. "R&D"
+                text.append(word)
+                prepend_space = ''
+            elif self.lang == 'fr' and has_next and self.ends_alpha_quote.search(word) and \
+                    self.starts_alpha.match(words[i + 1]):
+                # right-shift the contraction for French
+                text.append(prepend_space + word)
+                prepend_space = ''
+            elif self.quotes.match(word):
+                # combine punctuation smartly
+                count = quote_count.get(word, 0)
+                if count % 2 == 0:
+                    if en and word == "'" and i > 0 and self.ends_s.search(words[i - 1]):
+                        # single quote for possessives ending in s... "The Jones' house"
+                        text.append(word)
+                        prepend_space = ' '
+                    elif en and word == "'" and has_next and words[i + 1] == 's':
+                        # single quote for possessive construction. "John's"
+                        text.append(word)
+                        prepend_space = ''
+                    elif count == 0 and en and word == '"' and i > 1 and \
+                            self.comma_or_period.match(words[i - 1]) and words[i - 2] != 'said':
+                        # emergency case in which the opening quote is missing
+                        text.append(word)
+                        prepend_space = ' '
+                    elif en and word == '"' and has_next and self.comma_or_period.match(words[i + 1]):
+                        text.append(word)
+                        prepend_space = ' '
+                    else:
+                        # right shift
+                        text.append(prepend_space + word)
+                        prepend_space = ''
+                        quote_count[word] = count + 1
+                else:
+                    # left shift
+                    text.append(word)
+                    prepend_space = ' '
+                    quote_count[word] = count + 1
+            else:
+                text.append(prepend_space + word)
+                prepend_space = ' '
+
+        return ''.join(text)
+
+    def run(self, text: str) -> str:
+        """
+        Detokenizes text that may span several lines
+
+        :param text: input text
+        :return: detokenized text
+        """
+        return '\n'.join(self.detokenize(line) for line in text.split('\n')).strip()
+
+
+def _perl_split(text: str, sep: str) -> List[str]:
+    """
+    Splits like Perl's split, which drops trailing empty fields
+    """
+    words = text.split(sep)
+    while words and not words[-1]:
+        words.pop()
+    return words
@@ -0,0 +1,77 @@
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
+
+from .text_processor import TextProcessor
+
+PREPROCESS = 'preprocess'
+POSTPROCESS = 'postprocess'
+
+POOL_THREAD = 'thread'
+POOL_PROCESS = 'process'
+
+# the processors of a process pool worker, which are set before the workers are forked, so that they inherit them
+_processors = {}  # type: Dict[str, TextProcessor]
+
+
+def _run_batch(stage: str, texts: List[str]) -> List[str]:
+    return _processors[stage].run_batch(texts)
+
+
+class ProcessorPool:
+    """
+    Runs the preprocessor and postprocessor of a handler on a pool of threads or processes,
+    so that text processing overlaps with decoding.
+    Threads suit processors that mostly wait, since decoding releases the GIL.
+    Processes are forked from the handler when the pool is created, so they inherit its processors instead of loading
+    them again. The pool should be created before the model is loaded, so that the workers don't inherit the state of
+    the threads of MXNet.
+    """
+
+    def __init__(self, preprocessor: TextProcessor, postprocessor: TextProcessor, workers: int,
+                 kind: str = POOL_THREAD):
+        """
+        :param preprocessor: the preprocessor of the handler
+        :param postprocessor: the postprocessor of the handler
+        :param workers: number of threads or processes
+        :param kind: either 'thread' or 'process'
+        """
+        self.processors = {PREPROCESS: preprocessor, POSTPROCESS: postprocessor}
+        self.kind = kind
+        if kind == POOL_THREAD:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sockeye-serving')
+        elif kind == POOL_PROCESS:
+            _processors.update(self.processors)
+            self.executor = multiprocessing.get_context('fork').Pool(workers)
+        else:
+            raise ValueError(f'Unknown pool type {kind}')
+
+    def submit(self, stage: str, texts: List[str]) -> Future:
+        """
+        Processes texts in the background
+
+        :param stage: either 'preprocess' or 'postprocess'
+        :param texts: a list of texts
+        :return: a future of the processed texts
+        """
+        if self.kind == POOL_THREAD:
+            return self.executor.submit(self.processors[stage].run_batch, texts)
+        future = Future()
+
+        # the result thread of the pool dies if it completes a future that was cancelled
+        def set_result(result):
+            if not future.cancelled():
+                future.set_result(result)
+
+        def set_exception(e):
+            if not future.cancelled():
+                future.set_exception(e)
+
+        self.executor.apply_async(_run_batch, (stage, texts), callback=set_result, error_callback=set_exception)
+        return future
+
+    def shutdown(self):
+        if self.kind == POOL_THREAD:
+            self.executor.shutdown(wait=False)
+        else:
+            self.executor.terminate()
@@ -0,0 +1,220 @@
+import gc
+import logging
+import os
+from collections import OrderedDict
+
+from .default_handler import DefaultHandler
+from .ko_handler import KoreanHandler
+from .serving_args import get_serving_args
+from .sockeye_handler import BAD_REQUEST_STATUS
+from .utils import encode_responses, report_status
+from .zh_handler import ChineseHandler
+
+HANDLERS = {
+    'ko': KoreanHandler,
+    'zh': ChineseHandler,
+}
+
+
+class ModelContext:
+    """
+    The context of a model served by the router, which has its own name and model directory
+    """
+
+    def __init__(self, context, model_name, model_dir):
+        self.model_name = model_name
+        self.system_properties = dict(context.system_properties, model_dir=model_dir)
+        self.request_processor = getattr(context, 'request_processor', None)
+        self.metrics = getattr(context, 'metrics', None)
+
+
+class BatchContext:
+    """
+    The context of the requests of a batch that are translated by one model, which reports their statuses
+    at their positions in the whole batch
+    """
+
+    def __init__(self, context, indices):
+        self.context = context
+        self.indices = indices
+
+    def set_response_status(self, code, phrase, idx):
+        report_status(self.context, code, phrase, self.indices[idx])
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+
+class RouterHandler(object):
+    """
+    Serves several models in one worker. Every subdirectory of the model directory that contains ``sockeye-args.txt``
+    is a model, named after the directory. Each request is translated by the model given in its ``model`` field,
+    or the first model of the language given in its ``lang`` field.
+    Models are loaded on first use and share the MXNet runtime, the nonbreaking prefixes and identical BPE codes.
+    """
+
+    def __init__(self):
+        self._batch_size = 0
+        self.basedir = None
+        self.initialized = False
+        self.langs = {}
+        self.loaded = OrderedDict()
+        self.model_dirs = {}
+        self.serving_args = None
+
+    def initialize(self, context):
+        """
+        Finds the models in the model directory. This will be called during model loading time
+
+        :param context: Initial context contains model server system properties.
+        """
+        self._batch_size = context.system_properties['batch_size']
+        self.basedir = context.system_properties['model_dir']
+        self.serving_args = get_serving_args(self.basedir)
+
+        for name in sorted(os.listdir(self.basedir)):
+            model_dir = os.path.join(self.basedir, name)
+            if os.path.isfile(os.path.join(model_dir, 'sockeye-args.txt')):
+                self.model_dirs[name] = model_dir
+                self.langs[name] = get_serving_args(model_dir).lang or name
+
+        if not self.model_dirs:
+            raise ValueError(f'No models found in {self.basedir}')
+        if self.serving_args.default_model is not None and self.serving_args.default_model not in self.model_dirs:
+            raise ValueError(f'Unknown default model {self.serving_args.default_model}')
+
+        logging.info(f'Routing requests to the models {", ".join(self.model_dirs)}')
+        self.initialized = True
+
+    def route(self, req):
+        """
+        Returns the name of the model that translates a request
+
+        :param req: a JSON request
+        :return: a model name
+        """
+        body = req.get('body')
+        fields = body if isinstance(body, dict) else req
+
+        name = fields.get('model')
+        lang = fields.get('lang')
+        if isinstance(name, (bytes, bytearray)):
+            name = name.decode('utf-8')
+        if isinstance(lang, (bytes, bytearray)):
+            lang = lang.decode('utf-8')
+
+        if name is not None:
+            if name not in self.model_dirs:
+                raise ValueError(f'Unknown model {name}')
+            return name
+        if lang is not None:
+            for name, model_lang in self.langs.items():
+                if model_lang == lang:
+                    return name
+            raise ValueError(f'No model for language {lang}')
+        return self.serving_args.default_model or next(iter(self.model_dirs))
+
+    def get_handler(self, name, context):
+        """
+        Returns the handler of a model, loading it and unloading the least recently used models if necessary
+
+        :param name: model name
+        :param context: model server context
+        :return: an initialized handler
+        """
+        if name in self.loaded:
+            self.loaded.move_to_end(name)
+            return self.loaded[name]
+
+        self.evict(self.model_size(name))
+
+        lang = self.langs[name]
+        handler = HANDLERS.get(lang, DefaultHandler)()
+        handler.handle(None, ModelContext(context, lang, self.model_dirs[name]))
+        self.loaded[name] = handler
+        logging.info(f'Loaded model {name} ({lang}), {len(self.loaded)} models loaded')
+        return handler
+
+    def model_size(self, name):
+        """
+        Estimates the memory used by a model from the size of its parameter files
+
+        :param name: model name
+        :return: the size in megabytes
+        """
+        model_dir = self.model_dirs[name]
+        files = [os.path.join(model_dir, f) for f in os.listdir(model_dir) if f.startswith('params.')]
+        return sum(os.path.getsize(f) for f in files) / 2 ** 20
+
+    def evict(self, size):
+        """
+        Unloads the least recently used models until another model fits into the limits
+
+        :param size: the size of the model to load in megabytes
+        """
+        args = self.serving_args
+        evicted = False
+        while self.loaded:
+            too_many = 0 < args.max_models <= len(self.loaded)
+            too_large = args.memory_budget > 0 and \
+                sum(self.model_size(n) for n in self.loaded) + size > args.memory_budget
+            if not too_many and not too_large:
+                break
+
+            name, handler = self.loaded.popitem(last=False)
+            handler.close()
+            evicted = True
+            logging.info(f'Unloaded model {name}')
+
+        if evicted:
+            gc.collect()
+
+    def handle(self, data, context):
+        """
+        Custom service entry point function. The requests of a batch are grouped by model,
+        and the responses are returned in the order of the requests.
+
+        :param data: list of objects, raw input from request
+        :param context: model server context
+        :return: list of outputs to be send back to client
+        """
+        if not self.initialized:
+            self.initialize(context)
+            # load the default model with the worker, and the others on first use
+            self.get_handler(self.route({}), context)
+
+        if data is None:
+            return None
+
+        try:
+            res = [None] * len(data)
+            groups = OrderedDict()
+            for i, req in enumerate(data):
+                # a request for an unknown model or language is rejected on its own
+                try:
+                    name = self.route(req)
+                except ValueError as e:
+                    report_status(context, BAD_REQUEST_STATUS, str(e), i)
+                    res[i] = str(e)
+                    continue
+                groups.setdefault(name, []).append(i)
+
+            for name, indices in groups.items():
+                handler = self.get_handler(name, context)
+                outputs = handler.handle([data[i] for i in indices], BatchContext(context, indices))
+                for i, output in zip(indices, outputs):
+                    res[i] = output
+            return res
+
+        except Exception as e:
+            logging.error(e, exc_info=True)
+            request_processor = context.request_processor
+            request_processor.report_status(500, "Unknown inference error")
+            return [str(e)] * self._batch_size
+
+
+_service = RouterHandler()
+
+
+def handle(data, context):
+    return encode_responses(_service.handle(data, context), context)
@@ -0,0 +1,86 @@
+import bisect
+import logging
+from typing import Iterator, List
+
+
+class BatchScheduler:
+    """
+    Splits the sentences to translate into decoder batches. Sentences are sorted by length, longest first,
+    and a batch is closed when it reaches the batch size or when its padded length would exceed the token budget.
+    With a latency target, the batch size is halved when a batch takes longer than the target,
+    and grown by one sentence when a full batch takes less than 80% of it, up to the translator's batch size.
+    """
+
+    def __init__(self, max_batch_size: int, buckets: List[int], token_budget: int = 0, latency_target: float = 0):
+        """
+        :param max_batch_size: the batch size of the translator
+        :param buckets: the source buckets of the translator
+        :param token_budget: maximum number of source tokens in a batch including padding; 0 means no limit
+        :param latency_target: milliseconds a batch should take to translate; 0 keeps the batch size fixed
+        """
+        self.max_batch_size = max_batch_size
+        self.buckets = sorted(buckets)
+        self.token_budget = token_budget
+        self.latency_target = latency_target
+        self.batch_size = max_batch_size
+
+    @property
+    def fill_up(self) -> bool:
+        """
+        Whether the translator should pad batches to its batch size, which it does unless batches are right-sized
+        """
+        return not self.token_budget and not self.latency_target
+
+    def bucket(self, length: int) -> int:
+        """
+        Returns the length a sentence is padded to, like ``sockeye.data_io.get_bucket``
+
+        :param length: number of tokens
+        :return: the length of the smallest bucket that fits the sentence, or the length itself if none does
+        """
+        i = bisect.bisect_left(self.buckets, length)
+        return self.buckets[i] if i < len(self.buckets) else length
+
+    def padded_tokens(self, batch_size: int, length: int) -> int:
+        """
+        Returns the number of source tokens the translator decodes for a batch, including padding
+
+        :param batch_size: number of sentences
+        :param length: length of the longest sentence
+        """
+        return (self.max_batch_size if self.fill_up else batch_size) * self.bucket(length)
+
+    def batches(self, lengths: List[int]) -> Iterator[List[int]]:
+        """
+        Groups sentences into batches
+
+        :param lengths: the number of tokens of each sentence
+        :return: an iterator over lists of sentence indices, longest sentences first
+        """
+        batch = []  # type: List[int]
+        for i in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+            # the first sentence of a batch is the longest, so it determines the padded length
+            if batch and (len(batch) >= self.batch_size or
+                          self.token_budget and (len(batch) + 1) * self.bucket(lengths[batch[0]]) > self.token_budget):
+                yield batch
+                batch = []
+            batch.append(i)
+        if batch:
+            yield batch
+
+    def observe(self, batch_size: int, elapsed: float):
+        """
+        Adapts the batch size to the time it took to translate a batch
+
+        :param batch_size: number of sentences in the batch
+        :param elapsed: milliseconds
+        """
+        if not self.latency_target:
+            return
+
+        if elapsed > self.latency_target and self.batch_size > 1:
+            self.batch_size = max(1, self.batch_size // 2)
+            logging.debug(f'Batch of {batch_size} took {elapsed:.1f}ms, reducing the batch size to {self.batch_size}')
+        elif elapsed < 0.8 * self.latency_target and batch_size >= self.batch_size and \
+                self.batch_size < self.max_batch_size:
+            self.batch_size += 1
@@ -30,6 +30,7 @@ my $HELP = 0;
 
 while (@ARGV) {
   $_ = shift;
+  /^-b$/ && ($| = 1, next);
   /^-l$/ && ($language = shift, next);
   /^-v$/ && ($QUIET = 0, next);
   /^-h$/ && ($HELP = 1, next);
@@ -37,6 +38,8 @@ while (@ARGV) {
 
 if ($HELP) {
   print "Usage ./detokenizer.perl (-l [en|de|...]) < tokenizedfile > detokenizedfile\n";
+  print "Options:\n";
+  print "  -b     ... disable Perl buffering.\n";
   exit;
 }
 if (!$QUIET) {
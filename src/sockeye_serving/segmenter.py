@@ -0,0 +1,90 @@
+from typing import List
+
+import regex as re
+
+from .moses import NONBREAKING, NUMERIC_ONLY, load_prefixes
+
+
+class SentenceSplitter:
+    """
+    Splits documents into paragraphs and sentences following the rules of the Moses sentence splitter.
+    Every line of a document is treated as a paragraph so that line breaks can be restored after translation.
+    """
+
+    # characters that may precede the first letter of a sentence
+    starter = r'[\'\"\(\[¿¡\p{Pi}]'
+
+    # non-period end of sentence markers (?!) followed by sentence starters
+    question_exclamation = re.compile(rf'([?!]) +({starter}*[\p{{Uppercase}}])')
+    # multi-dots followed by sentence starters
+    multi_dot = re.compile(rf'(\.[\.]+) +({starter}*[\p{{Uppercase}}])')
+    # punctuation inside a quote or parenthetical followed by a possible sentence starter and upper case
+    quoted_end = re.compile(rf'([?!\.][\ ]*[\'\"\)\]\p{{Pf}}]+) +({starter}*[\ ]*[\p{{Uppercase}}])')
+    # punctuation followed by sentence starter punctuation and upper case
+    punct_starter = re.compile(rf'([?!\.]) +({starter}+[\ ]*[\p{{Uppercase}}])')
+    # full-width terminators in CJK text, which are not followed by spaces
+    cjk_end = re.compile(r'([。！？]+[”’」』）]*) *(?=\S)')
+
+    period_word = re.compile(r'([\p{Alnum}\.\-]*)([\'\"\)\]\%\p{Pf}]*)(\.+)$')
+    acronym = re.compile(r'(\.)[\p{Uppercase}\-]+(\.+)$')
+    next_starter = re.compile(rf'^([ ]*{starter}*[ ]*[\p{{Uppercase}}0-9])')
+    starts_digit = re.compile(r'^[0-9]+')
+    spaces = re.compile(r' +')
+    whitespace = re.compile(r'\s+')
+
+    def __init__(self, lang: str, prefixes_path: str):
+        """
+        :param lang: language code
+        :param prefixes_path: the ``nonbreaking_prefixes`` directory
+        """
+        self.lang = lang
+        self.prefixes = load_prefixes(prefixes_path, lang)
+
+    def split(self, paragraph: str) -> List[str]:
+        """
+        Splits a paragraph into sentences
+
+        :param paragraph: a single line of text
+        :return: a list of sentences, which is empty if the paragraph is blank
+        """
+        text = self.whitespace.sub(' ', paragraph).strip()
+        if not text:
+            return []
+
+        text = self.question_exclamation.sub('\\1\n\\2', text)
+        text = self.multi_dot.sub('\\1\n\\2', text)
+        text = self.quoted_end.sub('\\1\n\\2', text)
+        text = self.punct_starter.sub('\\1\n\\2', text)
+        text = self.cjk_end.sub('\\1\n', text)
+
+        # special punctuation cases are covered, check all remaining periods
+        words = text.split(' ')
+        for i in range(len(words) - 1):
+            m = self.period_word.search(words[i])
+            if not m:
+                continue
+
+            prefix, starting_punct = m.group(1), m.group(2)
+            kind = self.prefixes.get(prefix) if prefix else None
+            if kind == NONBREAKING and not starting_punct:
+                # known honorific
+                continue
+            elif self.acronym.search(words[i]):
+                # upper case acronym
+                continue
+            elif self.next_starter.match(words[i + 1]):
+                # the next word starts with upper case or a number, unless this is a numeric-only prefix
+                if not (kind == NUMERIC_ONLY and not starting_punct and self.starts_digit.match(words[i + 1])):
+                    words[i] += '\n'
+
+        text = self.spaces.sub(' ', ' '.join(words))
+        return [s.strip() for s in text.split('\n') if s.strip()]
+
+    def split_paragraphs(self, text: str) -> List[List[str]]:
+        """
+        Splits a document into paragraphs of sentences
+
+        :param text: a document
+        :return: one list of sentences for each line of the document
+        """
+        return [self.split(line) for line in text.split('\n')]
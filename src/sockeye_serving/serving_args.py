@@ -0,0 +1,208 @@
+import argparse
+import os
+from typing import Tuple
+
+from .pipeline import POOL_PROCESS, POOL_THREAD
+from .utils import read_sockeye_args
+from .word_segmenter import MAX_MATCH, VITERBI
+
+SERVING_ARGS_FILE = 'serving-args.txt'
+
+
+def add_cache_args(params):
+    cache_params = params.add_argument_group('Translation cache')
+    cache_params.add_argument('--cache-size', type=int, default=10000,
+                              help='maximum number of cached sentence translations; 0 disables the cache')
+    cache_params.add_argument('--cache-ttl', type=float, default=None,
+                              help='seconds after which a cached translation expires')
+    cache_params.add_argument('--cache-path', default=None,
+                              help='SQLite file that holds a cache shared by all workers on a host')
+
+
+def add_tokenization_args(params):
+    tokenization_params = params.add_argument_group('Tokenization')
+    tokenization_params.add_argument('--moses-perl', action='store_true',
+                                     help='tokenize and detokenize with the Moses Perl scripts, which run as '
+                                          'persistent co-processes, instead of their Python port; slower, but a '
+                                          'fallback for models whose training data the port does not reproduce')
+
+
+def add_bpe_args(params):
+    bpe_params = params.add_argument_group('BPE')
+    bpe_params.add_argument('--bpe-cache-size', type=int, default=50000,
+                            help='maximum number of words whose BPE segmentation is cached; 0 disables the cache')
+
+
+def add_pipeline_args(params):
+    pipeline_params = params.add_argument_group('Pipeline')
+    pipeline_params.add_argument('--pipeline-workers', type=int, default=0,
+                                 help='number of workers that preprocess and postprocess text while other sentences '
+                                      'are decoded; 0 runs all stages one after another')
+    pipeline_params.add_argument('--pipeline-pool', choices=[POOL_THREAD, POOL_PROCESS], default=POOL_THREAD,
+                                 help='run the pipeline workers as threads or as forked processes')
+    pipeline_params.add_argument('--pipeline-chunk-size', type=int, default=0,
+                                 help='number of sentences processed by a worker at a time; '
+                                      '0 uses the batch size of the translator')
+
+
+def add_word_segmentation_args(params):
+    segmentation_params = params.add_argument_group('Word segmentation')
+    segmentation_params.add_argument('--word-dict', default=None,
+                                     help='dictionary in the model directory with a word and a frequency on each '
+                                          'line, e.g. from jieba, which the Chinese and Korean handlers use to '
+                                          'segment text into words instead of characters; the model must be trained '
+                                          'on text segmented with the same dictionary')
+    segmentation_params.add_argument('--word-segmentation', choices=[VITERBI, MAX_MATCH], default=VITERBI,
+                                     help='segment into the most probable words, or take the longest word at '
+                                          'each position')
+
+
+def add_batching_args(params):
+    batching_params = params.add_argument_group('Batching')
+    batching_params.add_argument('--batch-token-budget', type=int, default=0,
+                                 help='maximum number of source tokens in a decoder batch, including padding; '
+                                      '0 means no limit')
+    batching_params.add_argument('--batch-latency-target', type=float, default=0,
+                                 help='milliseconds a decoder batch should take; the batch size is reduced when '
+                                      'batches are slower and increased up to the batch size of the translator when '
+                                      'they are faster; 0 keeps the batch size fixed')
+
+
+def add_lexicon_args(params):
+    lexicon_params = params.add_argument_group('Vocabulary restriction')
+    lexicon_params.add_argument('--lexicon-topk', type=int, default=None,
+                                help='number of target words per source word to load from lexicon.npy in the model '
+                                     'directory; defaults to --restrict-lexicon-topk in sockeye-args.txt, or to all '
+                                     'of them; check the BLEU with benchmarks/lexicon.py')
+    lexicon_params.add_argument('--no-lexicon', action='store_true',
+                                help='do not restrict the target vocabulary with lexicon.npy')
+    lexicon_params.add_argument('--lexicon-log', default=None,
+                                help='file to append the tokens and alignments of translated sentences to, from '
+                                     'which python -m sockeye_serving.lexicon builds a lexicon; '
+                                     '{pid} is replaced by the process ID of the worker')
+
+
+def decoding_profile(value: str) -> Tuple[str, int]:
+    """
+    Parses a decoding profile of the form NAME:BEAM_SIZE
+    """
+    name, sep, beam_size = value.partition(':')
+    if not name or not sep or not beam_size.isdigit() or int(beam_size) < 1:
+        raise argparse.ArgumentTypeError(f'Decoding profiles must have the form NAME:BEAM_SIZE, got {value}')
+    return name, int(beam_size)
+
+
+def add_memory_args(params):
+    memory_params = params.add_argument_group('Translation memory')
+    memory_params.add_argument('--memory', default=None,
+                               help='translation memory in the model directory, compiled with '
+                                    '"python -m sockeye_serving.translation_memory build"; sentences that are similar '
+                                    'to one in it are translated by adapting its translation')
+    memory_params.add_argument('--memory-size', type=int, default=0,
+                               help='number of recent translations that the worker keeps in memory '
+                                    'and adds to the translation memory')
+    memory_params.add_argument('--memory-threshold', type=float, default=0.9,
+                               help='minimum similarity of a sentence from the translation memory, i.e. the ratio of '
+                                    'matching tokens')
+    memory_params.add_argument('--memory-constraints', action='store_true',
+                               help='decode sentences whose match can only partly be adapted with the new tokens as '
+                                    'constraints')
+
+
+def add_profile_args(params):
+    profile_params = params.add_argument_group('Decoding profiles')
+    profile_params.add_argument('--decoding-profile', type=decoding_profile, action='append', default=[],
+                                metavar='NAME:BEAM_SIZE',
+                                help='a decoding profile that requests can select with their "profile" field; '
+                                     'the beam size must not exceed the one in sockeye-args.txt, since all profiles '
+                                     'share the loaded model; can be given several times')
+    profile_params.add_argument('--downgrade-profile', default=None,
+                                help='profile for requests without a "profile" field when a batch has more than '
+                                     '--downgrade-sentences sentences')
+    profile_params.add_argument('--downgrade-sentences', type=int, default=0,
+                                help='number of sentences in a batch above which requests are downgraded')
+
+
+def add_admission_args(params):
+    admission_params = params.add_argument_group('Admission control')
+    admission_params.add_argument('--request-cost-budget', type=int, default=0,
+                                  help='maximum cost of a request, estimated as its source tokens times the beam size '
+                                       'times one plus its number of constraints; requests over the budget get '
+                                       'status 413; 0 means no limit')
+    admission_params.add_argument('--batch-cost-budget', type=int, default=0,
+                                  help='maximum cost of the requests of a batch; requests that do not fit get '
+                                       'status 503; 0 means no limit')
+    admission_params.add_argument('--over-budget', choices=['reject', 'downgrade'], default='reject',
+                                  help='whether requests over budget are rejected, or first downgraded to '
+                                       '--downgrade-profile if that makes them fit')
+
+
+def add_response_args(params):
+    response_params = params.add_argument_group('Responses')
+    response_params.add_argument('--response-fields', nargs='+', default=None, metavar='FIELD',
+                                 help='fields of the responses to requests without a "fields" field, e.g. '
+                                      '"translation" for compact responses; defaults to all fields')
+
+
+def add_metrics_args(params):
+    metrics_params = params.add_argument_group('Metrics')
+    metrics_params.add_argument('--metrics-file', default=None,
+                                help='file to write metrics to in the Prometheus text format after every batch; '
+                                     '{pid} is replaced by the process ID of the worker')
+    metrics_params.add_argument('--metrics-port', type=int, default=None,
+                                help='port to serve metrics on at /metrics in the Prometheus text format')
+
+
+def add_warm_up_args(params):
+    warm_up_params = params.add_argument_group('Warm-up')
+    warm_up_params.add_argument('--no-warm-up', action='store_true',
+                                help='do not translate a batch of every bucket size when the model is loaded, '
+                                     'which makes the first requests of each size slower')
+
+
+def add_routing_args(params):
+    routing_params = params.add_argument_group('Routing')
+    routing_params.add_argument('--lang', default=None,
+                                help='language of a model served by router_handler, which selects its preprocessing '
+                                     'and matches the "lang" field of requests; defaults to the directory name')
+    routing_params.add_argument('--default-model', default=None,
+                                help='model of router_handler that translates requests without a "model" or "lang" '
+                                     'field; defaults to the first model in alphabetical order')
+    routing_params.add_argument('--max-models', type=int, default=0,
+                                help='maximum number of models that router_handler keeps loaded; 0 means no limit')
+    routing_params.add_argument('--memory-budget', type=float, default=0,
+                                help='megabytes of model parameters that router_handler keeps loaded; '
+                                     'the least recently used models are unloaded first; 0 means no limit')
+
+
+def add_serving_args(params):
+    add_cache_args(params)
+    add_tokenization_args(params)
+    add_bpe_args(params)
+    add_pipeline_args(params)
+    add_word_segmentation_args(params)
+    add_batching_args(params)
+    add_lexicon_args(params)
+    add_memory_args(params)
+    add_profile_args(params)
+    add_admission_args(params)
+    add_response_args(params)
+    add_metrics_args(params)
+    add_warm_up_args(params)
+    add_routing_args(params)
+
+
+def get_serving_args(basedir: str) -> argparse.Namespace:
+    """
+    Reads the handler options stored in the model directory, if any
+
+    :param basedir: model directory
+    :return: the parsed options
+    """
+    params = argparse.ArgumentParser(description='sockeye-serving handler options')
+    add_serving_args(params)
+
+    serving_args_path = os.path.join(basedir, SERVING_ARGS_FILE)
+    if os.path.isfile(serving_args_path):
+        return params.parse_args(read_sockeye_args(serving_args_path))
+    return params.parse_args([])
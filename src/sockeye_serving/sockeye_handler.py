@@ -9,10 +9,14 @@
 # permissions and limitations under the License.
 
 
+import copy
 import logging
 import os
+import time
+from collections import OrderedDict
 from contextlib import ExitStack
 
+import numpy as np
 from sockeye import arguments
 from sockeye import constants as const
 from sockeye import inference
@@ -20,7 +24,30 @@ from sockeye.lexicon import TopKLexicon
 from sockeye.output_handler import get_output_handler
 from sockeye.utils import check_condition, log_basic_info, determine_context
 
-from .utils import create_request, decode_bytes, get_file_data, get_request, read_sockeye_args
+from .admission import ADMIT, COST_BUCKETS, DOWNGRADE, REJECT, REJECT_STATUS, SHED_STATUS, AdmissionControl
+from .artifacts import ARTIFACTS_DIR, artifact_path, save_atomic
+from .cache import SqliteTranslationCache, TranslationCache, cache_key, cache_namespace
+from .lexicon import LEXICON_FILE, format_alignment
+from .metrics import MILLISECONDS, PERCENT, HandlerMetrics
+from .pipeline import POSTPROCESS, PREPROCESS, ProcessorPool
+from .scheduler import BatchScheduler
+from .serving_args import get_serving_args
+from .text_processor import BpeEncoder, ProcessorChain
+from .translation_memory import TranslationMemory, repair
+from .utils import create_request, decode_bytes, get_file_data, get_request, iter_lines, read_sockeye_args, \
+    report_status
+from .word_segmenter import WordSegmenter, WordTrie, build_trie, read_dictionary
+
+BPE_CODES_FILE = 'bpe-codes.txt'
+BPE_WORD_FREQS_FILE = 'bpe-word-freqs.txt'
+
+# how an input is decoded
+UNCONSTRAINED = 'unconstrained'
+CONSTRAINED = 'constrained'
+AVOID = 'avoid'
+
+# HTTP status of invalid requests
+BAD_REQUEST_STATUS = 400
 
 
 class SockeyeHandler(object):
@@ -32,12 +59,29 @@ class SockeyeHandler(object):
         self._context = None
         self._batch_size = 0
         self.error = None
+        self.admission = None
         self.basedir = None
+        self.cache = None
+        self.cache_namespaces = {}
         self.initialized = False
+        self.item_counts = []
+        self.lexicon_log = None
+        self.memory = None
+        self.metrics = HandlerMetrics()
+        self.metrics_server = None
+        self.pool = None
+        self.profiles = {}
+        self.rejected = {}
+        self.scheduler = None
+        self.schedulers = {}
         self.postprocessor = None
         self.preprocessor = None
+        self.segmenter = None
         self.sentence_id = 0
+        self.serving_args = None
+        self.sockeye_args = None
         self.translator = None
+        self.word_segmenter = None
 
     def initialize(self, context):
         """
@@ -49,9 +93,33 @@ class SockeyeHandler(object):
         self._context = context
         self._batch_size = context.system_properties['batch_size']
         self.basedir = context.system_properties['model_dir']
+        self.serving_args = get_serving_args(self.basedir)
+        self.metrics.model_name = context.model_name
+        if self.serving_args.metrics_port:
+            self.metrics_server = self.metrics.serve_prometheus(self.serving_args.metrics_port)
+        self.init_processors(context)
+        # fork the workers of a process pool before MXNet starts its threads
+        self.pool = self.get_pool()
         self.translator = self.get_translator(context)
+        self.scheduler = BatchScheduler(self.translator.max_batch_size, self.translator.buckets_source,
+                                        self.serving_args.batch_token_budget, self.serving_args.batch_latency_target)
+        self.schedulers = {(None, UNCONSTRAINED): self.scheduler}
+        self.cache = self.get_cache()
+        self.memory = self.get_translation_memory()
+        self.admission = self.get_admission_control()
+        if self.serving_args.lexicon_log:
+            self.lexicon_log = open(self.serving_args.lexicon_log.format(pid=os.getpid()), 'a', encoding='utf-8')
         self.initialized = True
 
+    def init_processors(self, context):
+        """
+        Creates the preprocessor, postprocessor and sentence segmenter of the handler.
+        This is called before the model is loaded.
+
+        :param context: Initial context contains model server system properties.
+        """
+        pass
+
     def get_translator(self, context):
         """
         Returns a translator for the given context
@@ -65,6 +133,13 @@ class SockeyeHandler(object):
         sockeye_args = params.parse_args(read_sockeye_args(sockeye_args_path))
         # override models directory
         sockeye_args.models = [self.basedir]
+        lexicon_path = os.path.join(self.basedir, LEXICON_FILE)
+        if sockeye_args.restrict_lexicon is None and not self.serving_args.no_lexicon and os.path.isfile(lexicon_path):
+            # restrict the target vocabulary with the lexicon built for the model
+            sockeye_args.restrict_lexicon = [(LEXICON_FILE, lexicon_path)]
+        if self.serving_args.lexicon_topk is not None:
+            sockeye_args.restrict_lexicon_topk = self.serving_args.lexicon_topk
+        self.sockeye_args = sockeye_args
 
         device_ids = []
         if 'gpu_id' in context.system_properties:
@@ -113,18 +188,18 @@ class SockeyeHandler(object):
                 logging.info(str(sockeye_args.restrict_lexicon))
                 if len(sockeye_args.restrict_lexicon) == 1:
                     # Single lexicon used for all inputs
-                    restrict_lexicon = TopKLexicon(source_vocabs[0], target_vocab)
                     # Handle a single arg of key:path or path (parsed as path:path)
-                    restrict_lexicon.load(sockeye_args.restrict_lexicon[0][1], k=sockeye_args.restrict_lexicon_topk)
+                    restrict_lexicon = self.load_lexicon(source_vocabs[0], target_vocab,
+                                                         sockeye_args.restrict_lexicon[0][1],
+                                                         sockeye_args.restrict_lexicon_topk)
                 else:
                     check_condition(sockeye_args.json_input,
                                     'JSON input is required when using multiple lexicons for vocabulary restriction')
                     # Multiple lexicons with specified names
                     restrict_lexicon = dict()
                     for key, path in sockeye_args.restrict_lexicon:
-                        lexicon = TopKLexicon(source_vocabs[0], target_vocab)
-                        lexicon.load(path, k=sockeye_args.restrict_lexicon_topk)
-                        restrict_lexicon[key] = lexicon
+                        restrict_lexicon[key] = self.load_lexicon(source_vocabs[0], target_vocab, path,
+                                                                  sockeye_args.restrict_lexicon_topk)
 
             store_beam = sockeye_args.output_type == const.OUTPUT_HANDLER_BEAM_STORE
 
@@ -148,93 +223,761 @@ class SockeyeHandler(object):
             if brevity_penalty_weight != 0.0:
                 brevity_penalty = inference.BrevityPenalty(brevity_penalty_weight)
 
-            return inference.Translator(context=translator_ctx,
-                                        ensemble_mode=sockeye_args.ensemble_mode,
-                                        bucket_source_width=sockeye_args.bucket_width,
-                                        length_penalty=inference.LengthPenalty(sockeye_args.length_penalty_alpha,
-                                                                               sockeye_args.length_penalty_beta),
-                                        beam_prune=sockeye_args.beam_prune,
-                                        beam_search_stop=sockeye_args.beam_search_stop,
-                                        nbest_size=sockeye_args.nbest_size,
-                                        models=models,
-                                        source_vocabs=source_vocabs,
-                                        target_vocab=target_vocab,
-                                        restrict_lexicon=restrict_lexicon,
-                                        avoid_list=sockeye_args.avoid_list,
-                                        store_beam=store_beam,
-                                        strip_unknown_words=sockeye_args.strip_unknown_words,
-                                        skip_topk=sockeye_args.skip_topk,
-                                        sample=sockeye_args.sample,
-                                        constant_length_ratio=constant_length_ratio,
-                                        brevity_penalty=brevity_penalty)
+            translator_args = dict(context=translator_ctx,
+                                   ensemble_mode=sockeye_args.ensemble_mode,
+                                   bucket_source_width=sockeye_args.bucket_width,
+                                   length_penalty=inference.LengthPenalty(sockeye_args.length_penalty_alpha,
+                                                                          sockeye_args.length_penalty_beta),
+                                   beam_prune=sockeye_args.beam_prune,
+                                   beam_search_stop=sockeye_args.beam_search_stop,
+                                   nbest_size=sockeye_args.nbest_size,
+                                   models=models,
+                                   source_vocabs=source_vocabs,
+                                   target_vocab=target_vocab,
+                                   restrict_lexicon=restrict_lexicon,
+                                   avoid_list=sockeye_args.avoid_list,
+                                   store_beam=store_beam,
+                                   strip_unknown_words=sockeye_args.strip_unknown_words,
+                                   skip_topk=sockeye_args.skip_topk,
+                                   sample=sockeye_args.sample,
+                                   constant_length_ratio=constant_length_ratio,
+                                   brevity_penalty=brevity_penalty)
 
-    def preprocess(self, batch):
+            self.profiles = self.get_profiles(translator_args)
+            return inference.Translator(**translator_args)
+
+    def get_profiles(self, translator_args):
         """
-        Preprocesses a JSON request for translation.
+        Creates a translator for each decoding profile. The translators share the models of the default translator,
+        whose modules are bound for the largest beam, so a profile only changes the beam size.
+
+        :param translator_args: the arguments of the default translator
+        :return: a translator for each profile name
+        """
+        models = translator_args['models']
+        profiles = {}
+        for name, beam_size in self.serving_args.decoding_profile:
+            check_condition(beam_size <= self.sockeye_args.beam_size,
+                            f'The beam size of profile {name} must not exceed {self.sockeye_args.beam_size}')
+            for model in models:
+                model.beam_size = beam_size
+            profiles[name] = inference.Translator(**dict(translator_args,
+                                                         nbest_size=min(beam_size, self.sockeye_args.nbest_size)))
+            logging.info(f'Decoding profile {name} with beam size {beam_size}')
+
+        for model in models:
+            model.beam_size = self.sockeye_args.beam_size
+
+        downgrade = self.serving_args.downgrade_profile
+        check_condition(downgrade is None or downgrade in profiles, f'Unknown downgrade profile {downgrade}')
+        return profiles
+
+    def load_lexicon(self, source_vocab, target_vocab, path, k):
+        """
+        Loads a top-k lexicon. Sockeye sorts the entries of every source word when it loads a lexicon, which is slow
+        for large vocabularies, so the sorted lexicon is saved in the model directory and memory-mapped on later starts.
+
+        :param source_vocab: source vocabulary of the model
+        :param target_vocab: target vocabulary of the model
+        :param path: lexicon file in Sockeye's format
+        :param k: number of target words to keep for each source word
+        :return: a lexicon
+        """
+        lexicon = TopKLexicon(source_vocab, target_vocab)
+        artifact = artifact_path(os.path.join(self.basedir, ARTIFACTS_DIR), 'lexicon', [path], 'npy',
+                                 k=k, source_vocab_size=len(source_vocab))
+        if os.path.isfile(artifact):
+            try:
+                lexicon.lex = np.load(artifact, mmap_mode='r')
+                logging.info(f'Loaded top-k lexicon from {artifact}')
+                return lexicon
+            except (OSError, ValueError) as e:
+                logging.warning(f'Could not load {artifact}, rebuilding it: {e}')
+
+        lexicon.load(path, k=k)
+        save_atomic(artifact, lambda f: np.save(f, lexicon.lex))
+        return lexicon
+
+    def get_admission_control(self):
+        """
+        Returns the admission control of the handler, which downgrades requests over budget to the beam size of
+        the downgrade profile if so configured
+        """
+        args = self.serving_args
+        downgrade_beam_size = None
+        if args.over_budget == 'downgrade':
+            check_condition(args.downgrade_profile is not None, '--over-budget downgrade requires --downgrade-profile')
+            downgrade_beam_size = self.profiles[args.downgrade_profile].beam_size
+        return AdmissionControl(args.request_cost_budget, args.batch_cost_budget, downgrade_beam_size)
+
+    def get_cache(self):
+        """
+        Returns a translation cache, or None if caching is disabled or decoding is not deterministic
+        :return:
+        """
+        args = self.serving_args
+        if args.cache_size <= 0 or self.sockeye_args.sample or self.translator.nbest_size > 1:
+            return None
+
+        self.cache_namespaces = {None: cache_namespace(self.sockeye_args)}
+        for name, translator in self.profiles.items():
+            sockeye_args = copy.copy(self.sockeye_args)
+            sockeye_args.beam_size = translator.beam_size
+            self.cache_namespaces[name] = cache_namespace(sockeye_args)
+        if args.cache_path:
+            return SqliteTranslationCache(args.cache_path, args.cache_size, args.cache_ttl)
+        return TranslationCache(args.cache_size, args.cache_ttl)
+
+    def get_translation_memory(self):
+        """
+        Returns the translation memory given by --memory, with up to --memory-size recent translations
+        :return: a translation memory, or None if there is none or decoding is not deterministic
+        """
+        args = self.serving_args
+        if args.memory is None and args.memory_size <= 0:
+            return None
+        if self.sockeye_args.sample or self.translator.nbest_size > 1:
+            return None
+
+        kwargs = dict(max_entries=args.memory_size, threshold=args.memory_threshold)
+        if args.memory is None:
+            return TranslationMemory(**kwargs)
+        path = os.path.join(self.basedir, args.memory)
+        memory = TranslationMemory.load(path, **kwargs)
+        logging.info(f'Loaded {len(memory)} sentences from the translation memory {path}')
+        return memory
+
+    def get_bpe_encoder(self):
+        """
+        Returns a BPE encoder for the codes in the model directory, whose word cache is filled from
+        ``bpe-word-freqs.txt`` if the model directory has one
+        :return: a BPE encoder, or None if the model does not use BPE
+        """
+        bpe_codes = os.path.join(self.basedir, BPE_CODES_FILE)
+        if not os.path.isfile(bpe_codes):
+            return None
+
+        word_freqs = os.path.join(self.basedir, BPE_WORD_FREQS_FILE)
+        return BpeEncoder(bpe_codes,
+                          cache_size=self.serving_args.bpe_cache_size,
+                          word_freqs_file=word_freqs if os.path.isfile(word_freqs) else None,
+                          artifacts_dir=os.path.join(self.basedir, ARTIFACTS_DIR))
+
+    def get_word_segmenter(self):
+        """
+        Returns a word segmenter for the dictionary given by ``--word-dict``. The dictionary is compiled into a trie
+        in the artifacts directory, which is memory-mapped so that the workers share it.
+        :return: a word segmenter, or None if text is segmented into characters
+        """
+        if self.serving_args.word_dict is None:
+            return None
+
+        path = os.path.join(self.basedir, self.serving_args.word_dict)
+        artifact = artifact_path(os.path.join(self.basedir, ARTIFACTS_DIR), 'words', [path], 'trie')
+        if os.path.isfile(artifact):
+            trie = WordTrie.load(artifact)
+        else:
+            data = build_trie(read_dictionary(path))
+            save_atomic(artifact, lambda f: f.write(data))
+            trie = WordTrie.load(artifact) if os.path.isfile(artifact) else WordTrie(data)
+        logging.info(f'Segmenting words with {path}')
+        return WordSegmenter(trie, self.serving_args.word_segmentation)
+
+    def get_scheduler(self, profile, kind):
+        """
+        Returns the batch scheduler of the inputs of a decoding profile and kind. Each group adapts its batch size to
+        its own latency, since constrained decoding and larger beams are slower than the default.
+
+        :param profile: a profile name, or None for the default profile
+        :param kind: CONSTRAINED, AVOID or UNCONSTRAINED
+        :return: a batch scheduler
+        """
+        key = (profile, kind)
+        if key not in self.schedulers:
+            self.schedulers[key] = BatchScheduler(self.scheduler.max_batch_size, self.scheduler.buckets,
+                                                  self.scheduler.token_budget, self.scheduler.latency_target)
+        return self.schedulers[key]
+
+    def get_pool(self):
+        """
+        Creates the worker pool for text processing
+        :return: a processor pool, or None if text processing is not pipelined
+        """
+        args = self.serving_args
+        if args.pipeline_workers <= 0:
+            return None
+        return ProcessorPool(self.preprocessor, self.postprocessor, args.pipeline_workers, args.pipeline_pool)
+
+    def read_requests(self, batch):
+        """
+        Reads the requests of a batch and splits their text into sentences. The items of requests with several texts
+        are read as requests of their own. Invalid requests and items are kept in ``rejected`` by their position.
 
         :param batch: a list of JSON requests
-        :return: a list of input strings to translate
+        :return: a list of requests, where 'segments' holds the sentences of each paragraph
         """
-        reqs = []
+        items = []
+        self.item_counts = []
         for x in batch:
-            data = get_file_data(x)
+            with self.metrics.time('RequestDecodeTime'):
+                r = get_request(x)
+                if r is None:
+                    data = get_file_data(x)
+                    r = self.read_file(data) if data else None
 
-            if data:
-                r = create_request(decode_bytes(data))
+            if isinstance(r, list):
+                self.item_counts.append(len(r))
+                items.extend(r)
             else:
-                r = get_request(x)
+                self.item_counts.append(None)
+                items.append(r)
+
+        reqs = []
+        positions = []
+        self.rejected = {}
+        for i, r in enumerate(items):
+            try:
+                self.check_request(r)
+            except ValueError as e:
+                self.rejected[i] = BAD_REQUEST_STATUS, str(e)
+                self.metrics.add('InvalidRequests', 1)
+                continue
+            if 'segments' not in r:
+                r['segments'] = self.segment(r)
+            reqs.append(r)
+            positions.append(i)
+
+        self.set_profiles(reqs)
+        self.metrics.add('Requests', len(reqs))
+        return self.admit(reqs, positions)
+
+    def check_request(self, req):
+        """
+        Checks the fields of a request
+
+        :param req: a request
+        :raises ValueError: if the request is invalid
+        """
+        if not isinstance(req, dict) or ('segments' not in req and not isinstance(req.get('text'), str)):
+            raise ValueError('A request must be a text or an object with a "text" field')
+        for field in ['constraints', 'avoid', 'fields']:
+            if field in req and not (isinstance(req[field], list) and all(isinstance(s, str) for s in req[field])):
+                raise ValueError(f'The {field} of a request must be a list of strings')
+        if req.get('profile') is not None and req['profile'] not in self.profiles:
+            raise ValueError(f'Unknown decoding profile {req["profile"]}')
+
+    def set_profiles(self, reqs):
+        """
+        If the batch has too many sentences, requests that don't select a profile are given the downgrade profile.
+
+        :param reqs: a list of requests
+        """
+        args = self.serving_args
+        if args.downgrade_profile is None:
+            return
+        sentences = sum(len(p) for r in reqs for p in r['segments'])
+        if sentences > args.downgrade_sentences:
+            downgraded = [r for r in reqs if r.get('profile') is None]
+            for r in downgraded:
+                r['profile'] = args.downgrade_profile
+            self.metrics.add('DowngradedRequests', len(downgraded))
+
+    def admit(self, reqs, positions):
+        """
+        Estimates the cost of every request before it is preprocessed and decoded. Requests over budget are downgraded
+        or rejected, and the status and message of rejected requests are kept in ``rejected`` by their position.
+
+        :param reqs: a list of requests
+        :param positions: the position of each request among the requests and items of the batch
+        :return: the admitted requests
+        """
+        requests = []
+        for r in reqs:
+            tokens = sum(self.estimate_tokens(s) for p in r['segments'] for s in p)
+            translator = self.profiles[r['profile']] if r.get('profile') is not None else self.translator
+            requests.append((tokens, len(r.get('constraints', [])), translator.beam_size))
+
+        admitted = []
+        for i, (r, (decision, cost)) in enumerate(zip(reqs, self.admission.admit(requests))):
+            self.metrics.observe('RequestCost', cost, COST_BUCKETS)
+            if decision == ADMIT:
+                admitted.append(r)
+            elif decision == DOWNGRADE:
+                r['profile'] = self.serving_args.downgrade_profile
+                self.metrics.add('DowngradedRequests', 1)
+                admitted.append(r)
+            elif decision == REJECT:
+                self.rejected[positions[i]] = REJECT_STATUS, f'Request cost {cost} exceeds the budget of ' \
+                                                  f'{self.admission.request_budget}'
+                self.metrics.add('RejectedRequests', 1)
+            else:
+                self.rejected[positions[i]] = SHED_STATUS, f'Request cost {cost} exceeds the remaining budget of the batch'
+                self.metrics.add('ShedRequests', 1)
+        return admitted
+
+    def add_rejected(self, responses, context):
+        """
+        Inserts the error messages of rejected requests among the responses, and reports their statuses.
+        The responses to the items of a request with several texts are put into a list, where a rejected item
+        has an error entry and doesn't change the status of the request.
+
+        :param responses: the responses to the admitted requests
+        :param context: model server context
+        :return: the responses to all requests
+        """
+        for i in sorted(self.rejected):
+            responses.insert(i, self.rejected[i][1])
+
+        res = []
+        start = 0
+        for idx, count in enumerate(self.item_counts):
+            if count is None:
+                if start in self.rejected:
+                    status, message = self.rejected[start]
+                    report_status(context, status, message, idx)
+                res.append(responses[start])
+                start += 1
+            else:
+                res.append([{'error': self.rejected[i][1]} if i in self.rejected else responses[i]
+                            for i in range(start, start + count)])
+                start += count
+        return res
+
+    @staticmethod
+    def estimate_tokens(text):
+        """
+        Estimates the number of source tokens of a sentence before it is preprocessed
+        """
+        return len(text.split())
+
+    @staticmethod
+    def request_profile(trans_input):
+        """
+        Returns the name of the decoding profile of an input, or None for the default profile
+        """
+        return (trans_input.pass_through_dict or {}).get('profile')
+
+    @staticmethod
+    def decoding_kind(trans_input):
+        """
+        Returns whether an input is decoded with constraints, with phrases to avoid only, or without either
+
+        :param trans_input: an input for Sockeye
+        :return: CONSTRAINED, AVOID or UNCONSTRAINED
+        """
+        if trans_input.constraints:
+            return CONSTRAINED
+        if trans_input.avoid_list:
+            return AVOID
+        return UNCONSTRAINED
+
+    @staticmethod
+    def request_texts(req):
+        """
+        Returns the texts of a request that need preprocessing
+
+        :param req: a request
+        :return: its sentences, constraints and avoided phrases
+        """
+        return [s for p in req['segments'] for s in p] + req.get('constraints', []) + req.get('avoid', [])
+
+    @staticmethod
+    def set_request_texts(req, texts):
+        """
+        Replaces the texts of a request with their preprocessed versions
+
+        :param req: a request
+        :param texts: an iterator over the preprocessed texts, in the order of ``request_texts``
+        """
+        req['segments'] = [[next(texts) for _ in p] for p in req['segments']]
+        req['text'] = '\n'.join(' '.join(p) for p in req['segments'])
+        if 'constraints' in req:
+            req['constraints'] = [next(texts) for _ in req['constraints']]
+        if 'avoid' in req:
+            req['avoid'] = [next(texts) for _ in req['avoid']]
+
+    def unique_texts(self, reqs):
+        """
+        Collects the distinct texts of requests, so that e.g. a constraint shared by many requests is preprocessed once
 
-            if r:
-                if 'text' in r:
-                    r['text'] = self.preprocessor.run(r['text'])
-                if 'constraints' in r:
-                    r['constraints'] = [self.preprocessor.run(s) for s in r['constraints']]
-                if 'avoid' in r:
-                    r['avoid'] = [self.preprocessor.run(s) for s in r['avoid']]
+        :param reqs: a list of requests
+        :return: the distinct texts, and the positions of the texts of each request among them
+        """
+        index = OrderedDict()
+        positions = [[index.setdefault(t, len(index)) for t in self.request_texts(r)] for r in reqs]
+        return list(index), positions
+
+    def preprocess(self, batch):
+        """
+        Preprocesses a JSON request for translation.
+
+        :param batch: a list of JSON requests
+        :return: a list of requests, where 'segments' holds the preprocessed sentences of each paragraph
+        """
+        reqs = self.read_requests(batch)
 
-                reqs.append(r)
+        # preprocess the sentences, constraints and avoided phrases of all requests together
+        texts, positions = self.unique_texts(reqs)
+        texts = self.preprocessor.run_batch(texts)
+        for r, pos in zip(reqs, positions):
+            self.set_request_texts(r, (texts[i] for i in pos))
 
         return reqs
 
+    def read_file(self, data):
+        """
+        Reads an uploaded file. If it is split into sentences, each line is split as it is decoded,
+        so that the text of the file is never held as a whole. The text of the request is then set from its
+        preprocessed sentences.
+
+        :param data: the UTF-8 encoded file
+        :return: a request
+        """
+        if self.segmenter is not None and self.translator.nbest_size == 1:
+            paragraphs = [self.segmenter.split(line) for line in iter_lines(data)]
+            if any(paragraphs):
+                return {'segments': paragraphs}
+        return create_request(decode_bytes(data))
+
+    def segment(self, req):
+        """
+        Splits the text of a request into paragraphs and sentences.
+        Requests with constraints and n-best translations are not split, since they apply to the whole text.
+
+        :param req: a request
+        :return: a list of sentences for each paragraph
+        """
+        text = req['text']
+        if self.segmenter is None or 'constraints' in req or self.translator.nbest_size > 1:
+            return [[text]]
+
+        paragraphs = self.segmenter.split_paragraphs(text)
+        if not any(paragraphs):
+            return [[text]]
+        return paragraphs
+
     def inference(self, reqs):
         """
-        Translates the input data.
+        Translates the input data. The sentences of all requests in the batch are translated together.
 
         :param reqs: a list of requests to translate
-        :return: a list of translation objects from Sockeye
+        :return: a list of translation objects from Sockeye for each paragraph of each request
         """
         if reqs:
-            trans_inputs = []
-            for r in reqs:
-                _input = inference.make_input_from_dict(self.sentence_id,
-                         r,
-                         self.translator)
-                trans_inputs.append(_input)
-            outputs = self.translator.translate(trans_inputs)
+            trans_inputs = [_input for r in reqs for _input in self.make_inputs(r)]
+            outputs = self.translate(trans_inputs)
 
             if len(outputs) != len(trans_inputs):
                 logging.warning("Number of translation outputs doesn't match the number of inputs")
 
-            self.sentence_id += len(trans_inputs)
-            return outputs
+            return self.group_outputs(reqs, outputs)
         else:
             self.error = 'Input to inference is empty'
             return []
 
+    def make_inputs(self, req):
+        """
+        Creates an input for Sockeye from each sentence of a preprocessed request
+
+        :param req: a request
+        :return: a list of inputs for Sockeye
+        """
+        trans_inputs = []
+        fields = {k: v for k, v in req.items() if k != 'segments'}
+        for p in req['segments']:
+            for s in p:
+                trans_inputs.append(inference.make_input_from_dict(self.sentence_id, dict(fields, text=s),
+                                                                   self.translator))
+                self.sentence_id += 1
+        return trans_inputs
+
+    @staticmethod
+    def group_outputs(reqs, outputs):
+        """
+        Puts the translated sentences of each request back together
+
+        :param reqs: a list of requests
+        :param outputs: translation objects from Sockeye for the sentences of all requests
+        :return: a list of translation objects for each paragraph of each request
+        """
+        res = []
+        outputs = iter(outputs)
+        for r in reqs:
+            res.append([[next(outputs) for _ in p] for p in r['segments']])
+        return res
+
+    def translate(self, trans_inputs):
+        """
+        Translates inputs that are not in the cache or the translation memory, in batches of similar length to reduce
+        padding, which are formed by the batch scheduler. Inputs are decoded with the translator of their profile.
+
+        :param trans_inputs: a list of inputs for Sockeye
+        :return: a list of translation objects from Sockeye in the same order
+        """
+        outputs = [None] * len(trans_inputs)
+        keys = [None] * len(trans_inputs)
+        first = {}
+        duplicates = []
+        misses = []
+
+        for i, _input in enumerate(trans_inputs):
+            if self.cache is not None and not isinstance(_input, inference.BadTranslatorInput):
+                key = cache_key(self.cache_namespaces[self.request_profile(_input)], _input)
+                if key in first:
+                    # translate repeated sentences once per batch
+                    duplicates.append((i, first[key]))
+                    continue
+                first[key] = i
+                keys[i] = key
+
+                value = self.cache.get(key)
+                if value is not None:
+                    outputs[i] = self.cached_output(_input, value)
+                    continue
+            misses.append(i)
+
+        cached = len(trans_inputs) - len(misses)
+        if self.memory is not None and misses:
+            misses = self.lookup_memory(trans_inputs, misses, keys, outputs)
+
+        # Sockeye decodes a whole batch with constrained beam search if any of its inputs has constraints,
+        # so inputs with constraints, with phrases to avoid only and without either are decoded separately
+        groups = OrderedDict()
+        for i in misses:
+            key = (self.request_profile(trans_inputs[i]), self.decoding_kind(trans_inputs[i]))
+            groups.setdefault(key, []).append(i)
+
+        for (profile, kind), indices in groups.items():
+            if kind == CONSTRAINED:
+                self.metrics.add('ConstrainedSentences', len(indices))
+            elif kind == AVOID:
+                self.metrics.add('AvoidSentences', len(indices))
+            translator = self.profiles[profile] if profile is not None else self.translator
+            # the models are shared by all profiles, and use the beam size of the translator to encode
+            for model in translator.models:
+                model.beam_size = translator.beam_size
+
+            scheduler = self.get_scheduler(profile, kind)
+            for batch in scheduler.batches([len(trans_inputs[i].tokens) for i in indices]):
+                batch = [indices[i] for i in batch]
+                start = time.perf_counter()
+                translated = translator.translate([trans_inputs[i] for i in batch],
+                                                  fill_up_batches=scheduler.fill_up)
+                elapsed = (time.perf_counter() - start) * 1000
+                self.metrics.add('TranslateTime', elapsed, MILLISECONDS)
+                scheduler.observe(len(batch), elapsed)
+                self.add_batch_metrics([trans_inputs[i] for i in batch], translated)
+                if self.lexicon_log is not None:
+                    self.log_lexicon([trans_inputs[i] for i in batch], translated)
+
+                for i, output in zip(batch, translated):
+                    outputs[i] = output
+                    if keys[i] is not None:
+                        self.cache.put(keys[i], (output.translation, output.tokens, float(output.score)))
+                    if self.memory is not None and profile is None and kind == UNCONSTRAINED:
+                        self.memory.add(trans_inputs[i].tokens, output.tokens, float(output.score))
+
+        for i, j in duplicates:
+            output = outputs[j]
+            outputs[i] = self.cached_output(trans_inputs[i], (output.translation, output.tokens, output.score))
+
+        self.metrics.add('Sentences', len(trans_inputs))
+        self.metrics.add('CachedSentences', cached)
+        return outputs
+
+    def lookup_memory(self, trans_inputs, misses, keys, outputs):
+        """
+        Looks up inputs in the translation memory. If the translation of a similar sentence can be adapted to an input,
+        it is the translation of the input, and it is cached like a decoded one. Otherwise, with --memory-constraints,
+        the tokens that adapt it are the constraints of the input, which is then neither cached nor added to the memory.
+        Inputs with constraints or phrases to avoid, and inputs of other decoding profiles than the default, whose
+        beam size the memory's translations were not decoded with, are not looked up.
+
+        :param trans_inputs: a list of inputs for Sockeye
+        :param misses: the positions of the inputs that are not in the cache
+        :param keys: the cache keys of the inputs
+        :param outputs: the translations of the inputs, which are set for the inputs found in the memory
+        :return: the positions of the inputs that still need decoding
+        """
+        remaining = []
+        with self.metrics.time('MemoryLookupTime'):
+            for i in misses:
+                _input = trans_inputs[i]
+                if isinstance(_input, inference.BadTranslatorInput) or self.decoding_kind(_input) != UNCONSTRAINED or \
+                        self.request_profile(_input) is not None:
+                    remaining.append(i)
+                    continue
+
+                match = self.memory.lookup(_input.tokens)
+                if match is not None:
+                    source, target, score, _ = match
+                    translation, spans = repair(_input.tokens, source, target)
+                    if translation is not None:
+                        value = (' '.join(translation), translation, score)
+                        outputs[i] = self.cached_output(_input, value)
+                        if keys[i] is not None:
+                            self.cache.put(keys[i], value)
+                        self.metrics.add('MemorySentences', 1)
+                        continue
+                    if spans and self.serving_args.memory_constraints:
+                        trans_inputs[i] = inference.TranslatorInput(sentence_id=_input.sentence_id,
+                                                                    tokens=_input.tokens,
+                                                                    factors=_input.factors,
+                                                                    restrict_lexicon=_input.restrict_lexicon,
+                                                                    constraints=spans,
+                                                                    avoid_list=_input.avoid_list,
+                                                                    pass_through_dict=_input.pass_through_dict)
+                        keys[i] = None
+                        self.metrics.add('MemoryConstrainedSentences', 1)
+                remaining.append(i)
+        return remaining
+
+    def add_batch_metrics(self, trans_inputs, outputs):
+        """
+        Records the size of a batch passed to the translator and how much of it is padding
+
+        :param trans_inputs: the inputs of the batch
+        :param outputs: their translations
+        """
+        lengths = [len(_input.tokens) for _input in trans_inputs]
+        if not lengths:
+            return
+        self.metrics.add('DecoderBatches', 1)
+        self.metrics.add('InputTokens', sum(lengths))
+        self.metrics.add('PaddedInputTokens', self.scheduler.padded_tokens(len(lengths), max(lengths)))
+        self.metrics.add('OutputTokens', sum(len(output.tokens) for output in outputs))
+
+    def log_lexicon(self, trans_inputs, outputs):
+        """
+        Appends the tokens of translated sentences, and their alignments by attention, to the lexicon log
+
+        :param trans_inputs: the inputs of a batch
+        :param outputs: their translations
+        """
+        lines = []
+        for _input, output in zip(trans_inputs, outputs):
+            attention = getattr(output, 'attention_matrix', None)
+            alignment = format_alignment(attention) if attention is not None else ''
+            lines.append(f"{' '.join(_input.tokens)}\t{' '.join(output.tokens)}\t{alignment}\n")
+        self.lexicon_log.write(''.join(lines))
+        self.lexicon_log.flush()
+
+    @staticmethod
+    def cached_output(trans_input, value):
+        """
+        Creates a translation object from a cached translation
+
+        :param trans_input: the input for Sockeye
+        :param value: the cached translation, tokens and score
+        :return: a translation object
+        """
+        translation, tokens, score = value
+        return inference.TranslatorOutput(sentence_id=trans_input.sentence_id,
+                                          translation=translation,
+                                          tokens=tokens,
+                                          attention_matrix=None,
+                                          score=score,
+                                          pass_through_dict=trans_input.pass_through_dict)
+
     def postprocess(self, outputs):
         """
         Converts the translations into a list of JSON responses.
 
-        :param outputs: a list of translation objects from Sockeye
+        :param outputs: translation objects from Sockeye for each paragraph of each request
         :return: a list of translations of the form: { 'translation': output_string }
         """
+        translations = self.postprocessor.run_batch([output.translation for paragraphs in outputs
+                                                     for p in paragraphs for output in p])
+        return self.make_responses(outputs, translations)
+
+    def make_responses(self, outputs, translations):
+        """
+        Creates the JSON responses from the translation objects and the postprocessed translations. A response has the
+        fields that its request lists in ``fields``, or those of --response-fields, or else every field from Sockeye.
+
+        :param outputs: translation objects from Sockeye for each paragraph of each request
+        :param translations: the postprocessed translations of all sentences
+        :return: a list of translations of the form: { 'translation': output_string }
+        """
+        translations = iter(translations)
         res = []
-        for output in outputs:
-            d = output.json()
-            d['translation'] = self.postprocessor.run(output.translation)
+        for paragraphs in outputs:
+            sentences = [output for p in paragraphs for output in p]
+            translation = '\n'.join(' '.join(next(translations) for _ in p) for p in paragraphs)
+
+            # the outputs of bad inputs have no pass-through fields
+            fields = (sentences[0].pass_through_dict or {}).pop('fields', self.serving_args.response_fields)
+            if fields == ['translation']:
+                # skip the other fields of compact responses
+                res.append({'translation': translation})
+                continue
+
+            d = sentences[0].json()
+            if len(sentences) > 1:
+                d['text'] = '\n'.join(' '.join((output.pass_through_dict or {}).get('text', '')
+                                               for output in p)
+                                      for p in paragraphs)
+                d['score'] = sum(output.score for output in sentences) / len(sentences)
+            d['translation'] = translation
+            if fields is not None:
+                d = {k: d[k] for k in fields if k in d}
             res.append(d)
         return res
 
+    def pipeline(self, batch):
+        """
+        Translates a batch like preprocess, inference and postprocess, with text processing running on the worker pool
+        in chunks of sentences. A request is decoded as soon as its texts are preprocessed, while later chunks are still
+        being preprocessed, and its translations are postprocessed while later requests are decoded.
+
+        :param batch: a list of JSON requests
+        :return: a list of translations of the form: { 'translation': output_string }
+        """
+        reqs = self.read_requests(batch)
+        if not reqs:
+            self.error = 'Input to inference is empty'
+            return []
+
+        pool = self.pool
+        batch_size = self.translator.max_batch_size
+        chunk_size = self.serving_args.pipeline_chunk_size or batch_size
+
+        texts, positions = self.unique_texts(reqs)
+        pre = [pool.submit(PREPROCESS, texts[i:i + chunk_size]) for i in range(0, len(texts), chunk_size)]
+        post = []
+
+        try:
+            done = []
+            next_req = 0
+            trans_inputs = []
+            outputs = []
+
+            for i, future in enumerate(pre):
+                done.extend(future.result())
+                while next_req < len(reqs) and max(positions[next_req], default=-1) < len(done):
+                    self.set_request_texts(reqs[next_req], (done[j] for j in positions[next_req]))
+                    trans_inputs.extend(self.make_inputs(reqs[next_req]))
+                    next_req += 1
+
+                # decode full batches, and whatever is left after the last chunk
+                ready = len(trans_inputs) - len(outputs)
+                if i < len(pre) - 1:
+                    ready -= ready % batch_size
+                if ready:
+                    translated = self.translate(trans_inputs[len(outputs):len(outputs) + ready])
+                    outputs.extend(translated)
+                    translations = [output.translation for output in translated]
+                    post.extend(pool.submit(POSTPROCESS, translations[j:j + chunk_size])
+                                for j in range(0, len(translations), chunk_size))
+
+            translations = [t for future in post for t in future.result()]
+        except Exception:
+            for future in pre + post:
+                future.cancel()
+            raise
+
+        return self.make_responses(self.group_outputs(reqs, outputs), translations)
+
     def handle(self, data, context):
         """
         Custom service entry point function.
@@ -246,18 +989,108 @@ class SockeyeHandler(object):
 
         if not self.initialized:
             self.initialize(context)
+            if not self.serving_args.no_warm_up:
+                self.warm_up()
 
         if data is None:
             return None
 
         try:
-            data = self.preprocess(data)
-            data = self.inference(data)
-            data = self.postprocess(data)
-            return data
+            self.instrument()
+            self.metrics.set('BatchSize', len(data))
+
+            with self.metrics.time('HandleTime'):
+                if self.pool is not None:
+                    return self.add_rejected(self.pipeline(data), context)
+
+                data = self.preprocess(data)
+                data = self.inference(data)
+                data = self.postprocess(data)
+                return self.add_rejected(data, context)
 
         except Exception as e:
             logging.error(e, exc_info=True)
+            self.metrics.add('Errors', 1)
             request_processor = context.request_processor
             request_processor.report_status(500, "Unknown inference error")
             return [str(e)] * self._batch_size
+
+        finally:
+            self.report_metrics(context)
+
+    def warm_up(self):
+        """
+        Runs the text processors and translates a batch of every bucket size, so that MXNet binds and optimizes the
+        graphs of all buckets when the model is loaded instead of during the first requests.
+        The cache and metrics are bypassed.
+        """
+        start = time.perf_counter()
+        self.postprocessor.run_batch(self.preprocessor.run_batch(['Warm-up.']))
+
+        buckets = self.translator.buckets_source
+        for bucket in buckets:
+            trans_inputs = [inference.TranslatorInput(sentence_id=i, tokens=[const.UNK_SYMBOL] * max(1, bucket - 1))
+                            for i in range(self.translator.max_batch_size)]
+            self.translator.translate(trans_inputs)
+        logging.info(f'Warmed up {len(buckets)} buckets in {time.perf_counter() - start:.2f}s')
+
+    def close(self):
+        """
+        Releases the worker pool and metrics server of the handler, and every reference to the models, including those
+        of the translators of the decoding profiles, so that an unloaded model can be freed
+        """
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+            self.metrics_server = None
+        if self.lexicon_log is not None:
+            self.lexicon_log.close()
+            self.lexicon_log = None
+        self.translator = None
+        self.profiles = {}
+        self.scheduler = None
+        self.schedulers = {}
+        self.sockeye_args = None
+        self.cache = None
+        self.memory = None
+        self.initialized = False
+
+    def instrument(self):
+        """
+        Lets the processor chains time each of their processors
+        """
+        for processor in [self.preprocessor, self.postprocessor]:
+            if isinstance(processor, ProcessorChain):
+                processor.metrics = self.metrics
+
+    def report_metrics(self, context):
+        """
+        Adds the padding ratio and cache statistics to the metrics of the batch, reports them to MMS
+        and exports them to Prometheus if configured
+
+        :param context: model server context
+        """
+        try:
+            batch = self.metrics.batch
+            if batch.get('PaddedInputTokens'):
+                padding = 1 - batch['InputTokens'][0] / batch['PaddedInputTokens'][0]
+                self.metrics.set('PaddingRatio', 100 * padding, PERCENT)
+            if self.scheduler.latency_target:
+                self.metrics.set('SchedulerBatchSize', self.scheduler.batch_size)
+            if self.cache is not None:
+                self.metrics.set('CacheHitRate', 100 * self.cache.hit_rate(), PERCENT)
+                self.metrics.set('CacheSize', len(self.cache))
+            for processor in getattr(self.preprocessor, 'chain', [self.preprocessor]):
+                if isinstance(processor, BpeEncoder) and processor.cache is not None:
+                    self.metrics.set('BpeCacheHitRate', 100 * processor.cache.hit_rate(), PERCENT)
+                    self.metrics.set('BpeCacheSize', len(processor.cache))
+
+            self.metrics.flush(context)
+            if self.serving_args.metrics_file:
+                self.metrics.write_prometheus(self.serving_args.metrics_file)
+        except Exception as e:
+            # metrics must not fail the translation
+            logging.warning(f'Could not report metrics: {e}')
@@ -1,103 +1,280 @@
+import hashlib
 import html
+import logging
 import os
+import threading
 import unicodedata
 from html.entities import html5, name2codepoint
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import regex as re
 from subword_nmt.apply_bpe import BPE
 
-from .utils import run_subprocess
+from .artifacts import artifact_path, cached_pickle
+from .cache import LruCache
+from .coprocess import get_coprocess
+from .moses import MosesDetokenizer
 
 
-class TextProcessor:
+class ControlCharacters(dict):
     """
-    Transforms text as part of either preprocessing or postprocessing
+    A translate table that deletes characters of the Unicode category C (control, format, surrogate,
+    private use and unassigned). The category of each character is looked up the first time it is seen.
     """
 
     def __init__(self):
-        symbols = ''
-        symbol_set = set({})
-
-        for k in name2codepoint.keys():
-            symbol_set.add(k)
+        super().__init__()
+        for i in range(256):
+            self[i]
 
-        for k in html5.keys():
-            symbol_set.add(k.strip(';'))
+    def __missing__(self, key):
+        value = None if unicodedata.category(chr(key))[0] == 'C' else key
+        self[key] = value
+        return value
 
-        for s in symbol_set:
-            symbols += '|' + s
 
-        symbols = symbols.strip('|')
+_control_characters = ControlCharacters()
 
-        self.single = re.compile('&[ ]?(' + symbols + ')[ ]?;', re.IGNORECASE)
-        self.double = re.compile(
-            '&[ ]?amp[ ]?;[ ]?(' + symbols + ')[ ]?;',
-            re.IGNORECASE)
 
-        self.singleNum = re.compile('&[ ]?#[ ]?([0-9]+)[ ]?;', re.IGNORECASE)
-        self.doubleNum = re.compile(
-            '&[ ]?amp[ ]?;[ ]?#[ ]?([0-9]+)[ ]?;',
-            re.IGNORECASE)
+def _entity_symbols() -> str:
+    symbol_set = set(name2codepoint.keys())
+    for k in html5.keys():
+        symbol_set.add(k.strip(';'))
+    return '|'.join(symbol_set)
 
-        self.singleXNum = re.compile(
-            '&[ ]?#[ ]?x[ ]?([a-f0-9]+)[ ]?;', re.IGNORECASE)
-        self.doubleXNum = re.compile(
-            '&[ ]?amp[ ]?;[ ]?#[ ]?x[ ]?([a-f0-9]+)[ ]?;',
-            re.IGNORECASE)
 
-        self.nbsp = re.compile(
-            '(&[ ]?x?[ ]?n[]?b[ ]?([a-z][ ]?){0,6}[ ]?;)|(&[ ]?o[ ]?s[ ]?p[ ]?;)',
-            re.IGNORECASE)
+class TextProcessor:
+    """
+    Transforms text as part of either preprocessing or postprocessing
+    """
 
-        self.shy = re.compile('[ ]?&[ ]?s[ ]?h[ ]?y[ ]?;[ ]?', re.IGNORECASE)
+    # a single pass that removes soft hyphens and puts html-escaped (or double escaped) codes back into
+    # canonical format: named entities, decimal and hexadecimal character references
+    entity = re.compile(
+        '(?P<shy>[ ]?(?:&[ ]?amp[ ]?;[ ]?shy[ ]?;|&[ ]?s[ ]?h[ ]?y[ ]?;)[ ]?)|'
+        '&[ ]?(?:amp[ ]?;[ ]?)?(?:'
+        '(?P<name>' + _entity_symbols() + ')|'
+        '#[ ]?x[ ]?(?P<hex>[a-f0-9]+)|'
+        '#[ ]?(?P<dec>[0-9]+)'
+        ')[ ]?;',
+        re.IGNORECASE)
+
+    nbsp = re.compile(
+        '(&[ ]?x?[ ]?n[]?b[ ]?([a-z][ ]?){0,6}[ ]?;)|(&[ ]?o[ ]?s[ ]?p[ ]?;)',
+        re.IGNORECASE)
 
+    def __init__(self):
         self.bpe = None
 
     def remove_control_characters(self, s):
-        return ''.join(ch for ch in s if unicodedata.category(ch)[0] != "C")
+        # printable text has no control characters
+        if s.isprintable():
+            return s
+        return s.translate(_control_characters)
+
+    @staticmethod
+    def canonical_entity(m):
+        if m.group('shy') is not None:
+            # get rid of this tag
+            return ''
+        if m.group('name') is not None:
+            return '&' + m.group('name') + ';'
+        if m.group('hex') is not None:
+            return '&#x' + m.group('hex') + ';'
+        return '&#' + m.group('dec') + ';'
 
     def unescape(self, line):
-        # put html-escaped (or double escaped) codes back into canonical format
-        line = re.sub(self.double, r'&\1;', line)
-        line = re.sub(self.doubleNum, r'&#\1;', line)
-        line = re.sub(self.doubleXNum, r'&#x\1;', line)
-        line = re.sub(self.single, r'&\1;', line)
-        line = re.sub(self.singleNum, r'&#\1;', line)
-        line = re.sub(self.singleXNum, r'&#x\1;', line)
-
-        # get rid of this tag
-        # alphabetic characters -- need only get rid of space around their
-        # canonical escaped forms
-        line = re.sub(self.shy, '', line)
+        if '&' not in line:
+            return line
+
+        line = self.entity.sub(self.canonical_entity, line)
 
         # unescape
         line = html.unescape(line)
 
         # clean up weird errors in the escaping of the non-breaking space
-        line = re.sub(self.nbsp, ' ', line)
+        if '&' in line:
+            line = self.nbsp.sub(' ', line)
         return line
 
     def run(self, text):
         text = self.unescape(text)
         return self.remove_control_characters(text)
 
+    def run_batch(self, texts: List[str]) -> List[str]:
+        """
+        Processes a batch of texts. Repeated texts are processed once.
+
+        :param texts: a list of texts
+        :return: the processed texts in the same order
+        """
+        done = {}
+        res = []
+        for text in texts:
+            if text not in done:
+                done[text] = self.run(text)
+            res.append(done[text])
+        return res
+
+
+class NoCache(dict):
+    """
+    Replaces the unbounded cache of ``subword_nmt``, since segmentations are kept in a bounded word cache
+    """
+
+    def __setitem__(self, key, value):
+        pass
+
+
+_bpe_lock = threading.Lock()
+_bpe_pool = {}  # type: Dict[str, Tuple[BPE, Optional[LruCache]]]
+
+
+def load_bpe(bpe_code_file: str) -> BPE:
+    with open(bpe_code_file, mode='r', encoding='utf-8') as f:
+        return BPE(f)
+
+
+def get_bpe(bpe_code_file: str, cache_size: int,
+            artifacts_dir: Optional[str] = None) -> Tuple[BPE, Optional[LruCache]]:
+    """
+    Returns the BPE model for a codes file and its word cache, which are shared by all encoders in the process,
+    including those of other models whose codes file has the same contents.
+    The cache is created with the size given the first time the codes are loaded.
+
+    :param bpe_code_file: BPE codes file
+    :param cache_size: maximum number of cached words; 0 disables the cache
+    :param artifacts_dir: directory where the parsed codes are saved for faster loading, if any
+    :return: a BPE model and a word cache, which is None if caching is disabled
+    """
+    with open(bpe_code_file, mode='rb') as f:
+        key = hashlib.sha1(f.read()).hexdigest()
+    with _bpe_lock:
+        if key not in _bpe_pool:
+            if artifacts_dir:
+                bpe = cached_pickle(artifact_path(artifacts_dir, 'bpe', [bpe_code_file], 'pkl'),
+                                    lambda: load_bpe(bpe_code_file))
+            else:
+                bpe = load_bpe(bpe_code_file)
+            bpe.cache = NoCache()
+            _bpe_pool[key] = bpe, LruCache(cache_size) if cache_size > 0 else None
+        return _bpe_pool[key]
+
 
 class BpeEncoder(TextProcessor):
     """
     Returns byte-pair encodings of text
     """
 
-    def __init__(self, bpe_code_file):
+    def __init__(self, bpe_code_file, cache_size=50000, word_freqs_file=None, artifacts_dir=None):
+        """
+        :param bpe_code_file: BPE codes file
+        :param cache_size: maximum number of words whose segmentation is cached; 0 disables the cache
+        :param word_freqs_file: words and their frequencies, used to fill the cache with the most frequent words
+        :param artifacts_dir: directory where the parsed codes and the segmentations of the most frequent words
+                              are saved for faster loading, if any
+        """
         super().__init__()
 
-        with open(bpe_code_file, mode='r', encoding='utf-8') as f:
-            self.bpe = BPE(f)
+        self.bpe_code_file = bpe_code_file
+        self.artifacts_dir = artifacts_dir
+        self.bpe, self.cache = get_bpe(bpe_code_file, cache_size, artifacts_dir)
+        # the cache is shared, so only the first encoder fills it
+        if word_freqs_file and self.cache is not None and not len(self.cache):
+            self.warm_up(word_freqs_file)
+
+    def warm_up(self, word_freqs_file):
+        """
+        Caches the segmentations of the most frequent words
+
+        :param word_freqs_file: one word and its frequency per line, like the output of ``subword-nmt get-vocab``
+        """
+        if self.artifacts_dir:
+            path = artifact_path(self.artifacts_dir, 'bpe-words', [self.bpe_code_file, word_freqs_file], 'pkl',
+                                 size=self.cache.max_size)
+            segmentations = cached_pickle(path, lambda: self.segment_frequent_words(word_freqs_file))
+        else:
+            segmentations = self.segment_frequent_words(word_freqs_file)
+
+        # the most frequent words are put last, so that they are evicted last
+        for word, segments in reversed(segmentations):
+            self.cache.put(word, segments)
+        logging.info(f'Cached the BPE segmentation of {len(segmentations)} words from {word_freqs_file}')
+
+    def segment_frequent_words(self, word_freqs_file) -> List[Tuple[str, str]]:
+        """
+        Segments the words that fit into the cache, most frequent first
+        """
+        words = []
+        with open(word_freqs_file, mode='r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if fields:
+                    words.append((int(fields[1]) if len(fields) > 1 else 0, fields[0]))
+        words.sort(key=lambda w: w[0], reverse=True)
+        return [(word, ' '.join(self.bpe.segment_tokens([word]))) for _, word in words[:self.cache.max_size]]
+
+    def segment_words(self, words) -> Dict[str, str]:
+        """
+        Segments words, looking them up in the word cache first
+
+        :param words: distinct words
+        :return: the segmentation of each word
+        """
+        res = {}
+        for word in words:
+            segments = self.cache.get(word) if self.cache is not None else None
+            if segments is None:
+                segments = ' '.join(self.bpe.segment_tokens([word]))
+                if self.cache is not None:
+                    self.cache.put(word, segments)
+            res[word] = segments
+        return res
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the counters of the word cache
+
+        :return: a dictionary of hits, misses, evictions, the current size and the hit rate
+        """
+        if self.cache is None:
+            return {}
+        return dict(self.cache.stats(), hit_rate=self.cache.hit_rate())
 
     def run(self, text):
         if not text:
             return ''
-        return self.bpe.process_line(text)
+        return self.run_batch([text])[0]
+
+    def run_batch(self, texts: List[str]) -> List[str]:
+        """
+        Encodes a batch of texts, segmenting each distinct word of the batch once
+
+        :param texts: a list of tokenized texts
+        :return: the encoded texts in the same order
+        """
+        lines = [text.strip('\r\n ').split(' ') for text in texts]
+
+        words = {}
+        for line in lines:
+            for word in line:
+                if word:
+                    words[word] = None
+        words = self.segment_words(words)
+
+        res = []
+        for text, line in zip(texts, lines):
+            if not text:
+                res.append('')
+                continue
+            # keep leading and trailing whitespace like BPE.process_line
+            leading = len(text) - len(text.lstrip('\r\n '))
+            trailing = len(text) - len(text.rstrip('\r\n '))
+            out = text[:leading] + ' '.join(words[word] for word in line if word)
+            if trailing and trailing != len(text):
+                out += text[-trailing:]
+            res.append(out)
+        return res
 
 
 class ProcessorChain(TextProcessor):
@@ -109,22 +286,30 @@ class ProcessorChain(TextProcessor):
         super().__init__()
 
         self.chain = chain
+        # HandlerMetrics that time each processor, if set
+        self.metrics = None
 
     def run(self, text: str) -> str:
         for processor in self.chain:
             text = processor.run(text)
         return text
 
+    def run_batch(self, texts: List[str]) -> List[str]:
+        for processor in self.chain:
+            if self.metrics is None:
+                texts = processor.run_batch(texts)
+            else:
+                with self.metrics.time(type(processor).__name__ + 'Time'):
+                    texts = processor.run_batch(texts)
+        return texts
+
 
 class DeBPE(TextProcessor):
     """
     Removes BPE
     """
 
-    def __init__(self):
-        super().__init__()
-
-        self.de_bpe = re.compile('@@( |$)', re.IGNORECASE)
+    de_bpe = re.compile('@@( |$)', re.IGNORECASE)
 
     def run(self, text):
         return re.sub(self.de_bpe, '', text).strip()
@@ -132,16 +317,19 @@ class DeBPE(TextProcessor):
 
 class Detokenizer(TextProcessor):
     """
-    Detokenizes text
+    Detokenizes text like the Moses detokenizer, or with the Moses Perl script itself
     """
 
-    def __init__(self, scripts_path):
+    def __init__(self, scripts_path, perl=False):
         super().__init__()
 
-        self.de_tok = os.path.join(scripts_path, 'detokenize.pl')
-
-        if not os.access(self.de_tok, os.X_OK):
-            os.chmod(self.de_tok, 0o755)
+        if perl:
+            de_tok = os.path.join(scripts_path, 'detokenize.pl')
+            if not os.access(de_tok, os.X_OK):
+                os.chmod(de_tok, 0o755)
+            self.de_tok = get_coprocess([de_tok, '-b', '-l', 'en'])
+        else:
+            self.de_tok = MosesDetokenizer('en')
 
     def run(self, text):
-        return run_subprocess(text, [self.de_tok, '-l', 'en'])
+        return self.de_tok.run(text)
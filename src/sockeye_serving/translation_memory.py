@@ -0,0 +1,365 @@
+"""
+Finds earlier translations of sentences that are similar to a new one, e.g. templates that differ only in a number or
+a name, so that their translations can be reused instead of decoding the sentence.
+
+Sentences are compared by the character n-grams of their tokens. Candidates are found by locality-sensitive hashing of
+MinHash signatures, and verified by the similarity of their tokens. The translations of a model are compiled into an
+index that is memory-mapped, so that the workers of a host share one copy of it::
+
+    python -m sockeye_serving.translation_memory build lexicon-*.tsv -o memory.tm
+    python -m sockeye_serving.translation_memory lookup memory.tm < test.tok.bpe.zh
+"""
+
+import argparse
+import mmap
+import struct
+import sys
+import zlib
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MEMORY_MAGIC = b'SSTM1\0\0\0'
+# magic, number of entries, bands, rows per band, n-gram length, seed, padding to align the arrays
+_HEADER = struct.Struct('=8sIIIII4x')
+
+# a Mersenne prime, so that the hashes of the signatures fit into 64 bits
+_PRIME = np.uint64((1 << 31) - 1)
+
+# a similar sentence, its translation tokens, the score of the translation and the similarity
+Match = Tuple[List[str], List[str], float, float]
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures of sentences, and hashes their bands for locality-sensitive hashing.
+    Sentences whose n-grams have a Jaccard similarity of about ``(1 / bands) ** (1 / rows)`` share a band
+    with a probability of one half.
+    """
+
+    def __init__(self, bands: int = 8, rows: int = 4, ngram: int = 4, seed: int = 1):
+        self.bands = bands
+        self.rows = rows
+        self.ngram = ngram
+        self.seed = seed
+        state = np.random.RandomState(seed)
+        self.a = state.randint(1, int(_PRIME), size=(bands * rows, 1)).astype(np.uint64)
+        self.b = state.randint(0, int(_PRIME), size=(bands * rows, 1)).astype(np.uint64)
+
+    def shingles(self, tokens: Sequence[str]) -> List[int]:
+        text = ' '.join(tokens).encode('utf-8')
+        if len(text) <= self.ngram:
+            return [zlib.crc32(text)]
+        return [zlib.crc32(text[i:i + self.ngram]) for i in range(len(text) - self.ngram + 1)]
+
+    def signatures(self, sentences: Sequence[Sequence[str]]) -> np.ndarray:
+        """
+        Computes the signatures of sentences at once, one hash function at a time, so that only one hash of every
+        shingle is held in memory
+
+        :param sentences: the tokens of each sentence
+        :return: an array with a row for each sentence
+        """
+        shingles = [np.array(self.shingles(tokens), dtype=np.uint64) for tokens in sentences]
+        starts = np.cumsum([0] + [len(s) for s in shingles[:-1]])
+        x = np.concatenate(shingles)
+        del shingles
+        signatures = np.empty((len(sentences), len(self.a)), dtype=np.uint64)
+        hashes = np.empty_like(x)
+        for k in range(len(self.a)):
+            np.multiply(self.a[k], x, out=hashes)
+            hashes += self.b[k]
+            hashes %= _PRIME
+            signatures[:, k] = np.minimum.reduceat(hashes, starts)
+        return signatures
+
+    def band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """
+        Hashes the bands of signatures
+
+        :param signatures: an array with a row for each sentence
+        :return: an array with a key for each band of each sentence
+        """
+        bands = signatures.reshape(len(signatures), self.bands, self.rows)
+        keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+        for j in range(self.rows):
+            # FNV-style mixing, which wraps around
+            keys = keys * np.uint64(0x100000001b3) + bands[:, :, j]
+        return keys
+
+
+def read_pairs(paths: Iterable[str]) -> Iterator[Tuple[List[str], List[str], float]]:
+    """
+    Reads sentence pairs with a preprocessed source and a translation, separated by a tab, on each line.
+    Further columns, like the alignments of a lexicon log, are ignored.
+
+    :param paths: files of sentence pairs
+    :return: an iterator over the tokens of the source and the translation, and the score of the translation
+    """
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) > 1 and fields[0].strip() and fields[1].strip():
+                    yield fields[0].split(), fields[1].split(), 0.0
+
+
+def build_memory(pairs: Iterable[Tuple[List[str], List[str], float]], hasher: MinHasher,
+                 chunk_size: int = 2000) -> bytes:
+    """
+    Compiles sentence pairs into an index. Repeated sources keep their last translation.
+
+    :param pairs: the tokens of each source and translation, and the score of the translation
+    :param hasher: the MinHash parameters of the index
+    :param chunk_size: number of sentences whose signatures are computed at once
+    :return: the index in its binary format
+    """
+    entries = OrderedDict()
+    for source, target, score in pairs:
+        key = ' '.join(source)
+        entries.pop(key, None)
+        entries[key] = (' '.join(target), score)
+
+    sources = list(entries)
+    keys = np.zeros((len(sources), hasher.bands), dtype=np.uint64)
+    for i in range(0, len(sources), chunk_size):
+        chunk = [s.split() for s in sources[i:i + chunk_size]]
+        keys[i:i + chunk_size] = hasher.band_keys(hasher.signatures(chunk))
+
+    # the entries of each band, sorted by key
+    order = np.argsort(keys, axis=0, kind='stable').T
+    band_keys = np.take_along_axis(keys.T, order, axis=1)
+
+    blob = bytearray()
+    offsets = np.zeros(2 * len(sources) + 1, dtype=np.uint64)
+    for i, source in enumerate(sources):
+        for j, text in enumerate([source, entries[source][0]]):
+            blob += text.encode('utf-8')
+            offsets[2 * i + j + 1] = len(blob)
+    scores = np.array([score for _, score in entries.values()], dtype=np.float32)
+
+    header = _HEADER.pack(MEMORY_MAGIC, len(sources), hasher.bands, hasher.rows, hasher.ngram, hasher.seed)
+    return b''.join([header, band_keys.tobytes(), offsets.tobytes(), order.astype(np.uint32).tobytes(),
+                     scores.tobytes(), bytes(blob)])
+
+
+class TranslationMemory:
+    """
+    Finds the most similar earlier translation of a sentence, in a compiled index and among the most recent
+    translations, of which up to ``max_entries`` are kept in memory. The similarity of two sentences is the ratio
+    of matching tokens found by ``difflib``.
+    """
+
+    def __init__(self, buffer=None, max_entries: int = 0, threshold: float = 0.9, max_candidates: int = 8,
+                 max_bucket: int = 32):
+        """
+        :param buffer: an index in its binary format, e.g. a memory map of a file, or None
+        :param max_entries: number of recent translations to keep in memory
+        :param threshold: minimum similarity of a match
+        :param max_candidates: number of candidates that share the most bands whose similarity is computed
+        :param max_bucket: maximum number of entries that are taken from each band
+        """
+        self.buffer = buffer
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self.max_bucket = max_bucket
+        self.size = 0
+
+        if buffer is not None:
+            magic, self.size, bands, rows, ngram, seed = _HEADER.unpack_from(buffer)
+            if magic != MEMORY_MAGIC:
+                raise ValueError('Not a compiled translation memory')
+            self.hasher = MinHasher(bands, rows, ngram, seed)
+            offset = _HEADER.size
+            self.keys = np.frombuffer(buffer, np.uint64, bands * self.size, offset).reshape(bands, self.size)
+            offset += self.keys.nbytes
+            self.offsets = np.frombuffer(buffer, np.uint64, 2 * self.size + 1, offset)
+            offset += self.offsets.nbytes
+            self.ids = np.frombuffer(buffer, np.uint32, bands * self.size, offset).reshape(bands, self.size)
+            offset += self.ids.nbytes
+            self.scores = np.frombuffer(buffer, np.float32, self.size, offset)
+            self.blob = offset + self.scores.nbytes
+        else:
+            self.hasher = MinHasher()
+
+        # recent translations by source, and their sources by band and key
+        self.recent = OrderedDict()
+        self.buckets = [{} for _ in range(self.hasher.bands)]
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'TranslationMemory':
+        """
+        Memory-maps a compiled index
+        """
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), **kwargs)
+
+    def __len__(self):
+        return self.size + len(self.recent)
+
+    def entry(self, i: int) -> Tuple[List[str], List[str], float]:
+        """
+        Returns the source tokens, translation tokens and score of an entry of the index
+        """
+        start, middle, end = (int(o) + self.blob for o in self.offsets[2 * i:2 * i + 3])
+        source = str(self.buffer[start:middle], 'utf-8')
+        target = str(self.buffer[middle:end], 'utf-8')
+        return source.split(), target.split(), float(self.scores[i])
+
+    def candidates(self, keys: np.ndarray) -> List[Tuple[List[str], List[str], float]]:
+        """
+        Finds the entries that share the most bands with a sentence
+
+        :param keys: the band keys of the sentence
+        :return: the source tokens, translation tokens and score of each candidate
+        """
+        counts = {}
+        if self.size:
+            for band, key in enumerate(keys):
+                lo = np.searchsorted(self.keys[band], key, 'left')
+                hi = min(np.searchsorted(self.keys[band], key, 'right'), lo + self.max_bucket)
+                for i in self.ids[band, lo:hi].tolist():
+                    counts[i] = counts.get(i, 0) + 1
+        for band, key in enumerate(keys.tolist()):
+            for source in self.buckets[band].get(key, ()):
+                counts[source] = counts.get(source, 0) + 1
+
+        res = []
+        for c in sorted(counts, key=counts.get, reverse=True)[:self.max_candidates]:
+            if isinstance(c, str):
+                target, score, _ = self.recent[c]
+                res.append((c.split(), target.split(), score))
+            else:
+                res.append(self.entry(c))
+        return res
+
+    def lookup(self, tokens: Sequence[str]) -> Optional[Match]:
+        """
+        Finds the earlier translation of the most similar sentence
+
+        :param tokens: the tokens of a preprocessed sentence
+        :return: the sentence, its translation tokens, the score of the translation and the similarity,
+                 or None if no sentence is similar enough
+        """
+        if not tokens:
+            return None
+        keys = self.hasher.band_keys(self.hasher.signatures([tokens]))[0]
+        best = None
+        matcher = SequenceMatcher(None, autojunk=False)
+        matcher.set_seq2(list(tokens))
+        for source, target, score in self.candidates(keys):
+            matcher.set_seq1(source)
+            # quick_ratio is an upper bound of the similarity
+            if matcher.quick_ratio() < self.threshold or (best is not None and matcher.quick_ratio() <= best[3]):
+                continue
+            similarity = matcher.ratio()
+            if similarity >= self.threshold and (best is None or similarity > best[3]):
+                best = source, target, score, similarity
+        if best is not None and ' '.join(best[0]) in self.recent:
+            self.recent.move_to_end(' '.join(best[0]))
+        return best
+
+    def add(self, tokens: Sequence[str], translation: Sequence[str], score: float):
+        """
+        Keeps a translation in memory, and forgets the least recently used one if there are too many
+
+        :param tokens: the tokens of a preprocessed sentence
+        :param translation: the tokens of its translation
+        :param score: the score of the translation
+        """
+        if self.max_entries <= 0 or not tokens:
+            return
+        source = ' '.join(tokens)
+        if source in self.recent:
+            self.recent.move_to_end(source)
+            return
+        keys = self.hasher.band_keys(self.hasher.signatures([tokens]))[0].tolist()
+        self.recent[source] = ' '.join(translation), score, keys
+        for band, key in enumerate(keys):
+            self.buckets[band].setdefault(key, set()).add(source)
+
+        while len(self.recent) > self.max_entries:
+            old, (_, _, old_keys) = self.recent.popitem(last=False)
+            for band, key in enumerate(old_keys):
+                bucket = self.buckets[band][key]
+                bucket.discard(old)
+                if not bucket:
+                    del self.buckets[band][key]
+
+
+def repair(tokens: Sequence[str], source: Sequence[str], target: Sequence[str]) -> Tuple[Optional[List[str]],
+                                                                                            List[List[str]]]:
+    """
+    Adapts the translation of a similar sentence. Every span of the similar sentence that the new sentence replaces,
+    e.g. a number or a name, must occur once in the translation, where it is replaced by the new span.
+
+    :param tokens: the tokens of the new sentence
+    :param source: the tokens of the similar sentence
+    :param target: the tokens of its translation
+    :return: the adapted translation, or None if the translation can't be adapted, and the new spans that replace
+             a span of the translation, which a decoder can use as constraints
+    """
+    edits = []
+    repairable = True
+    for op, i1, i2, j1, j2 in SequenceMatcher(None, source, tokens, autojunk=False).get_opcodes():
+        if op == 'equal':
+            continue
+        old = list(source[i1:i2])
+        positions = [k for k in range(len(target) - len(old) + 1) if old and target[k:k + len(old)] == old]
+        if op == 'replace' and len(positions) == 1:
+            edits.append((positions[0], len(old), list(tokens[j1:j2])))
+        else:
+            repairable = False
+
+    edits.sort()
+    if any(prev[0] + prev[1] > cur[0] for prev, cur in zip(edits, edits[1:])):
+        return None, []
+    spans = [new for _, _, new in edits]
+    if not repairable:
+        return None, spans
+
+    res = list(target)
+    for pos, length, new in reversed(edits):
+        res[pos:pos + length] = new
+    return res, spans
+
+
+def main():
+    params = argparse.ArgumentParser(description='Compile and query translation memories')
+    subparsers = params.add_subparsers(dest='command')
+    build = subparsers.add_parser('build', help='compile sentence pairs with a preprocessed source and a translation '
+                                                'on each line, separated by a tab, e.g. the logs of --lexicon-log')
+    build.add_argument('pairs', nargs='+')
+    build.add_argument('-o', '--output', required=True, help='the compiled index')
+    build.add_argument('--bands', type=int, default=8, help='number of bands of the MinHash signatures')
+    build.add_argument('--rows', type=int, default=4, help='number of rows per band')
+    build.add_argument('--ngram', type=int, default=4, help='length of the character n-grams, in bytes')
+    lookup = subparsers.add_parser('lookup', help='find similar sentences for preprocessed sentences from stdin')
+    lookup.add_argument('memory')
+    lookup.add_argument('-t', '--threshold', type=float, default=0.9, help='minimum similarity')
+    args = params.parse_args()
+
+    if args.command == 'build':
+        data = build_memory(read_pairs(args.pairs), MinHasher(args.bands, args.rows, args.ngram))
+        with open(args.output, 'wb') as f:
+            f.write(data)
+    elif args.command == 'lookup':
+        memory = TranslationMemory.load(args.memory, threshold=args.threshold)
+        for line in sys.stdin:
+            tokens = line.split()
+            match = memory.lookup(tokens)
+            if match is None:
+                print()
+                continue
+            source, target, _, similarity = match
+            repaired, _ = repair(tokens, source, target)
+            print(f"{similarity:.3f}\t{' '.join(source)}\t{' '.join(repaired or target)}")
+    else:
+        params.print_help()
+
+
+if __name__ == '__main__':
+    main()
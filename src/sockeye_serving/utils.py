@@ -1,7 +1,66 @@
+import json
+import os
 import re
 import subprocess
 
-from typing import Dict
+from typing import Dict, Iterator, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the bundled Moses scripts and nonbreaking prefixes, located without importing pkg_resources, which is slow to load
+SCRIPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+
+
+JSON_CONTENT_TYPE = 'application/json'
+# leading whitespace of a body, which is matched in place instead of stripping a copy of a large upload
+LEADING_SPACE = re.compile(r'\s*')
+LEADING_SPACE_BYTES = re.compile(rb'\s*')
+
+
+def _to_json(obj):
+    # numpy arrays and scalars, e.g. scores
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(',', ':'), default=_to_json)
+
+
+def encode_json(obj) -> bytes:
+    """
+    Serializes an object as compact UTF-8 encoded JSON, with orjson if it is installed
+
+    :param obj: a JSON object
+    :return: the encoded object
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_to_json, option=orjson.OPT_SERIALIZE_NUMPY)
+    return _json_encoder.encode(obj).encode('utf-8')
+
+
+def encode_responses(responses: Optional[List], context) -> Optional[List]:
+    """
+    Serializes the JSON responses of a batch, so that MMS sends the bytes as they are instead of serializing them again.
+    Responses that are not JSON objects or arrays, i.e. error messages, are left to MMS.
+
+    :param responses: the responses of a handler, or None
+    :param context: model server context
+    :return: the serialized responses
+    """
+    if responses is None:
+        return None
+    res = []
+    for i, r in enumerate(responses):
+        if isinstance(r, (dict, list)):
+            r = encode_json(r)
+            if hasattr(context, 'set_response_content_type'):
+                context.set_response_content_type(i, JSON_CONTENT_TYPE)
+        res.append(r)
+    return res
 
 
 def create_request(input: str) -> Dict:
@@ -15,26 +74,107 @@ def decode_bytes(data: bytearray) -> str:
     :param data: a UTF-8 encoded byte array
     :return: a cleaned string
     """
-    pattern = re.compile('\r', re.UNICODE)
     res = data.decode('utf-8', 'ignore')
-    res = pattern.sub('', res)
+    if '\r' in res:
+        res = res.replace('\r', '')
     return res
 
 
-def get_request(req: Dict) -> Dict:
+def iter_lines(data: bytearray, block_size: int = 1 << 20) -> Iterator[str]:
+    """
+    Decodes the lines of a file upload like ``decode_bytes(data).split('\n')``, but a block of about ``block_size``
+    bytes at a time, so that the whole upload is never copied into a string. Blocks are slices of a memoryview
+    that end at a line break, which never occurs inside a UTF-8 encoded character.
+
+    :param data: a UTF-8 encoded byte array
+    :param block_size: minimum number of bytes to decode at a time
+    :return: an iterator over the cleaned lines
+    """
+    with memoryview(data) as view:
+        start = 0
+        while True:
+            end = data.find(b'\n', start + block_size) if start + block_size < len(data) else -1
+            if end < 0:
+                end = len(data)
+            block = str(view[start:end], 'utf-8', 'ignore')
+            if '\r' in block:
+                block = block.replace('\r', '')
+            yield from block.split('\n')
+            if end == len(data):
+                return
+            start = end + 1
+
+
+def get_json_lines(data: Union[str, bytearray]) -> Optional[List[Dict]]:
+    """
+    Parses a body of JSON Lines, with a JSON object on every non-blank line.
+    A file upload is only decoded a block at a time, and not at all unless it starts with an object.
+
+    :param data: the body
+    :return: the objects, or None if the body is not JSON Lines
+    """
+    if isinstance(data, (bytes, bytearray)):
+        start = LEADING_SPACE_BYTES.match(data).end()
+        if data[start:start + 1] != b'{':
+            return None
+        lines = iter_lines(data)
+    else:
+        start = LEADING_SPACE.match(data).end()
+        if data[start:start + 1] != '{':
+            return None
+        lines = data.split('\n')
+    items = []
+    for line in lines:
+        if line.strip():
+            try:
+                item = json.loads(line)
+            except ValueError:
+                return None
+            if not isinstance(item, dict):
+                return None
+            items.append(item)
+    return items
+
+
+def create_item(item, fields: Dict):
+    """
+    Creates the request of an item of a request with several texts
+
+    :param item: a text, or an object with a text and other fields
+    :param fields: the fields of the request that apply to all of its items
+    :return: a request, or the item itself if it is neither, so that it can be reported as invalid
+    """
+    if isinstance(item, str):
+        return dict(fields, text=item)
+    if isinstance(item, dict):
+        return dict(fields, **item)
+    return item
+
+
+def get_request(req: Dict) -> Union[Dict, List, None]:
     """
-    Returns the text string, if any, in the request
+    Returns the text string, if any, in the request. A request can also hold several texts, as a ``texts`` array
+    whose items share the other fields of the request, as a JSON array or as JSON Lines.
 
     :param req: a JSON request
-    :return: a text string
+    :return: a text string, a list with an item for each text, or None
     """
     for field in ['body']:
         if field in req:
             data = req[field]
+            if isinstance(data, (str, bytes, bytearray)):
+                items = get_json_lines(data)
+                if items is not None:
+                    return [create_item(item, {}) for item in items]
             if isinstance(data, str):
                 return create_request(data)
             elif isinstance(data, dict) and 'text' in data:
                 return data
+            elif isinstance(data, dict) and isinstance(data.get('texts'), list):
+                fields = {k: v for k, v in data.items() if k != 'texts'}
+                return [create_item(item, fields) for item in data['texts']]
+            elif isinstance(data, list):
+                return [create_item(item, {}) for item in data]
     return None
 
 
@@ -82,3 +222,19 @@ def run_subprocess(text, args):
         encoding='utf-8',
         stdout=subprocess.PIPE)
     return proc.stdout.strip()
+
+
+def report_status(context, code: int, reason: str, idx: int):
+    """
+    Reports the HTTP status of a request in a batch. MMS versions without statuses per request
+    apply it to the whole batch.
+
+    :param context: model server context
+    :param code: HTTP status code
+    :param reason: reason phrase
+    :param idx: position of the request in the batch
+    """
+    if hasattr(context, 'set_response_status'):
+        context.set_response_status(code, reason, idx)
+    else:
+        context.request_processor.report_status(code, reason)
@@ -0,0 +1,241 @@
+"""
+Segments runs of Chinese or Korean characters into dictionary words.
+
+The dictionary is compiled into an array-backed trie that is memory-mapped, so that the workers of a host share one
+copy of it. Every node has a contiguous range of edges, sorted by character, and the cost of the word that ends at the
+node::
+
+    python -m sockeye_serving.word_segmenter build dict.txt words.trie
+    python -m sockeye_serving.word_segmenter segment words.trie < corpus.zh > corpus.seg.zh
+"""
+
+import argparse
+import math
+import mmap
+import struct
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Tuple
+
+import regex as re
+
+VITERBI = 'viterbi'
+MAX_MATCH = 'max-match'
+
+TRIE_MAGIC = b'SSTRIE1\0'
+# magic, number of nodes, number of edges, cost of an unknown character, length of the longest word
+_HEADER = struct.Struct('=8sIIfI')
+
+# Han, CJK symbols and punctuation and Hangul syllables
+CJK_CHARACTERS = re.compile(r'[\p{IsHan}\p{InCJK_Symbols_and_Punctuation}\p{InCJK_Radicals_Supplement}'
+                            r'\p{InCJK_Compatibility}가-힣]+', re.UNICODE)
+
+
+def read_dictionary(path: str) -> Dict[str, float]:
+    """
+    Reads a dictionary with a word and an optional frequency on each line, like the dictionaries of jieba.
+    Further columns, e.g. parts of speech, are ignored.
+
+    :param path: dictionary file
+    :return: the frequency of each word
+    """
+    words = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                freq = float(fields[1]) if len(fields) > 1 else 1.0
+                words[fields[0]] = words.get(fields[0], 0.0) + freq
+    return words
+
+
+def build_trie(words: Dict[str, float]) -> bytes:
+    """
+    Compiles a dictionary into a trie. The cost of a word is its negative log probability,
+    and an unknown character costs more than any word.
+
+    :param words: the frequency of each word
+    :return: the trie in its binary format
+    """
+    total = sum(words.values())
+    children = [{}]  # type: List[Dict[int, int]]
+    costs = array('f', [math.inf])
+    for word, freq in words.items():
+        if freq <= 0:
+            continue
+        node = 0
+        for c in word:
+            child = children[node].get(ord(c))
+            if child is None:
+                child = children[node][ord(c)] = len(children)
+                children.append({})
+                costs.append(math.inf)
+            node = child
+        costs[node] = -math.log(freq / total)
+
+    offsets = array('I', [0])
+    labels = array('I')
+    targets = array('I')
+    for edges in children:
+        for label in sorted(edges):
+            labels.append(label)
+            targets.append(edges[label])
+        offsets.append(len(labels))
+
+    finite = [cost for cost in costs if cost < math.inf]
+    unk_cost = (max(finite) if finite else 0.0) + math.log(10)
+    max_len = max((len(word) for word in words), default=0)
+    header = _HEADER.pack(TRIE_MAGIC, len(children), len(labels), unk_cost, max_len)
+    return b''.join([header, offsets.tobytes(), labels.tobytes(), targets.tobytes(), costs.tobytes()])
+
+
+class WordTrie:
+    """
+    A read-only view of a compiled dictionary
+    """
+
+    def __init__(self, buffer):
+        """
+        :param buffer: the trie in its binary format, e.g. a memory map of a file
+        """
+        self.buffer = buffer
+        magic, num_nodes, num_edges, self.unk_cost, self.max_len = _HEADER.unpack_from(buffer)
+        if magic != TRIE_MAGIC:
+            raise ValueError('Not a compiled dictionary')
+
+        view = memoryview(buffer)
+        offset = _HEADER.size
+        self.offsets, offset = view[offset:offset + 4 * (num_nodes + 1)].cast('I'), offset + 4 * (num_nodes + 1)
+        self.labels, offset = view[offset:offset + 4 * num_edges].cast('I'), offset + 4 * num_edges
+        self.targets, offset = view[offset:offset + 4 * num_edges].cast('I'), offset + 4 * num_edges
+        self.costs = view[offset:offset + 4 * num_nodes].cast('f')
+
+    @classmethod
+    def load(cls, path: str) -> 'WordTrie':
+        """
+        Memory-maps a compiled dictionary
+        """
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def prefixes(self, text: str, start: int) -> Iterator[Tuple[int, float]]:
+        """
+        Finds the dictionary words that start at a position
+
+        :param text: a text
+        :param start: the position
+        :return: an iterator over the end position and cost of every word, shortest first
+        """
+        offsets, labels, targets, costs = self.offsets, self.labels, self.targets, self.costs
+        node = 0
+        for i in range(start, min(len(text), start + self.max_len)):
+            lo, hi = offsets[node], offsets[node + 1]
+            c = ord(text[i])
+            j = bisect_left(labels, c, lo, hi)
+            if j == hi or labels[j] != c:
+                return
+            node = targets[j]
+            if costs[node] < math.inf:
+                yield i + 1, costs[node]
+
+
+class WordSegmenter:
+    """
+    Splits runs of characters into dictionary words, either with the segmentation of the lowest total cost (Viterbi)
+    or by taking the longest word at each position (maximal match). Unknown characters become words of their own.
+    """
+
+    def __init__(self, trie: WordTrie, method: str = VITERBI):
+        self.trie = trie
+        self.method = method
+
+    def segment(self, text: str) -> List[str]:
+        """
+        Segments a run of characters without spaces
+
+        :param text: the characters
+        :return: the words
+        """
+        if self.method == MAX_MATCH:
+            return self.max_match(text)
+        return self.viterbi(text)
+
+    def viterbi(self, text: str) -> List[str]:
+        n = len(text)
+        best = [0.0] + [math.inf] * n
+        back = [0] * (n + 1)
+        for i in range(n):
+            cost = best[i] + self.trie.unk_cost
+            if cost < best[i + 1]:
+                best[i + 1] = cost
+                back[i + 1] = i
+            for j, word_cost in self.trie.prefixes(text, i):
+                cost = best[i] + word_cost
+                if cost < best[j]:
+                    best[j] = cost
+                    back[j] = i
+
+        words = []
+        j = n
+        while j > 0:
+            words.append(text[back[j]:j])
+            j = back[j]
+        return words[::-1]
+
+    def max_match(self, text: str) -> List[str]:
+        words = []
+        i = 0
+        while i < len(text):
+            end = i + 1
+            # the words are found shortest first
+            for end, _ in self.trie.prefixes(text, i):
+                pass
+            words.append(text[i:end])
+            i = end
+        return words
+
+    def sub(self, pattern, text: str) -> str:
+        """
+        Segments every run of characters matched by a pattern, and separates the words with single spaces from each
+        other and from the surrounding text
+
+        :param pattern: a compiled regular expression
+        :param text: a text
+        :return: the tokenized text
+        """
+        def replace(m):
+            start, end = m.span()
+            before = ' ' if start > 0 and not text[start - 1].isspace() else ''
+            after = ' ' if end < len(text) and not text[end].isspace() else ''
+            return before + ' '.join(self.segment(m.group())) + after
+
+        return pattern.sub(replace, text).strip()
+
+
+def main():
+    params = argparse.ArgumentParser(description='Compile dictionaries and segment text into words')
+    subparsers = params.add_subparsers(dest='command')
+    build = subparsers.add_parser('build', help='compile a dictionary with a word and a frequency on each line')
+    build.add_argument('dictionary')
+    build.add_argument('trie')
+    segment = subparsers.add_parser('segment', help='segment the Chinese and Korean characters of text from stdin, '
+                                                    'e.g. to prepare training data')
+    segment.add_argument('trie')
+    segment.add_argument('-m', '--method', choices=[VITERBI, MAX_MATCH], default=VITERBI)
+    args = params.parse_args()
+
+    if args.command == 'build':
+        with open(args.trie, 'wb') as f:
+            f.write(build_trie(read_dictionary(args.dictionary)))
+    elif args.command == 'segment':
+        segmenter = WordSegmenter(WordTrie.load(args.trie), args.method)
+        for line in sys.stdin:
+            print(segmenter.sub(CJK_CHARACTERS, unicodedata.normalize('NFKC', line)))
+    else:
+        params.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,16 @@
+import math
 import os
-import pkg_resources
 import regex as re
 import unicodedata
 
 from .default_handler import DefaultPreprocessor
+from .segmenter import SentenceSplitter
 from .sockeye_handler import SockeyeHandler
-from .text_processor import BpeEncoder, DeBPE, Detokenizer, ProcessorChain
-from .utils import run_subprocess
+from .text_processor import DeBPE, Detokenizer, ProcessorChain
+from .utils import SCRIPTS_PATH, encode_responses, run_subprocess
+
+# the average length of the words of a dictionary segmentation
+CHARS_PER_WORD = 1.5
 
 
 class ChinesePreprocessor(DefaultPreprocessor):
@@ -14,18 +18,27 @@ class ChinesePreprocessor(DefaultPreprocessor):
     Preprocesses Chinese text
     """
 
-    def __init__(self, scripts_path):
-        super().__init__(scripts_path, 'zh')
+    pattern = re.compile(
+        r'([\p{IsHan}\p{InCJK_Symbols_and_Punctuation}\p{InCJK_Radicals_Supplement}\p{InCJK_Compatibility}])',
+        re.UNICODE)
+
+    words = re.compile(
+        r'[\p{IsHan}\p{InCJK_Symbols_and_Punctuation}\p{InCJK_Radicals_Supplement}\p{InCJK_Compatibility}]+',
+        re.UNICODE)
 
-        self.pattern = re.compile(
-            r'([\p{IsHan}\p{InCJK_Symbols_and_Punctuation}\p{InCJK_Radicals_Supplement}\p{InCJK_Compatibility}])',
-            re.UNICODE)
+    def __init__(self, scripts_path, word_segmenter=None):
+        super().__init__(scripts_path, 'zh')
+        self.word_segmenter = word_segmenter
 
     def run(self, text):
         text = self.unescape(text)
         text = unicodedata.normalize('NFKC', text)
         text = self.remove_control_characters(text)
 
+        if self.word_segmenter is not None:
+            # tokenize by segmenting runs of ZH characters into words
+            return self.word_segmenter.sub(self.words, text)
+
         # tokenize by separating all ZH characters with a space
         return self.pattern.sub(r' \1 ', text).strip()
 
@@ -35,22 +48,31 @@ class ChineseHandler(SockeyeHandler):
     Consumes Chinese text of arbitrary length and returns its translation.
     """
 
-    def initialize(self, context):
-        super().initialize(context)
-        scripts_path = pkg_resources.resource_filename(
-            'sockeye_serving', 'scripts')
-        bpe_codes = os.path.join(self.basedir, 'bpe-codes.txt')
+    def estimate_tokens(self, text):
+        # every Chinese character becomes a token, or with a dictionary, every word, whose number is estimated
+        # from the average word length rather than by segmenting the text before admission control
+        characters = len(ChinesePreprocessor.pattern.findall(text))
+        others = len(ChinesePreprocessor.pattern.sub(' ', text).split())
+        if self.word_segmenter is not None:
+            return others + math.ceil(characters / CHARS_PER_WORD)
+        return others + characters
+
+    def init_processors(self, context):
+        scripts_path = SCRIPTS_PATH
 
-        preprocessors = [ChinesePreprocessor(scripts_path)]
-        if os.path.isfile(bpe_codes):
-            preprocessors.append(BpeEncoder(bpe_codes))
+        self.word_segmenter = self.get_word_segmenter()
+        preprocessors = [ChinesePreprocessor(scripts_path, self.word_segmenter)]
+        bpe_encoder = self.get_bpe_encoder()
+        if bpe_encoder is not None:
+            preprocessors.append(bpe_encoder)
 
         self.preprocessor = ProcessorChain(preprocessors)
         self.postprocessor = DeBPE()
+        self.segmenter = SentenceSplitter('zh', os.path.join(scripts_path, 'nonbreaking_prefixes'))
 
 
 _service = ChineseHandler()
 
 
 def handle(data, context):
-    return _service.handle(data, context)
+    return encode_responses(_service.handle(data, context), context)
@@ -0,0 +1,23 @@
+from sockeye_serving.admission import ADMIT, DOWNGRADE, REJECT, SHED, AdmissionControl
+
+
+def test_request_budget():
+    admission = AdmissionControl(request_budget=100)
+    assert admission.cost(10, 1, 5) == 100
+    assert admission.admit([(10, 0, 5), (10, 1, 5), (21, 0, 5)]) == [(ADMIT, 50), (ADMIT, 100), (REJECT, 105)]
+    assert AdmissionControl().admit([(1000, 10, 5)]) == [(ADMIT, 55000)]
+
+
+def test_batch_budget():
+    admission = AdmissionControl(batch_budget=100)
+    # requests that don't fit into the rest of the batch are shed, later smaller ones are still admitted
+    assert admission.admit([(10, 0, 5), (12, 0, 5), (8, 0, 5), (1, 0, 5)]) == \
+        [(ADMIT, 50), (SHED, 60), (ADMIT, 40), (ADMIT, 5)]
+
+
+def test_downgrade():
+    admission = AdmissionControl(request_budget=100, batch_budget=150, downgrade_beam_size=2)
+    assert admission.admit([(30, 0, 5), (10, 0, 5), (40, 0, 5), (60, 0, 5), (20, 0, 1)]) == \
+        [(DOWNGRADE, 60), (ADMIT, 50), (REJECT, 200), (REJECT, 300), (ADMIT, 20)]
+    # the second request fits into the batch only when downgraded, the third not even then
+    assert admission.admit([(20, 0, 5), (20, 0, 5), (10, 0, 5)]) == [(ADMIT, 100), (DOWNGRADE, 40), (SHED, 50)]
@@ -0,0 +1,35 @@
+import os
+
+from sockeye_serving.artifacts import artifact_path, cached_pickle
+
+
+def test_artifact_path(tmpdir):
+    source = tmpdir.join('bpe-codes.txt')
+    source.write('a b\n')
+    path = artifact_path(str(tmpdir), 'bpe', [str(source)], 'pkl')
+
+    assert path == artifact_path(str(tmpdir), 'bpe', [str(source)], 'pkl')
+    assert path != artifact_path(str(tmpdir), 'bpe', [str(source)], 'pkl', size=10)
+
+    source.write('a b\nc d\n')
+    assert path != artifact_path(str(tmpdir), 'bpe', [str(source)], 'pkl')
+
+
+def test_cached_pickle(tmpdir):
+    path = str(tmpdir.join('artifacts', 'words.pkl'))
+    builds = []
+
+    def build():
+        builds.append(1)
+        return [('hello', 'hel@@ lo')]
+
+    assert cached_pickle(path, build) == [('hello', 'hel@@ lo')]
+    assert cached_pickle(path, build) == [('hello', 'hel@@ lo')]
+    assert len(builds) == 1
+    assert os.listdir(os.path.dirname(path)) == ['words.pkl']
+
+    # a corrupt artifact is rebuilt
+    with open(path, 'wb') as f:
+        f.write(b'corrupt')
+    assert cached_pickle(path, build) == [('hello', 'hel@@ lo')]
+    assert len(builds) == 2
@@ -0,0 +1,110 @@
+import json
+import os
+from argparse import Namespace
+
+import pytest
+
+from sockeye_serving.bulk import shards, read_checkpoint, translate_file, write_checkpoint
+
+# stands in for a handler: translates by upper-casing, rejects lines that start with 'reject',
+# and fails to load a model directory that contains a file named 'broken'
+STUB_HANDLER = '''
+import os
+
+from sockeye_serving.utils import report_status
+
+
+class StubHandler:
+    def handle(self, data, context):
+        if data is None:
+            if os.path.exists(os.path.join(context.system_properties['model_dir'], 'broken')):
+                raise IOError('Broken model')
+            return None
+        res = []
+        for i, req in enumerate(data):
+            text = req['body']['text']
+            if text.startswith('reject'):
+                report_status(context, 413, 'Too long', i)
+                res.append('Too long')
+            else:
+                res.append({'translation': text.upper()})
+        return res
+
+
+_service = StubHandler()
+'''
+
+
+@pytest.fixture
+def my_args(tmp_path, monkeypatch):
+    package = tmp_path / 'bulkstub'
+    package.mkdir()
+    (package / '__init__.py').write_text('')
+    (package / 'handler.py').write_text(STUB_HANDLER)
+    # the worker processes are spawned with the same path
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    model_dir = tmp_path / 'en'
+    model_dir.mkdir()
+    inp = tmp_path / 'input.txt'
+    inp.write_text('one\ntwo\n\nreject me\nfive\nsix\n')
+    return Namespace(model_dir=str(model_dir), handler='bulkstub.handler', input=str(inp),
+                     output=str(tmp_path / 'output.txt'), lang=None, workers=2, batch_size=2, shard_bytes=4,
+                     json=False)
+
+
+def test_shards():
+    data = b'one\ntwo\nthree\n\nfive\n'
+    assert list(shards(data, 1)) == [(0, 3), (4, 7), (8, 13), (14, 19)]
+    assert list(shards(data, 5)) == [(0, 7), (8, 13), (14, 19)]
+    assert list(shards(data, 100)) == [(0, 19)]
+    # resuming after the second shard
+    assert list(shards(data, 5, 8)) == [(8, 13), (14, 19)]
+    assert list(shards(data, 5, 20)) == []
+
+    # every line is in exactly one shard
+    for size in range(1, 8):
+        lines = [line for s, e in shards(data, size) for line in data[s:e].split(b'\n')]
+        assert lines == data.split(b'\n')[:-1]
+
+    assert list(shards(b'no line break', 4)) == [(0, 13)]
+    assert list(shards(b'\n', 4)) == [(0, 0)]
+    assert list(shards(b'', 4)) == []
+
+
+def test_checkpoint(tmpdir):
+    path = str(tmpdir.join('out.txt.checkpoint'))
+    assert read_checkpoint(path) is None
+    write_checkpoint(path, {'input_offset': 8, 'lines': 2})
+    write_checkpoint(path, {'input_offset': 14, 'lines': 3})
+    assert read_checkpoint(path) == {'input_offset': 14, 'lines': 3}
+    assert tmpdir.listdir() == [tmpdir.join('out.txt.checkpoint')]
+
+
+def test_translate_file(my_args):
+    expected = ['ONE', 'TWO', '', json.dumps({'error': 'Too long'}, separators=(',', ':')), 'FIVE', 'SIX']
+    checkpoint = translate_file(my_args)
+    assert checkpoint['lines'] == 6
+    with open(my_args.output, encoding='utf-8') as f:
+        assert f.read().split('\n')[:-1] == expected
+
+    # an interrupted job resumes after the last checkpoint and discards the output written after it
+    with open(my_args.output, 'rb') as f:
+        output = f.read()
+    checkpoint.update(input_offset=8, output_offset=8, lines=2)
+    write_checkpoint(f'{my_args.output}.checkpoint', checkpoint)
+    with open(my_args.output, 'ab') as f:
+        f.write(b'partial')
+    assert translate_file(my_args)['lines'] == 6
+    with open(my_args.output, 'rb') as f:
+        assert f.read() == output
+
+    # a finished job does not load the model again
+    open(os.path.join(my_args.model_dir, 'broken'), 'w').close()
+    assert translate_file(my_args)['lines'] == 6
+
+
+def test_translate_file_broken(my_args):
+    open(os.path.join(my_args.model_dir, 'broken'), 'w').close()
+    with pytest.raises(IOError, match='Broken model'):
+        translate_file(my_args)
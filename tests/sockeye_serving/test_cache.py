@@ -0,0 +1,64 @@
+import time
+from argparse import Namespace
+from types import SimpleNamespace
+
+import pytest
+
+from sockeye_serving.cache import SqliteTranslationCache, TranslationCache, cache_key, cache_namespace
+
+
+@pytest.fixture
+def my_value():
+    return 'a b', ['a', 'b'], -1.5
+
+
+def test_lru(my_value):
+    cache = TranslationCache(max_size=2)
+    cache.put('a', my_value)
+    cache.put('b', my_value)
+    assert cache.get('a') == my_value
+    cache.put('c', my_value)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == my_value
+    assert cache.get('c') == my_value
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1, 'size': 2}
+
+
+def test_ttl(my_value):
+    cache = TranslationCache(max_size=2, ttl=0.05)
+    cache.put('a', my_value)
+    assert cache.get('a') == my_value
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_sqlite(tmp_path, my_value):
+    path = str(tmp_path / 'cache.db')
+    cache = SqliteTranslationCache(path, max_size=2)
+    other = SqliteTranslationCache(path, max_size=2)
+
+    cache.put('a', my_value)
+    assert other.get('a') == my_value
+
+    other.put('b', my_value)
+    other.put('c', my_value)
+    assert len(other) == 2
+    assert cache.get('a') is None
+    assert cache.get('c') == my_value
+
+
+def test_cache_key():
+    namespace = cache_namespace(Namespace(models=['/models/en'], beam_size=5))
+    assert namespace != cache_namespace(Namespace(models=['/models/en'], beam_size=10))
+    assert namespace != cache_namespace(Namespace(models=['/models/de'], beam_size=5))
+
+    def make_input(constraints=None, avoid_list=None):
+        return SimpleNamespace(tokens=['a', 'b'], constraints=constraints, avoid_list=avoid_list,
+                               pass_through_dict={'text': 'a b'})
+
+    key = cache_key(namespace, make_input())
+    assert key == cache_key(namespace, make_input())
+    assert key != cache_key(namespace, make_input(constraints=[['c']]))
+    assert key != cache_key(namespace, make_input(avoid_list=[['c']]))
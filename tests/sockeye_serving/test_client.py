@@ -0,0 +1,162 @@
+import importlib.machinery
+import importlib.util
+import json
+import os
+import threading
+import time
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+client_path = os.path.join(os.path.dirname(__file__), '..', '..', 'bin', 'sockeye-client')
+
+
+def load_client():
+    loader = importlib.machinery.SourceFileLoader('sockeye_client', client_path)
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    Stands in for the prediction API: translates by upper-casing, and fails the first attempt of texts
+    that start with 'retry' and every attempt of texts that start with 'fail'. Requests with a text that starts with
+    'huge' are rejected as a whole, those with a text that starts with 'garbage' get a response that is not JSON,
+    and those with a text that starts with 'slow' time out.
+    """
+    protocol_version = 'HTTP/1.1'
+    attempts = {}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if 'texts' in body:
+            # a failing item gets an error entry
+            texts = [r if isinstance(r, dict) else {'text': r} for r in body['texts']]
+            status, data = 200, json.dumps([{'error': 'Bad item'} if r['text'].startswith('fail') else
+                                            {'translation': r['text'].upper()} for r in texts]).encode('utf-8')
+            if any(r['text'].startswith('huge') for r in texts):
+                status, data = 413, b'Payload Too Large'
+            elif any(r['text'].startswith('garbage') for r in texts):
+                data = b'<html>'
+            elif any(r['text'].startswith('slow') for r in texts):
+                time.sleep(0.5)
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        text = body['text']
+        self.attempts[text] = self.attempts.get(text, 0) + 1
+
+        if text.startswith('fail') or (text.startswith('retry') and self.attempts[text] == 1):
+            status, data = 503, b'Service Unavailable'
+        else:
+            status, data = 200, json.dumps({'translation': text.upper()}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def my_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PredictionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_batch(my_server, tmpdir, capsys):
+    client = load_client()
+    cli = client.HttpClient()
+    cli.prediction_url = my_server
+
+    lines = ['{"text": "hello"}', '', 'plain text', '"retry me"'] + [json.dumps({'text': f'line {i}'})
+                                                                         for i in range(20)]
+    inp = tmpdir.join('requests.jsonl')
+    inp.write('\n'.join(lines) + '\n')
+    out = tmpdir.join('out.jsonl')
+
+    cli.batch(Namespace(model_name='en', file=str(inp), output=str(out), concurrency=4, retries=2, backoff=0.01,
+                        texts_per_request=1))
+
+    results = [json.loads(line) for line in out.readlines()]
+    assert [r['line'] for r in results] == [1, 3, 4] + list(range(5, 25))
+    assert [r['translation'] for r in results[:3]] == ['HELLO', 'PLAIN TEXT', 'RETRY ME']
+    assert results[-1]['translation'] == 'LINE 19'
+    assert '23 requests' in capsys.readouterr().err
+
+
+def test_batch_failure(my_server, tmpdir):
+    client = load_client()
+    cli = client.HttpClient()
+    cli.prediction_url = my_server
+
+    inp = tmpdir.join('requests.jsonl')
+    inp.write('fail\nok\n')
+    out = tmpdir.join('out.jsonl')
+
+    with pytest.raises(SystemExit):
+        cli.batch(Namespace(model_name='en', file=str(inp), output=str(out), concurrency=2, retries=1, backoff=0.01,
+                            texts_per_request=1))
+
+    results = [json.loads(line) for line in out.readlines()]
+    assert results[0]['line'] == 1 and results[0]['error'].startswith('503')
+    assert results[1] == {'line': 2, 'translation': 'OK'}
+    assert PredictionHandler.attempts['fail'] == 2
+
+
+def test_batch_texts(my_server, tmpdir):
+    client = load_client()
+    cli = client.HttpClient()
+    cli.prediction_url = my_server
+
+    inp = tmpdir.join('requests.jsonl')
+    inp.write('a\nfail\n\n{"text": "c"}\nd\ne\n')
+    out = tmpdir.join('out.jsonl')
+
+    with pytest.raises(SystemExit):
+        cli.batch(Namespace(model_name='en', file=str(inp), output=str(out), concurrency=2, retries=1, backoff=0.01,
+                            texts_per_request=2))
+
+    results = [json.loads(line) for line in out.readlines()]
+    assert results == [{'line': 1, 'translation': 'A'}, {'line': 2, 'error': 'Bad item'},
+                       {'line': 4, 'translation': 'C'}, {'line': 5, 'translation': 'D'},
+                       {'line': 6, 'translation': 'E'}]
+
+
+def test_upload_stream(my_server, tmpdir):
+    client = load_client()
+    cli = client.HttpClient()
+    cli.prediction_url = my_server
+    cli.timeout = 0.2
+
+    inp = tmpdir.join('input.txt')
+    inp.write('a\n\nb c\nfail\nd\nhuge\ne\ngarbage\nslow\nf\n')
+    out = tmpdir.join('out.jsonl')
+
+    with pytest.raises(SystemExit):
+        cli.upload_stream(Namespace(model_name='en', file=str(inp), output=str(out), chunk_size=2, retries=1,
+                                    backoff=0.01))
+
+    results = [json.loads(line) for line in out.readlines()]
+    assert [r['line'] for r in results] == list(range(1, 11))
+    assert results[:4] == [{'line': 1, 'translation': 'A'}, {'line': 2, 'translation': ''},
+                           {'line': 3, 'translation': 'B C'}, {'line': 4, 'error': 'Bad item'}]
+    # the lines of a chunk that fails as a whole get its error
+    assert results[4]['error'].startswith('413') and results[5]['error'] == results[4]['error']
+    assert results[6] == {'line': 7, 'error': results[7]['error']}
+    assert results[8]['error'] == results[9]['error']
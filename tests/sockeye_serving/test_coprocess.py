@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import sockeye_serving
+from sockeye_serving import utils
+from sockeye_serving.coprocess import CoProcess, CoProcessError, get_coprocess
+
+
+@pytest.fixture
+def tokenizer_args():
+    scripts_path = os.path.join(os.path.dirname(sockeye_serving.__file__), 'scripts')
+    return [os.path.join(scripts_path, 'tokenizer.perl'), '-b', '-l', 'en', '-no-escape', '-q']
+
+
+def test_run(tokenizer_args):
+    proc = CoProcess(tokenizer_args)
+    try:
+        for text in ['Hello, world!', "It's Mr. Smith's car.", 'a\nb, c', '', '  ']:
+            assert proc.run(text) == utils.run_subprocess(text, tokenizer_args)
+    finally:
+        proc.close()
+
+
+def test_run_lines(tokenizer_args):
+    proc = CoProcess(tokenizer_args)
+    try:
+        lines = [f'Line {i}, of many.' for i in range(5000)]
+        assert proc.run_lines(lines) == [f'Line {i} , of many .' for i in range(5000)]
+    finally:
+        proc.close()
+
+
+def test_restart(tokenizer_args):
+    proc = CoProcess(tokenizer_args)
+    try:
+        assert proc.run('a,b') == 'a , b'
+        proc.proc.kill()
+        proc.proc.wait()
+        assert proc.run('a,b') == 'a , b'
+    finally:
+        proc.close()
+
+
+def test_hang():
+    proc = CoProcess(['sleep', '10'], timeout=0.2)
+    with pytest.raises(CoProcessError):
+        proc.run('abc')
+    proc.close()
+
+
+def test_get_coprocess(tokenizer_args):
+    assert get_coprocess(tokenizer_args) is get_coprocess(list(tokenizer_args))
@@ -1,9 +1,11 @@
 import os
+import shutil
 
 import pytest
 from mms.context import Context
 
-from sockeye_serving import sockeye_handler, default_handler, ko_handler, zh_handler
+from sockeye_serving import sockeye_handler, default_handler, ko_handler, router_handler, zh_handler
+from sockeye_serving.translation_memory import MinHasher, build_memory
 
 
 @pytest.fixture
@@ -17,6 +19,22 @@ def my_ctx():
                    mms_version='1.0.3')
 
 
+@pytest.fixture
+def my_model_dir(my_ctx, tmp_path):
+    """
+    Copies the test model into a model directory with the given handler options, and points the context to it
+    """
+    def make(serving_args=None, name='en'):
+        model_dir = tmp_path / name
+        shutil.copytree(my_ctx.system_properties['model_dir'], str(model_dir))
+        if serving_args is not None:
+            (model_dir / 'serving-args.txt').write_text(serving_args)
+        my_ctx.system_properties['model_dir'] = str(model_dir)
+        return model_dir
+
+    return make
+
+
 def run_test(handler: sockeye_handler.SockeyeHandler, context: Context):
     handler.initialize(context)
     assert handler.initialized
@@ -39,3 +57,188 @@ def test_ko_handler(my_ctx):
 
 def test_zh_handler(my_ctx):
     run_test(zh_handler.ChineseHandler(), my_ctx)
+
+
+@pytest.mark.skipif(shutil.which('perl') is None, reason='perl is required for the Moses scripts')
+def test_moses_perl(my_ctx, my_model_dir):
+    my_model_dir('--moses-perl')
+    handler = default_handler.DefaultHandler()
+    run_test(handler, my_ctx)
+    assert handler.preprocessor.chain[0].run('Hello, world!') == 'Hello , world !'
+    assert handler.postprocessor.run('Hello , world !') == 'Hello, world!'
+
+
+def test_router_handler(my_ctx, tmp_path):
+    resources = my_ctx.system_properties['model_dir']
+    for name in ['en', 'ko', 'zh']:
+        shutil.copytree(resources, str(tmp_path / name))
+    (tmp_path / 'serving-args.txt').write_text('--max-models 2')
+    my_ctx.system_properties['model_dir'] = str(tmp_path)
+
+    handler = router_handler.RouterHandler()
+    handler.handle(None, my_ctx)
+    assert list(handler.loaded) == ['en']
+
+    response = handler.handle([{'body': {'text': 'a b c 123', 'lang': 'ko'}},
+                               {'body': 'a b c 123'},
+                               {'body': {'text': 'a b c 123', 'model': 'zh'}}], my_ctx)
+    assert len(response) == 3
+    assert all(r.get('translation') for r in response)
+    assert isinstance(handler.loaded['zh'], zh_handler.ChineseHandler)
+    # the least recently used model is unloaded
+    assert list(handler.loaded) == ['en', 'zh']
+
+    # an unloaded model releases the translators of its decoding profiles too
+    (tmp_path / 'ko' / 'serving-args.txt').write_text('--decoding-profile fast:1')
+    ko = handler.get_handler('ko', my_ctx)
+    assert ko.profiles and list(handler.loaded) == ['zh', 'ko']
+    handler.get_handler('zh', my_ctx)
+    handler.get_handler('en', my_ctx)
+    assert list(handler.loaded) == ['zh', 'en']
+    assert not ko.initialized and ko.translator is None and ko.sockeye_args is None
+    assert ko.profiles == {} and ko.schedulers == {}
+
+    # requests for unknown models or languages are rejected without failing the others
+    response = handler.handle([{'body': {'text': 'a b c 123', 'model': 'zzz'}},
+                               {'body': 'a b c 123'},
+                               {'body': {'text': 'a b c 123', 'lang': 'zzz'}}], my_ctx)
+    assert response[0] == 'Unknown model zzz'
+    assert response[1].get('translation')
+    assert response[2] == 'No model for language zzz'
+
+
+def test_bad_input(my_ctx, monkeypatch):
+    handler = default_handler.DefaultHandler()
+    handler.handle(None, my_ctx)
+    make_input = sockeye_handler.inference.make_input_from_dict
+
+    def make_bad_input(sentence_id, input_dict, translator):
+        # like a request with factors of the wrong length
+        if input_dict['text'] == 'x':
+            return sockeye_handler.inference.BadTranslatorInput(sentence_id, [])
+        return make_input(sentence_id, input_dict, translator)
+
+    monkeypatch.setattr(sockeye_handler.inference, 'make_input_from_dict', make_bad_input)
+    response = handler.handle([{'body': 'x'}, {'body': {'text': 'a b c 123', 'fields': ['translation']}}], my_ctx)
+    assert response[0]['translation'] == ''
+    assert response[1].get('translation')
+
+
+def test_admission(my_ctx, my_model_dir):
+    my_model_dir('--request-cost-budget 100')
+
+    handler = default_handler.DefaultHandler()
+    handler.handle(None, my_ctx)
+    long_text = ' '.join(['a'] * (100 // handler.translator.beam_size + 1))
+
+    response = handler.handle([{'body': 'a b c 123'}, {'body': long_text}, {'body': 'a b'}], my_ctx)
+    assert len(response) == 3
+    assert response[0].get('translation') and response[2].get('translation')
+    assert response[1].startswith('Request cost')
+    assert handler.metrics.histograms['RequestCost'][3] == 3
+
+
+def test_constrained_batches(my_ctx):
+    handler = default_handler.DefaultHandler()
+    handler.handle(None, my_ctx)
+    batches = []
+    translate = handler.translator.translate
+
+    def record(trans_inputs, **kwargs):
+        batches.append([handler.decoding_kind(i) for i in trans_inputs])
+        return translate(trans_inputs, **kwargs)
+
+    handler.translator.translate = record
+    response = handler.handle([{'body': {'text': 'a b c', 'constraints': ['b']}},
+                               {'body': 'a b c 123'},
+                               {'body': {'text': 'a c', 'avoid': ['c']}},
+                               {'body': {'text': 'c b', 'constraints': ['b']}}], my_ctx)
+    assert all(r.get('translation') for r in response)
+    # every decoder batch has one kind of input
+    assert all(len(set(kinds)) == 1 for kinds in batches)
+    assert sorted(k for kinds in batches for k in kinds) == [sockeye_handler.AVOID, sockeye_handler.CONSTRAINED,
+                                                             sockeye_handler.CONSTRAINED,
+                                                             sockeye_handler.UNCONSTRAINED]
+
+
+def test_scheduler_groups(my_ctx, my_model_dir):
+    model_dir = my_model_dir('--batch-latency-target 0.000001')
+    with open(str(model_dir / 'sockeye-args.txt'), 'a') as f:
+        f.write('\n--batch-size 4\n')
+
+    handler = default_handler.DefaultHandler()
+    handler.handle(None, my_ctx)
+    response = handler.handle([{'body': {'text': 'a b c', 'constraints': ['b']}}], my_ctx)
+    assert response[0].get('translation')
+    # slow constrained batches shrink the batch size of constrained inputs only
+    assert handler.get_scheduler(None, sockeye_handler.CONSTRAINED).batch_size == 2
+    assert handler.scheduler.batch_size == 4
+
+
+def test_texts(my_ctx, my_model_dir):
+    my_model_dir('--request-cost-budget 100')
+
+    handler = default_handler.DefaultHandler()
+    handler.handle(None, my_ctx)
+    long_text = ' '.join(['a'] * (100 // handler.translator.beam_size + 1))
+
+    response = handler.handle([{'body': {'texts': ['a b', 5, long_text, {'text': 'c d'}], 'fields': ['translation']}},
+                               {'body': 'a b c 123'},
+                               {'body': {'text': 'a b', 'profile': 'zzz'}}], my_ctx)
+    assert len(response) == 3
+    items = response[0]
+    assert len(items) == 4
+    assert list(items[0]) == ['translation'] and list(items[3]) == ['translation']
+    assert items[1]['error'].startswith('A request must be')
+    assert items[2]['error'].startswith('Request cost')
+    assert response[1].get('translation')
+    assert response[2] == 'Unknown decoding profile zzz'
+    assert my_ctx.request_processor.status == (sockeye_handler.BAD_REQUEST_STATUS, response[2])
+
+
+def test_response_fields(my_ctx, my_model_dir):
+    my_model_dir('--response-fields translation')
+
+    handler = default_handler.DefaultHandler()
+    handler.handle(None, my_ctx)
+    response = handler.handle([{'body': 'a b c 123'},
+                               {'body': {'text': 'a b c 123', 'fields': ['translation', 'score', 'zzz']}}], my_ctx)
+    assert list(response[0]) == ['translation']
+    assert list(response[1]) == ['translation', 'score']
+    assert response[0]['translation'] == response[1]['translation']
+
+    response = handler.handle([{'body': {'text': 'a b c', 'fields': 'translation'}}], my_ctx)
+    assert response[0].startswith('The fields of a request')
+
+
+def test_translation_memory(my_ctx, my_model_dir):
+    model_dir = my_model_dir()
+
+    handler = default_handler.DefaultHandler()
+    handler.initialize(my_ctx)
+    assert handler.memory is None
+    source = handler.preprocessor.run('a b c d e f').split()
+    (model_dir / 'memory.tm').write_bytes(build_memory([(source, ['x', 'y', 'f'], -1.0)], MinHasher()))
+    (model_dir / 'serving-args.txt').write_text('--memory memory.tm --memory-threshold 0.7 --decoding-profile fast:1')
+    handler.initialize(my_ctx)
+
+    response = handler.handle([{'body': 'a b c d e g'}, {'body': 'x y z'}], my_ctx)
+    assert response[0]['translation'] == 'x y g'
+    assert response[1].get('translation')
+    assert handler.metrics.totals['MemorySentences'] == 1
+
+    # an adapted translation is cached, and other profiles are decoded
+    response = handler.handle([{'body': 'a b c d e g'}, {'body': {'text': 'a b c d e h', 'profile': 'fast'}}],
+                              my_ctx)
+    assert response[0]['translation'] == 'x y g'
+    assert response[1]['translation'] != 'x y h'
+    assert handler.metrics.totals['MemorySentences'] == 1
+
+
+def test_word_dict(my_ctx, my_model_dir):
+    model_dir = my_model_dir('--word-dict dict.txt', 'zh')
+    (model_dir / 'dict.txt').write_text('中国 10\n人民 8\n', encoding='utf-8')
+
+    handler = zh_handler.ChineseHandler()
+    run_test(handler, my_ctx)
+    assert handler.preprocessor.chain[0].run('我是中国人民') == '我 是 中国 人民'
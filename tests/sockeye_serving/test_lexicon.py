@@ -0,0 +1,38 @@
+import numpy as np
+
+from sockeye_serving.lexicon import build_lexicon, format_alignment, parse_alignment, read_log, save_lexicon
+
+SOURCE_VOCAB = {'<pad>': 0, '<unk>': 1, '<s>': 2, '</s>': 3, 'ein': 4, 'haus': 5, 'das': 6}
+TARGET_VOCAB = {'<pad>': 0, '<unk>': 1, '<s>': 2, '</s>': 3, 'a': 4, 'house': 5, 'the': 6, 'home': 7}
+
+
+def test_build_lexicon():
+    pairs = [
+        ('ein haus'.split(), 'a house'.split(), parse_alignment('0-0 1-1')),
+        ('das haus'.split(), 'the home'.split(), parse_alignment('0-0 1-1')),
+        ('das haus'.split(), 'the house'.split(), parse_alignment('0-0 1-1 5-5')),
+        ('ein xyz'.split(), 'a xyz'.split(), None),
+    ]
+    lex = build_lexicon(pairs, SOURCE_VOCAB, TARGET_VOCAB, 2)
+    assert lex.dtype == np.uint16
+    assert lex.shape == (len(SOURCE_VOCAB), 2)
+    # most frequent first
+    assert lex[5].tolist() == [5, 7]
+    assert lex[6].tolist() == [6, 0]
+    # co-occurrences without alignment; unknown words are left out
+    assert lex[4].tolist() == [4, 0]
+    assert lex[1].tolist() == [0, 0]
+
+
+def test_lexicon_log(tmpdir):
+    assert format_alignment(np.array([[0.1, 0.9], [0.8, 0.2], [0.5, 0.5]])) == '1-0 0-1 0-2'
+
+    log = tmpdir.join('lexicon.tsv')
+    log.write('ein haus\ta house\t0-0 1-1\ndas haus\tthe house\t\n')
+    pairs = list(read_log(str(log)))
+    assert pairs == [(['ein', 'haus'], ['a', 'house'], [(0, 0), (1, 1)]), (['das', 'haus'], ['the', 'house'], None)]
+
+    path = str(tmpdir.join('lexicon.npy'))
+    save_lexicon(path, build_lexicon(pairs, SOURCE_VOCAB, TARGET_VOCAB, 3))
+    lex = np.load(path, mmap_mode='r')
+    assert lex[5].tolist() == [5, 6, 0]
@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import pytest
+
+from sockeye_serving.metrics import PERCENT, HandlerMetrics
+
+
+class MyMetricsStore:
+    def __init__(self):
+        self.metrics = []
+
+    def add_time(self, name, value):
+        self.metrics.append(('time', name))
+
+    def add_counter(self, name, value):
+        self.metrics.append(('counter', name, value))
+
+    def add_percent(self, name, value):
+        self.metrics.append(('percent', name, value))
+
+
+@pytest.fixture
+def my_metrics():
+    return HandlerMetrics('en')
+
+
+def test_flush(my_metrics):
+    context = SimpleNamespace(metrics=MyMetricsStore())
+    with my_metrics.time('TranslateTime'):
+        pass
+    my_metrics.add('InputTokens', 3)
+    my_metrics.add('InputTokens', 4)
+    my_metrics.set('PaddingRatio', 25, PERCENT)
+
+    batch = my_metrics.flush(context)
+    assert batch['InputTokens'] == 7
+    assert context.metrics.metrics == [('time', 'TranslateTime'), ('counter', 'InputTokens', 7),
+                                       ('percent', 'PaddingRatio', 25)]
+    assert my_metrics.flush(context) == {}
+
+
+def test_prometheus(my_metrics, tmp_path):
+    my_metrics.add('InputTokens', 3)
+    my_metrics.add('DeBPETime', 1500, 'ms')
+    my_metrics.set('CacheSize', 10)
+    my_metrics.flush(SimpleNamespace(metrics=None))
+    my_metrics.add('InputTokens', 2)
+    my_metrics.flush(SimpleNamespace(metrics=None))
+
+    text = my_metrics.prometheus_text()
+    assert 'sockeye_serving_input_tokens_total{model="en"} 5\n' in text
+    assert 'sockeye_serving_de_bpe_seconds_sum{model="en"} 1.500000\n' in text
+    assert 'sockeye_serving_de_bpe_seconds_count{model="en"} 1\n' in text
+    assert 'sockeye_serving_cache_size{model="en"} 10\n' in text
+
+    path = tmp_path / 'metrics-{pid}.prom'
+    my_metrics.write_prometheus(str(path))
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_histogram(my_metrics):
+    for value in [5, 10, 40, 1000]:
+        my_metrics.observe('RequestCost', value, [10, 100])
+
+    text = my_metrics.prometheus_text()
+    assert '# TYPE sockeye_serving_request_cost histogram\n' in text
+    assert 'sockeye_serving_request_cost_bucket{model="en",le="10"} 2\n' in text
+    assert 'sockeye_serving_request_cost_bucket{model="en",le="100"} 3\n' in text
+    assert 'sockeye_serving_request_cost_bucket{model="en",le="+Inf"} 4\n' in text
+    assert 'sockeye_serving_request_cost_sum{model="en"} 1055\n' in text
+    assert 'sockeye_serving_request_cost_count{model="en"} 4\n' in text
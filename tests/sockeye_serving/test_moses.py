@@ -0,0 +1,58 @@
+import os
+import shutil
+
+import pytest
+
+import sockeye_serving
+from sockeye_serving.coprocess import CoProcess
+from sockeye_serving.moses import MosesDetokenizer, MosesTokenizer
+
+scripts_path = os.path.join(os.path.dirname(sockeye_serving.__file__), 'scripts')
+prefixes_path = os.path.join(scripts_path, 'nonbreaking_prefixes')
+resources_path = os.path.join(os.path.dirname(__file__), 'resources')
+
+requires_perl = pytest.mark.skipif(shutil.which('perl') is None, reason='perl is required for conformance tests')
+
+
+def read_lines(name):
+    with open(os.path.join(resources_path, name), encoding='utf-8') as f:
+        return f.read().split('\n')
+
+
+def run_perl(args, lines):
+    proc = CoProcess(args)
+    try:
+        return proc.run_lines(lines)
+    finally:
+        proc.close()
+
+
+@requires_perl
+@pytest.mark.parametrize('lang', ['en', 'de', 'fr', 'fi', 'it', 'ga', 'so', 'ru', 'zz'])
+@pytest.mark.parametrize('options', [['-no-escape'], [], ['-a', '-no-escape']])
+def test_tokenizer_conformance(lang, options):
+    lines = read_lines('moses-corpus.txt')
+    expected = run_perl([os.path.join(scripts_path, 'tokenizer.perl'), '-b', '-q', '-l', lang] + options, lines)
+
+    tokenizer = MosesTokenizer(lang, prefixes_path, aggressive='-a' in options, no_escape='-no-escape' in options)
+    assert [tokenizer.tokenize(line) for line in lines] == expected
+
+
+@requires_perl
+@pytest.mark.parametrize('lang', ['en', 'fr', 'de'])
+def test_detokenizer_conformance(lang):
+    tokenizer = MosesTokenizer('en', prefixes_path)
+    lines = read_lines('moses-tokenized.txt') + [tokenizer.tokenize(line) for line in read_lines('moses-corpus.txt')]
+    expected = run_perl([os.path.join(scripts_path, 'detokenize.pl'), '-b', '-l', lang], lines)
+
+    detokenizer = MosesDetokenizer(lang)
+    assert [detokenizer.detokenize(line) for line in lines] == expected
+
+
+def test_run():
+    tokenizer = MosesTokenizer('en', prefixes_path)
+    assert tokenizer.run("It's Mr. Smith's car.") == "It 's Mr. Smith 's car ."
+    assert tokenizer.run('') == ''
+
+    detokenizer = MosesDetokenizer()
+    assert detokenizer.run("It 's Mr. Smith 's car .") == "It's Mr. Smith's car."
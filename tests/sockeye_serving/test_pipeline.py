@@ -0,0 +1,34 @@
+import pytest
+
+from sockeye_serving.pipeline import POOL_PROCESS, POOL_THREAD, POSTPROCESS, PREPROCESS, ProcessorPool
+from sockeye_serving.text_processor import DeBPE, TextProcessor
+
+
+@pytest.mark.parametrize('kind', [POOL_THREAD, POOL_PROCESS])
+def test_processor_pool(kind):
+    pool = ProcessorPool(TextProcessor(), DeBPE(), workers=2, kind=kind)
+    try:
+        pre = pool.submit(PREPROCESS, ['a &amp; b', 'c\x07'])
+        post = pool.submit(POSTPROCESS, ['He@@ llo wor@@ ld'])
+        assert pre.result() == ['a & b', 'c']
+        assert post.result() == ['Hello world']
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.parametrize('kind', [POOL_THREAD, POOL_PROCESS])
+def test_cancel(kind):
+    pool = ProcessorPool(TextProcessor(), DeBPE(), workers=1, kind=kind)
+    try:
+        cancelled = [pool.submit(PREPROCESS, ['a &amp; b'] * 1000) for _ in range(4)]
+        for future in cancelled:
+            future.cancel()
+        # the pool still completes later batches
+        assert pool.submit(POSTPROCESS, ['He@@ llo']).result(timeout=10) == ['Hello']
+    finally:
+        pool.shutdown()
+
+
+def test_unknown_pool():
+    with pytest.raises(ValueError):
+        ProcessorPool(TextProcessor(), DeBPE(), workers=1, kind='fiber')
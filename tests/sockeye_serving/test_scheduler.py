@@ -0,0 +1,36 @@
+from sockeye_serving.scheduler import BatchScheduler
+
+
+def test_batches():
+    scheduler = BatchScheduler(3, [10, 20, 30])
+    assert scheduler.fill_up
+    assert list(scheduler.batches([5, 25, 12, 1, 7])) == [[1, 2, 4], [0, 3]]
+    assert scheduler.padded_tokens(2, 7) == 30
+    assert list(scheduler.batches([])) == []
+
+
+def test_token_budget():
+    scheduler = BatchScheduler(8, [10, 20, 30], token_budget=40)
+    assert not scheduler.fill_up
+    # two sentences of the 20 bucket fit into the budget, but only one of the 30 bucket
+    assert list(scheduler.batches([25, 15, 18, 3, 2, 12])) == [[0], [2, 1], [5, 3], [4]]
+    assert scheduler.padded_tokens(2, 18) == 40
+    # a sentence longer than the budget gets a batch of its own
+    assert list(scheduler.batches([50, 51])) == [[1], [0]]
+
+
+def test_latency_target():
+    scheduler = BatchScheduler(4, [10], latency_target=100)
+    scheduler.observe(4, 250)
+    assert scheduler.batch_size == 2
+    scheduler.observe(2, 250)
+    scheduler.observe(1, 250)
+    assert scheduler.batch_size == 1
+
+    # only full batches that are fast enough increase the batch size
+    scheduler.observe(1, 90)
+    assert scheduler.batch_size == 1
+    for _ in range(5):
+        scheduler.observe(scheduler.batch_size, 10)
+    assert scheduler.batch_size == 4
+    assert list(scheduler.batches([1] * 6)) == [[0, 1, 2, 3], [4, 5]]
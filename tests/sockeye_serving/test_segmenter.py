@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+import sockeye_serving
+from sockeye_serving.segmenter import SentenceSplitter
+
+prefixes_path = os.path.join(os.path.dirname(sockeye_serving.__file__), 'scripts', 'nonbreaking_prefixes')
+
+
+@pytest.fixture
+def en_splitter():
+    return SentenceSplitter('en', prefixes_path)
+
+
+def test_split(en_splitter):
+    assert en_splitter.split('Hello world. This is Mr. Smith! Is it? "Yes." No. 5 is next.') == \
+           ['Hello world.', 'This is Mr. Smith!', 'Is it?', '"Yes."', 'No. 5 is next.']
+    assert en_splitter.split('He said so... Then he left.') == ['He said so...', 'Then he left.']
+    assert en_splitter.split('The U.S.A. Is big.') == ['The U.S.A. Is big.']
+    assert en_splitter.split('lower. case') == ['lower. case']
+    assert en_splitter.split('  ') == []
+
+
+def test_split_cjk():
+    splitter = SentenceSplitter('zh', prefixes_path)
+    assert splitter.split('我的世界。你好！好吗？') == ['我的世界。', '你好！', '好吗？']
+
+
+def test_split_paragraphs(en_splitter):
+    assert en_splitter.split_paragraphs('One. Two.\n\nThree.') == [['One.', 'Two.'], [], ['Three.']]
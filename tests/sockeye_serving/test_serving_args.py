@@ -0,0 +1,21 @@
+import pytest
+
+from sockeye_serving.serving_args import get_serving_args
+
+
+def test_decoding_profiles(tmpdir):
+    tmpdir.join('serving-args.txt').write('--decoding-profile fast:2\n--decoding-profile balanced:5\n'
+                                          '--downgrade-profile fast\n--downgrade-sentences 64\n')
+    args = get_serving_args(str(tmpdir))
+    assert args.decoding_profile == [('fast', 2), ('balanced', 5)]
+    assert args.downgrade_profile == 'fast'
+    assert args.downgrade_sentences == 64
+
+    assert get_serving_args(str(tmpdir.mkdir('empty'))).decoding_profile == []
+
+
+@pytest.mark.parametrize('profile', ['fast', 'fast:', ':2', 'fast:0', 'fast:two'])
+def test_invalid_decoding_profile(tmpdir, profile):
+    tmpdir.join('serving-args.txt').write(f'--decoding-profile {profile}')
+    with pytest.raises(SystemExit):
+        get_serving_args(str(tmpdir))
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from sockeye_serving import text_processor
+from sockeye_serving.text_processor import BpeEncoder, DeBPE, ProcessorChain, TextProcessor
+
+resources_path = os.path.join(os.path.dirname(__file__), 'resources')
+
+
+@pytest.fixture
+def my_processor():
+    return TextProcessor()
+
+
+def test_unescape(my_processor):
+    assert my_processor.unescape('no entities') == 'no entities'
+    assert my_processor.unescape('a &amp; b &lt; c') == 'a & b < c'
+    assert my_processor.unescape('a &amp;amp; b &amp; lt ; c') == 'a & b < c'
+    assert my_processor.unescape('&#38; & # x 26 ; &amp;#x26;') == '& & &'
+    assert my_processor.unescape('soft &shy; hy & s h y ;phen') == 'softhyphen'
+    assert my_processor.unescape('a&nbssp;b &osp;c') == 'a b  c'
+
+
+def test_remove_control_characters(my_processor):
+    assert my_processor.remove_control_characters('a\tb\x00c\u200bde\U000e0001f') == 'abcdef'
+    assert my_processor.remove_control_characters('héllo wörld') == 'héllo wörld'
+
+
+def test_run_batch(my_processor):
+    texts = ['a &amp; b', 'c\x07', 'a &amp; b', '']
+    assert my_processor.run_batch(texts) == [my_processor.run(t) for t in texts]
+
+
+def test_bpe_run_batch():
+    bpe = BpeEncoder(os.path.join(resources_path, 'bpe-codes.txt'))
+    with open(os.path.join(resources_path, 'moses-tokenized.txt'), encoding='utf-8') as f:
+        texts = f.read().splitlines() + ['', '  ', ' leading and trailing ']
+    assert bpe.run_batch(texts) == [bpe.run(t) for t in texts]
+
+    chain = ProcessorChain([bpe, DeBPE()])
+    assert chain.run_batch(texts) == [chain.run(t) for t in texts]
+
+
+def test_bpe_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(text_processor, '_bpe_pool', {})
+    bpe_codes = tmp_path / 'bpe-codes.txt'
+    bpe_codes.write_text(open(os.path.join(resources_path, 'bpe-codes.txt'), encoding='utf-8').read(),
+                         encoding='utf-8')
+    word_freqs = tmp_path / 'bpe-word-freqs.txt'
+    word_freqs.write_text('rare 1\nthe 100\nof 50\na 10\n', encoding='utf-8')
+
+    bpe = BpeEncoder(str(bpe_codes), cache_size=3, word_freqs_file=str(word_freqs))
+    assert bpe.stats() == {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 3, 'hit_rate': 0.0}
+
+    expected = bpe.bpe.process_line('the end of the')
+    assert bpe.run('the end of the') == expected
+    assert bpe.stats()['hits'] == 2
+    assert bpe.stats()['misses'] == 1
+
+    # encoders of the same codes share the cache, even if they are in another model directory
+    other = BpeEncoder(os.path.join(resources_path, 'bpe-codes.txt'))
+    assert other.cache is bpe.cache
+    assert other.run('the end of the') == expected
@@ -0,0 +1,46 @@
+import pytest
+
+from sockeye_serving.translation_memory import MinHasher, TranslationMemory, build_memory, read_pairs, repair
+
+PAIRS = [
+    ('your order 123 has shipped .', 'votre commande 123 a été expédiée .'),
+    ('the parcel for Alice is delayed .', 'le colis pour Alice est retardé .'),
+    ('thank you for your patience .', 'merci de votre patience .'),
+]
+
+
+@pytest.fixture
+def my_memory(tmp_path):
+    pairs = tmp_path / 'pairs.tsv'
+    pairs.write_text(''.join(f'{source}\t{target}\t0-0\n' for source, target in PAIRS), encoding='utf-8')
+    path = tmp_path / 'memory.tm'
+    path.write_bytes(build_memory(read_pairs([str(pairs)]), MinHasher()))
+    return TranslationMemory.load(str(path), max_entries=2, threshold=0.8)
+
+
+def test_lookup(my_memory):
+    assert len(my_memory) == 3
+    source, target, _, similarity = my_memory.lookup('your order 456 has shipped .'.split())
+    assert ' '.join(source) == PAIRS[0][0]
+    assert ' '.join(target) == PAIRS[0][1]
+    assert similarity == pytest.approx(5 / 6)
+    assert my_memory.lookup('your order 456 has been cancelled .'.split()) is None
+    assert my_memory.lookup('where is my parcel ?'.split()) is None
+
+
+def test_recent(my_memory):
+    for i in range(3):
+        my_memory.add(f'{i} new messages in your inbox'.split(), f'{i} nouveaux messages'.split(), -1.0)
+    assert len(my_memory) == 5
+    assert my_memory.lookup('7 new messages in your inbox'.split())[1] == '2 nouveaux messages'.split()
+    # the least recently used translation is forgotten
+    assert my_memory.lookup('0 new messages in your inbox'.split())[1] != '0 nouveaux messages'.split()
+
+
+def test_repair():
+    source, target = PAIRS[1][0].split(), PAIRS[1][1].split()
+    assert repair('the parcel for Bob is delayed .'.split(), source, target) == \
+        ('le colis pour Bob est retardé .'.split(), [['Bob']])
+    # the inserted word has no counterpart in the translation
+    assert repair('the parcel for Bob is delayed again .'.split(), source, target) == (None, [['Bob']])
+    assert repair('the box for Bob is delayed .'.split(), source, target) == (None, [['Bob']])
@@ -1,3 +1,5 @@
+import tracemalloc
+
 import pytest
 
 from sockeye_serving import utils
@@ -28,6 +30,13 @@ def test_decode_bytes(my_str, my_data):
     assert my_str == utils.decode_bytes(my_data)
 
 
+@pytest.mark.parametrize('data', [b'', b'\n', b'a\r\nb', b'a\xff\nb\xc3', b'\r\r\n\n', 'x\r\ny\nz\xfc\n'.encode('utf-8') * 5])
+def test_iter_lines(data):
+    expected = utils.decode_bytes(bytearray(data)).split('\n')
+    for block_size in [1, 2, 3, 1 << 20]:
+        assert list(utils.iter_lines(bytearray(data), block_size)) == expected
+
+
 def test_get_request(my_str):
     assert utils.get_request({'body': my_str}) == {'text': my_str}
 
@@ -45,6 +54,48 @@ def test_get_request(my_str):
     assert utils.get_request({'body': {'zzz': my_str}}) is None
 
 
+def test_get_request_texts(my_str):
+    body = {'texts': [my_str, {'text': 'abc', 'profile': 'fast'}, 5], 'constraints': ['def']}
+    assert utils.get_request({'body': body}) == [{'text': my_str, 'constraints': ['def']},
+                                                 {'text': 'abc', 'profile': 'fast', 'constraints': ['def']}, 5]
+    assert utils.get_request({'body': [my_str, {'text': 'abc'}]}) == [{'text': my_str}, {'text': 'abc'}]
+
+    lines = '{"text": "abc"}\n\n{"text": "def", "avoid": ["de"]}\n'
+    assert utils.get_request({'body': bytearray(lines, 'utf-8')}) == [{'text': 'abc'}, {'text': 'def', 'avoid': ['de']}]
+    assert utils.get_request({'body': lines}) == [{'text': 'abc'}, {'text': 'def', 'avoid': ['de']}]
+    # text and file uploads that are not JSON Lines
+    assert utils.get_request({'body': '{abc}'}) == {'text': '{abc}'}
+    assert utils.get_request({'body': bytearray(b'{abc}')}) is None
+
+
+def test_get_request_no_copy():
+    # a large file upload is neither copied nor decoded in full to find out whether it is JSON Lines
+    data = bytearray(b' \t\n') * 1000 + bytearray(b'x' * 1023 + b'\n') * (1 << 13)
+    lines = bytearray(b' {"text": "abc"}\n') + data
+    tracemalloc.start()
+    try:
+        assert utils.get_request({'body': data}) is None
+        assert utils.get_request({'body': lines}) is None
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < len(data) // 2
+
+
+def test_encode_responses():
+    class Context:
+        content_types = {}
+
+        def set_response_content_type(self, idx, value):
+            self.content_types[idx] = value
+
+    context = Context()
+    responses = utils.encode_responses([{'translation': '안녕', 'score': 0.5}, 'Unknown decoding profile x'], context)
+    assert responses == ['{"translation":"안녕","score":0.5}'.encode('utf-8'), 'Unknown decoding profile x']
+    assert context.content_types == {0: utils.JSON_CONTENT_TYPE}
+    assert utils.encode_responses(None, context) is None
+
+
 def test_get_file_data(my_str, my_data):
     assert utils.get_file_data({'body': my_data}) == my_data
     assert utils.get_file_data({'file': my_data}) == my_data
@@ -0,0 +1,45 @@
+import pytest
+
+from sockeye_serving.ko_handler import KoreanHandler
+from sockeye_serving.word_segmenter import CJK_CHARACTERS, MAX_MATCH, WordSegmenter, WordTrie, build_trie, \
+    read_dictionary
+from sockeye_serving.zh_handler import ChineseHandler
+
+
+@pytest.fixture
+def my_trie(tmp_path):
+    path = tmp_path / 'dict.txt'
+    path.write_text('中国 10 ns\n中国人 3 n\n人民 8 n\n我 20 r\n是 20 v\n', encoding='utf-8')
+    trie = tmp_path / 'words.trie'
+    trie.write_bytes(build_trie(read_dictionary(str(path))))
+    return WordTrie.load(str(trie))
+
+
+def test_prefixes(my_trie):
+    assert [end for end, _ in my_trie.prefixes('中国人民', 0)] == [2, 3]
+    assert [end for end, _ in my_trie.prefixes('中国人民', 2)] == [4]
+    assert list(my_trie.prefixes('中国人民', 3)) == []
+    assert my_trie.max_len == 3
+
+
+def test_segment(my_trie):
+    segmenter = WordSegmenter(my_trie)
+    assert segmenter.segment('我是中国人民') == ['我', '是', '中国', '人民']
+    assert WordSegmenter(my_trie, MAX_MATCH).segment('我是中国人民') == ['我', '是', '中国人', '民']
+    # unknown characters are words of their own
+    assert segmenter.segment('他是中国人') == ['他', '是', '中国人']
+    assert segmenter.sub(CJK_CHARACTERS, 'Hi 我是中国人民。') == 'Hi 我 是 中国 人民 。'
+    assert segmenter.sub(CJK_CHARACTERS, '我是Hi中国人 ok') == '我 是 Hi 中国人 ok'
+
+    with pytest.raises(ValueError):
+        WordTrie(b'\0' * 64)
+
+
+def test_estimate_tokens(my_trie):
+    assert KoreanHandler().estimate_tokens('안녕 hi') == 3
+    handler = ChineseHandler()
+    assert handler.estimate_tokens('我是中国人民 hi') == 7
+    # with a dictionary, words are estimated from the characters without segmenting them
+    handler.word_segmenter = WordSegmenter(my_trie)
+    handler.word_segmenter.segment = None
+    assert handler.estimate_tokens('我是中国人民 hi') == 5